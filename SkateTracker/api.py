@@ -0,0 +1,288 @@
+"""
+Non-interactive API for batch analysis of races in scripts and notebooks. Every function works on many races at once,
+given as 2-D (n_results, nr_laps) or 3-D (n_races, n_athletes, nr_laps) Numpy arrays of lap times. Like everywhere in
+SkateTracker, the lap times are int32 centiseconds and laps that were not skated are MISSING.
+
+    >>> from SkateTracker import api
+    >>> archive = api.load_archive("F", 1500)
+    >>> race_names, race_times = archive.races()
+    >>> model = api.fit_model(archive.times)
+    >>> prediction = api.predict(model, race_times, laps_done=2)
+    >>> openers = archive.splits.passage_times([100, 300], archive.length)
+"""
+import numpy as np
+
+from typing import List, Optional, Union
+
+from rich.layout import Layout
+
+try:
+    from SkateTracker.layout import make_race_layout
+    from SkateTracker.predict import LapRatioModel, PredictionInterval
+    from SkateTracker.splits import SplitTimes, load_splits
+    from SkateTracker.utils import (MISSING, TIME_DTYPE, archive_paths, load_race_ids, load_results, missing_times,
+                                    number_of_laps, parse_results_fname, total_times)
+except ModuleNotFoundError:
+    from layout import make_race_layout
+    from predict import LapRatioModel, PredictionInterval
+    from splits import SplitTimes, load_splits
+    from utils import (MISSING, TIME_DTYPE, archive_paths, load_race_ids, load_results, missing_times,
+                       number_of_laps, parse_results_fname, total_times)
+
+
+class Archive:
+    """All saved results of a gender and length, one row per result.
+
+    :ivar str gender: string indicating if the races are for Men or Women.
+    :ivar int length: integer indicating the length of the races.
+    :ivar np.array names: Numpy array with the name of the athlete of every result.
+    :ivar np.array tournaments: Numpy array with the tournament of every result.
+    :ivar np.array race_ids: Numpy array with the race of every result, unique over all tournaments.
+    :ivar np.array times: Numpy array with the lap times in centiseconds, shape=(n_results, nr_laps)
+    :ivar SplitTimes splits: the sectional splits of every result. Results that were timed per lap have the splits of
+     their lap times.
+    """
+    def __init__(
+            self,
+            gender: str,
+            length: int,
+            names: np.array,
+            tournaments: np.array,
+            race_ids: np.array,
+            times: np.array,
+            splits: SplitTimes):
+        self.gender = gender
+        self.length = length
+        self.names = names
+        self.tournaments = tournaments
+        self.race_ids = race_ids
+        self.times = times
+        self.splits = splits
+
+    def __len__(self) -> int:
+        return self.times.shape[0]
+
+    def races(self) -> (np.array, np.array):
+        """Groups the results per race, see group_races."""
+        return group_races(self.names, self.times, self.race_ids)
+
+
+def load_archive(gender: str, length: int, tournaments: Optional[List[str]] = None) -> Archive:
+    """Loads the saved results of a gender and length from all tournaments in the skate_data folder.
+
+    :param str gender: string indicating if the races are for Men or Women. Accepted values are ["M", "F"]
+    :param int length: integer indicating the length of the races. Accepted values are
+     [500, 1000, 1500, 3000, 5000, 10000]
+
+    :param (List[str], None) tournaments: If given, only the results of these tournaments are loaded.
+    :return Archive: the results of all loaded files
+    """
+    nr_laps = number_of_laps(length)
+    names, file_tournaments, race_ids, times, splits = [], [], [], [], []
+    next_race = 0
+    for fname in archive_paths(gender, length):
+        tournament, _, _ = parse_results_fname(fname)
+        if tournaments is not None and tournament not in tournaments:
+            continue
+        file_names, results = load_results(tournament, fname=fname)
+        if results.shape[1] != nr_laps or not file_names:
+            continue
+
+        # The race ids of a file start at 0, so they are shifted to keep the races of different files apart
+        file_race_ids = load_race_ids(fname, len(file_names)) + next_race
+        next_race = int(file_race_ids.max()) + 1
+        names.extend(file_names)
+        file_tournaments.extend([tournament] * len(file_names))
+        race_ids.append(file_race_ids)
+        times.append(results)
+        splits.append(load_splits(fname, results, length, file_names))
+
+    return Archive(
+        gender,
+        length,
+        np.array(names, dtype=str),
+        np.array(file_tournaments, dtype=str),
+        np.concatenate(race_ids) if race_ids else np.zeros(0, dtype=np.int64),
+        np.vstack(times) if times else missing_times((0, nr_laps)),
+        SplitTimes.concatenate(splits) if splits else SplitTimes()
+    )
+
+
+def group_races(names: np.array, times: np.array, race_ids: np.array) -> (np.array, np.array):
+    """Groups results per race into a padded 3-D array. Races with fewer athletes than the largest race are padded
+     with an empty name and MISSING lap times.
+
+    :param np.array names: Numpy array with the name of the athlete of every result.
+    :param np.array times: Numpy array with the lap times, shape=(n_results, nr_laps)
+    :param np.array race_ids: Numpy array with the race of every result.
+    :return (np.array, np.array): the names, shape=(n_races, n_athletes), and the lap times,
+     shape=(n_races, n_athletes, nr_laps), of the races in the order they were skated
+    """
+    names = np.asarray(names, dtype=object)
+    times = np.asarray(times)
+    if names.shape[0] == 0:
+        return np.zeros((0, 0), dtype=object), missing_times((0, 0, times.shape[1]))
+
+    _, first, inverse = np.unique(race_ids, return_index=True, return_inverse=True)
+    race = np.argsort(np.argsort(first))[inverse.reshape(-1)]
+    order = np.argsort(race, kind="stable")
+    counts = np.bincount(race)
+    # Position of every result within its race, keeping the order in which the athletes were entered
+    position = np.arange(order.shape[0]) - np.repeat(np.cumsum(counts) - counts, counts)
+
+    race_names = np.full((counts.shape[0], counts.max()), "", dtype=object)
+    race_times = missing_times((counts.shape[0], counts.max(), times.shape[1]))
+    race_names[race[order], position] = names[order]
+    race_times[race[order], position] = times[order]
+    return race_names, race_times
+
+
+def final_times(times: np.array) -> np.array:
+    """Gives the exact final time of every result. Results in which not all laps were skated get MISSING.
+
+    :param np.array times: Numpy array with the lap times, shape=(..., nr_laps)
+    :return np.array: Numpy array with the final times in centiseconds, shape=(...)
+    """
+    times = np.asarray(times)
+    return np.where(np.all(times != MISSING, axis=-1), total_times(times), MISSING)
+
+
+def best_tables(times: np.array, k: int = 3) -> (np.array, np.array):
+    """Selects the k fastest results of every table in a batch at once, like the best results table of the tracker.
+     Results that are not skated (all MISSING) are placed last.
+
+    :param np.array times: Numpy array with the lap times, shape=(..., n_results, nr_laps). A 2-D array is a single
+     table, a 3-D array a batch of tables, for example the races of group_races.
+
+    :param int k: the number of results to select per table.
+    :return (np.array, np.array): the index of the k best results in every table, shape=(..., k), and their lap
+     times, shape=(..., k, nr_laps), fastest first
+    """
+    times = np.asarray(times)
+    totals = np.where(np.any(times != MISSING, axis=-1), total_times(times), np.iinfo(np.int64).max)
+    k = min(k, totals.shape[-1])
+    if k < totals.shape[-1]:
+        index = np.argpartition(totals, k - 1, axis=-1)[..., :k]
+    else:
+        index = np.broadcast_to(np.arange(totals.shape[-1]), totals.shape)
+    index = np.take_along_axis(index, np.argsort(np.take_along_axis(totals, index, axis=-1), axis=-1), axis=-1)
+    return index, np.take_along_axis(times, index[..., None], axis=-2)
+
+
+def fit_model(times: np.array, min_races: int = 10, seed: Optional[int] = None) -> LapRatioModel:
+    """Creates the prediction model of the tracker from historical lap times.
+
+    :param np.array times: Numpy array with the historical lap times, shape=(..., nr_laps)
+    :param int min_races: the minimum number of historical races before predictions are made.
+    :param (int, None) seed: seed of the random generator, for reproducible simulations.
+    :return LapRatioModel: the model
+    """
+    times = np.asarray(times)
+    model = LapRatioModel(times.shape[-1], min_races=min_races, seed=seed)
+    model.add(times.reshape(-1, times.shape[-1]))
+    return model
+
+
+def predict(
+        model: LapRatioModel,
+        times: np.array,
+        laps_done: Union[int, np.array],
+        n_samples: int = 2000) -> Optional[PredictionInterval]:
+    """Predicts the final times of a batch of results, as the tracker does after laps_done laps. Only the first
+     laps_done laps are used, so complete historical races can be given to backtest the predictions.
+
+    :param LapRatioModel model: the prediction model, see fit_model.
+    :param np.array times: Numpy array with the lap times, shape=(..., nr_laps)
+    :param (int, np.array) laps_done: number of laps that have been skated, for all results or per result. For a 3-D
+     array of races it may also be given per race, shape=(n_races,)
+
+    :param int n_samples: number of simulated trajectories per result.
+    :return (PredictionInterval, None): the prediction intervals with final, shape=(..., 3), band,
+     shape=(..., 3, nr_laps), and laps_done, shape=(...), in seconds. Results that were not skated get NaN. None if
+     the model has too few historical races
+    """
+    if model.totals.shape[0] < model.min_races:
+        return None
+
+    times = np.asarray(times)
+    batch_shape, nr_laps = times.shape[:-1], times.shape[-1]
+    laps_done = np.asarray(laps_done)
+    if times.ndim == 3 and laps_done.ndim == 1:
+        laps_done = laps_done[:, None]
+    laps_done = np.broadcast_to(laps_done, batch_shape).reshape(-1)
+    times = times.reshape(-1, nr_laps)
+
+    final = np.full((times.shape[0], 3), np.nan)
+    band = np.full((times.shape[0], 3, nr_laps), np.nan)
+    # One simulation per number of skated laps instead of one per race. The results are simulated in chunks of about
+    # 2^22 simulated laps, which keeps the temporary arrays small enough to stay fast
+    for laps in np.unique(laps_done[laps_done > 0]):
+        rows = np.flatnonzero((laps_done == laps) & np.all(times[:, :laps] != MISSING, axis=1))
+        chunk_size = max(1, 2 ** 22 // (n_samples * max(1, nr_laps - laps)))
+        for chunk in np.split(rows, np.arange(chunk_size, rows.shape[0], chunk_size)):
+            prediction = model.simulate(times[chunk], int(laps), n_samples)
+            final[chunk], band[chunk] = prediction.final, prediction.band
+
+    return PredictionInterval(
+        final.reshape(batch_shape + (3,)),
+        band.reshape(batch_shape + (3, nr_laps)),
+        laps_done.reshape(batch_shape)
+    )
+
+
+def render_race_views(
+        gender: str,
+        length: int,
+        race_names: np.array,
+        race_times: np.array,
+        best_names: List[str],
+        best_times: np.array,
+        laps_done: Optional[Union[int, np.array]] = None,
+        prediction: Optional[PredictionInterval] = None,
+        chart: str = "plotext") -> List[Layout]:
+    """Creates the race screen of the tracker for a batch of races. The screens are rich.Layout objects, which can
+     be shown with rich.print, also in a notebook.
+
+    :param str gender: string indicating if the races are for Men or Women. Accepted values are ["M", "F"]
+    :param int length: integer indicating the length of the races.
+    :param np.array race_names: Numpy array with the names of the athletes, shape=(n_races, n_athletes). Empty names
+     are padding and are left out.
+
+    :param np.array race_times: Numpy array with the lap times, shape=(n_races, n_athletes, nr_laps)
+    :param List[str] best_names: List of strings with the names of the best athletes, shown in every screen.
+    :param np.array best_times: Numpy array with the best times, shape=(3, nr_laps)
+    :param (int, np.array, None) laps_done: number of laps shown, for all races or per race. All laps if None.
+    :param (PredictionInterval, None) prediction: If given, the prediction of predict for the same races.
+    :param str chart: the backend that draws the charts, "plotext" or "native".
+    :return List[rich.Layout]: the screen of every race
+    """
+    # main creates the race view, importing it here keeps this module importable without the tracker
+    try:
+        from SkateTracker.main import create_race_view
+    except ModuleNotFoundError:
+        from main import create_race_view
+
+    race_names = np.atleast_2d(np.asarray(race_names, dtype=object))
+    race_times = np.asarray(race_times, dtype=TIME_DTYPE).reshape(race_names.shape + (-1,))
+    nr_laps = race_times.shape[-1]
+    laps_done = np.broadcast_to(nr_laps if laps_done is None else laps_done, race_names.shape[:1])
+
+    layouts = []
+    for i, (names, times, laps) in enumerate(zip(race_names, race_times, laps_done)):
+        athletes = np.flatnonzero(names != "")
+        times = times[athletes].copy()
+        times[:, laps:] = MISSING
+
+        race_prediction = None
+        if prediction is not None and 0 < laps < nr_laps and not np.isnan(prediction.final[i, athletes]).any():
+            race_prediction = PredictionInterval(
+                prediction.final[i, athletes], prediction.band[i, athletes], int(laps)
+            )
+
+        race_layout = make_race_layout()
+        create_race_view(gender, length, list(names[athletes]), times, nr_laps, best_names, best_times, race_layout,
+                         first=True, prediction=race_prediction, chart=chart)
+        race_progress = race_layout["progress"].renderable.renderable.renderable
+        race_progress.update(race_progress.task_ids[0], completed=int(laps))
+        layouts.append(race_layout)
+    return layouts
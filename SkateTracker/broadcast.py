@@ -0,0 +1,259 @@
+"""
+Broadcasting of the race that is being tracked to read-only viewers on the same machine. The tracker owns the race
+state and sends a compact message per lap over a Unix domain socket, every viewer renders the race view itself.
+"""
+import json
+import os
+import selectors
+import socket
+import stat
+import threading
+import time
+
+import numpy as np
+
+from typing import List, Optional
+
+from rich.console import Console
+
+try:
+    from SkateTracker.layout import make_race_layout
+    from SkateTracker.predict import PredictionInterval
+    from SkateTracker.utils import TIME_DTYPE, missing_times
+except ModuleNotFoundError:
+    from layout import make_race_layout
+    from predict import PredictionInterval
+    from utils import TIME_DTYPE, missing_times
+
+
+class RaceBroadcaster:
+    """Server side of the broadcast. Viewers can connect at any moment, a viewer that connects during a race first
+     receives the messages of the race so far. Every message is encoded once and added to the buffer of every viewer,
+     a writer thread sends the buffers over non-blocking sockets. The tracker never waits on a viewer, and a viewer
+     that stops reading is dropped once its buffer is full.
+    """
+    def __init__(self, socket_path: str, max_buffer: int = 2 ** 20):
+        """Initialize and start accepting viewers
+
+        :param str socket_path: path of the Unix domain socket. An old socket at this path is replaced, any other file
+         is left alone.
+
+        :param int max_buffer: the number of bytes that may be waiting for a single viewer.
+        """
+        if not hasattr(socket, "AF_UNIX"):
+            raise OSError("ERROR: broadcasting needs Unix domain sockets, which are not available on this system")
+        if os.path.lexists(socket_path):
+            if not stat.S_ISSOCK(os.lstat(socket_path).st_mode):
+                raise FileExistsError(f"ERROR: {socket_path} already exists and is not a socket, choose another path")
+            os.remove(socket_path)
+
+        self.socket_path = socket_path
+        self.max_buffer = max_buffer
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(socket_path)
+        self.server.listen()
+        self.server.setblocking(False)
+        # The tracker wakes the writer thread up through this pair of sockets
+        self.wakeup_recv, self.wakeup_send = socket.socketpair()
+        self.wakeup_recv.setblocking(False)
+        self.wakeup_send.setblocking(False)
+        self.buffers = {}
+        self.dropped = []
+        self.history = []
+        self.closed = False
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._write, daemon=True)
+        self.thread.start()
+
+    def _wakeup(self):
+        try:
+            self.wakeup_send.send(b"\0")
+        except (BlockingIOError, OSError):
+            # A full wakeup socket already wakes the writer thread up
+            pass
+
+    def _drop(self, client: socket.socket):
+        # The socket is closed by the writer thread, which may be waiting on it
+        self.buffers.pop(client, None)
+        self.dropped.append(client)
+
+    def _write(self):
+        selector = selectors.DefaultSelector()
+        selector.register(self.server, selectors.EVENT_READ)
+        selector.register(self.wakeup_recv, selectors.EVENT_READ)
+        while True:
+            with self.lock:
+                if self.closed:
+                    break
+                waiting = [client for client, buffer in self.buffers.items() if buffer]
+                for client in waiting:
+                    selector.register(client, selectors.EVENT_WRITE)
+
+            for key, _ in selector.select():
+                if key.fileobj is self.wakeup_recv:
+                    try:
+                        self.wakeup_recv.recv(4096)
+                    except BlockingIOError:
+                        pass
+                elif key.fileobj is self.server:
+                    try:
+                        client, _ = self.server.accept()
+                    except OSError:
+                        continue
+                    client.setblocking(False)
+                    with self.lock:
+                        self.buffers[client] = bytearray(b"".join(self.history))
+                else:
+                    client = key.fileobj
+                    with self.lock:
+                        buffer = self.buffers.get(client)
+                        if not buffer:
+                            continue
+                        try:
+                            del buffer[:client.send(buffer)]
+                        except BlockingIOError:
+                            pass
+                        except OSError:
+                            self._drop(client)
+
+            with self.lock:
+                for client in waiting:
+                    selector.unregister(client)
+                for client in self.dropped:
+                    client.close()
+                self.dropped = []
+        selector.close()
+
+    def _send(self, message: dict, reset: bool = False):
+        data = (json.dumps(message, separators=(",", ":")) + "\n").encode()
+        with self.lock:
+            if reset:
+                self.history = []
+            self.history.append(data)
+            for client, buffer in list(self.buffers.items()):
+                if len(buffer) + len(data) > self.max_buffer:
+                    # A viewer that stopped reading is dropped, the tracker never waits on it
+                    self._drop(client)
+                else:
+                    buffer += data
+        self._wakeup()
+
+    def start_race(
+            self,
+            gender: str,
+            length: int,
+            names: List[str],
+            nr_laps: int,
+            best_names: List[str],
+            best_times: np.array):
+        """Sends the start of a race, which resets the state of all viewers."""
+        self._send({
+            "type": "race", "gender": gender, "length": length, "names": names, "nr_laps": nr_laps,
+            "best_names": list(best_names), "best_times": np.asarray(best_times).tolist()
+        }, reset=True)
+
+    def lap(self, lap: int, lap_times: np.array, prediction: Optional[PredictionInterval] = None):
+        """Sends the lap times of a single lap in centiseconds, and the predictions made after it."""
+        message = {"type": "lap", "lap": lap, "times": np.asarray(lap_times).tolist()}
+        if prediction is not None:
+            message["band"] = np.round(prediction.band, 2).tolist()
+        self._send(message)
+
+    def best(self, best_names: List[str], best_times: np.array):
+        """Sends the best times after a race is finished."""
+        self._send({"type": "best", "best_names": list(best_names), "best_times": np.asarray(best_times).tolist()})
+
+    def close(self, timeout: float = 1.0):
+        """Stops the writer thread, after the viewers received the last messages or at most timeout seconds."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self.lock:
+                if not any(self.buffers.values()):
+                    break
+            time.sleep(0.01)
+        with self.lock:
+            self.closed = True
+        self._wakeup()
+        self.thread.join()
+        for client in list(self.buffers) + self.dropped:
+            client.close()
+        self.buffers = {}
+        self.dropped = []
+        self.server.close()
+        self.wakeup_recv.close()
+        self.wakeup_send.close()
+        if os.path.lexists(self.socket_path) and stat.S_ISSOCK(os.lstat(self.socket_path).st_mode):
+            os.remove(self.socket_path)
+
+
+class RaceViewer:
+    """State of a viewer, rebuilt from the messages of the broadcaster."""
+    def __init__(self, chart: str = "plotext"):
+        self.chart = chart
+        self.race = None
+        self.times = None
+        self.laps_done = 0
+        self.prediction = None
+
+    def apply(self, message: dict):
+        """Updates the state with a single message."""
+        if message["type"] == "race":
+            self.race = message
+            self.times = missing_times((len(message["names"]), message["nr_laps"]))
+            self.laps_done = 0
+            self.prediction = None
+        elif message["type"] == "lap" and self.race is not None:
+            self.times[:, message["lap"]] = message["times"]
+            self.laps_done = message["lap"] + 1
+            band = np.array(message["band"]) if "band" in message else None
+            self.prediction = PredictionInterval(band[:, :, -1], band, self.laps_done) if band is not None else None
+        elif message["type"] == "best" and self.race is not None:
+            self.race["best_names"] = message["best_names"]
+            self.race["best_times"] = message["best_times"]
+            self.prediction = None
+
+    def render(self, console: Console):
+        """Renders the race view of the current state."""
+        # main imports this module for the broadcaster, so the race view is imported when it is needed
+        try:
+            from SkateTracker.main import create_race_view
+        except ModuleNotFoundError:
+            from main import create_race_view
+
+        race = self.race
+        race_layout = make_race_layout()
+        create_race_view(
+            race["gender"],
+            race["length"],
+            race["names"],
+            self.times,
+            race["nr_laps"],
+            race["best_names"],
+            np.array(race["best_times"], dtype=TIME_DTYPE),
+            race_layout,
+            first=True,
+            prediction=self.prediction,
+            chart=self.chart
+        )
+        race_progress = race_layout["progress"].renderable.renderable.renderable
+        race_progress.update(race_progress.task_ids[0], completed=self.laps_done)
+        console.clear()
+        console.print(race_layout)
+
+
+def view(socket_path: str, chart: str = "plotext"):
+    """Connects to a broadcasting tracker and shows the race view after every message, until the tracker stops.
+
+    :param str socket_path: path of the Unix domain socket of the tracker.
+    :param str chart: the backend that draws the charts, "plotext" or "native".
+    """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(socket_path)
+    viewer = RaceViewer(chart)
+    console = Console()
+    with client, client.makefile("r") as messages:
+        console.print(f"Connected to {socket_path}, waiting for the next race...")
+        for line in messages:
+            viewer.apply(json.loads(line))
+            if viewer.race is not None:
+                viewer.render(console)
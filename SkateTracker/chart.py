@@ -0,0 +1,263 @@
+"""
+Native race charts, drawn with braille characters straight into rich segments. An alternative for the plotext charts
+that keeps no global state, so charts can be drawn from several threads at once.
+"""
+import numpy as np
+
+from typing import List, Optional
+
+from rich.console import Console, ConsoleOptions, RenderResult
+from rich.layout import Layout
+from rich.panel import Panel
+from rich.segment import Segment
+from rich.style import Style
+
+try:
+    from SkateTracker.predict import PredictionInterval
+    from SkateTracker.splits import passage_labels
+    from SkateTracker.utils import MISSING
+except ModuleNotFoundError:
+    from predict import PredictionInterval
+    from splits import passage_labels
+    from utils import MISSING
+
+CHART_BACKENDS = ("plotext", "native")
+# Bit of every dot of a braille character, by the row and column of the dot in the 4x2 dots of a character
+BRAILLE_DOTS = np.array([[0x01, 0x08], [0x02, 0x10], [0x04, 0x20], [0x40, 0x80]], dtype=np.uint32)
+BRAILLE_BLANK = 0x2800
+
+
+class BrailleCanvas:
+    """Grid of characters of 2x4 braille dots each, on which lines are drawn in data coordinates. Every character
+     gets the color of the last line that was drawn through it.
+    """
+    def __init__(self, width: int, height: int, x_range: tuple, y_range: tuple):
+        """Initialize
+
+        :param int width: width of the canvas in characters.
+        :param int height: height of the canvas in characters.
+        :param tuple x_range: the x values at the left and right edge of the canvas.
+        :param tuple y_range: the y values at the bottom and top edge of the canvas.
+        """
+        self.width = width
+        self.height = height
+        self.x_range = x_range
+        self.y_range = y_range
+        self.dots = np.zeros((4 * height, 2 * width), dtype=bool)
+        self.colors = np.full((height, width), -1, dtype=np.int16)
+        self.styles = []
+
+    def to_dots(self, x: np.array, y: np.array) -> (np.array, np.array):
+        """Converts data coordinates to (fractional) dot columns and rows."""
+        (x0, x1), (y0, y1) = self.x_range, self.y_range
+        columns = (x - x0) / max(x1 - x0, 1e-9) * (2 * self.width - 1)
+        rows = (y1 - y) / max(y1 - y0, 1e-9) * (4 * self.height - 1)
+        return columns, rows
+
+    def line(self, x: np.array, y: np.array, style: Style, dotted: bool = False):
+        """Draws the line through the points (x, y). Every segment is sampled at one point per dot, all at once.
+
+        :param np.array x: x values of the points.
+        :param np.array y: y values of the points.
+        :param rich.Style style: style of the characters of the line.
+        :param bool dotted: if True, only every third dot of the line is drawn.
+        """
+        columns, rows = self.to_dots(np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64))
+        if columns.shape[0] > 1:
+            d_columns, d_rows = np.diff(columns), np.diff(rows)
+            steps = np.ceil(np.maximum(np.abs(d_columns), np.abs(d_rows))).astype(np.int64) + 1
+            segment = np.repeat(np.arange(steps.shape[0]), steps)
+            t = (np.arange(steps.sum()) - np.repeat(np.cumsum(steps) - steps, steps)) / \
+                np.repeat(np.maximum(steps - 1, 1), steps)
+            columns = columns[segment] + t * d_columns[segment]
+            rows = rows[segment] + t * d_rows[segment]
+            if dotted:
+                columns, rows = columns[::3], rows[::3]
+
+        columns, rows = np.rint(columns).astype(np.int64), np.rint(rows).astype(np.int64)
+        inside = (columns >= 0) & (columns < 2 * self.width) & (rows >= 0) & (rows < 4 * self.height)
+        columns, rows = columns[inside], rows[inside]
+        self.dots[rows, columns] = True
+        self.colors[rows // 4, columns // 2] = len(self.styles)
+        self.styles.append(style)
+
+    def rows(self) -> List[List[Segment]]:
+        """Gives the segments of every row of characters, neighbouring characters of the same color are joined."""
+        cells = self.dots.reshape(self.height, 4, self.width, 2)
+        codes = np.einsum("ijkl,jl->ik", cells.astype(np.uint32), BRAILLE_DOTS)
+        codes = np.where(codes > 0, codes + BRAILLE_BLANK, ord(" ")).astype("<u4")
+
+        rows = []
+        for codes_row, colors_row in zip(codes, self.colors):
+            text = codes_row.tobytes().decode("utf-32-le")
+            starts = np.concatenate(([0], np.flatnonzero(np.diff(colors_row)) + 1, [self.width]))
+            rows.append([
+                Segment(text[start:end], self.styles[colors_row[start]] if colors_row[start] >= 0 else None)
+                for start, end in zip(starts[:-1], starts[1:])
+            ])
+        return rows
+
+
+class LineChart:
+    """Chart with a title, a y-axis with ticks, and x-axis ticks labelled with the passages of the laps."""
+    def __init__(
+            self,
+            title: List[Segment],
+            x_labels: List[str],
+            y_range: tuple,
+            lines: List[tuple]):
+        """Initialize
+
+        :param List[Segment] title: the title, as segments so the names can have the colors of their lines.
+        :param List[str] x_labels: label of every lap, the x values are 1 to the number of laps.
+        :param tuple y_range: the y values at the bottom and top of the chart.
+        :param List[tuple] lines: the lines, as tuples of the x values, y values, style and if the line is dotted.
+        """
+        self.title = title
+        self.x_labels = x_labels
+        self.y_range = y_range
+        self.lines = lines
+
+    def render_lines(self, width: int, height: int) -> List[List[Segment]]:
+        """Renders the chart into height rows of segments, each width characters wide."""
+        title_length = sum(len(segment.text) for segment in self.title)
+        title = [Segment(" " * max((width - title_length) // 2, 0))] + self.title
+        plot_height = height - 4
+        y0, y1 = self.y_range
+        n_ticks = min(5, plot_height)
+        y_ticks = np.linspace(y1, y0, n_ticks) if n_ticks > 1 else np.array([y1])
+        y_labels = [f"{tick:.1f}" for tick in y_ticks]
+        label_width = max(len(label) for label in y_labels)
+        plot_width = width - label_width - 2
+        if plot_height < 1 or plot_width < 2:
+            return [title] + [[]] * (height - 1)
+
+        nr_laps = len(self.x_labels)
+        canvas = BrailleCanvas(plot_width, plot_height, (1, max(nr_laps, 2)), self.y_range)
+        for x, y, style, dotted in self.lines:
+            canvas.line(x, y, style, dotted)
+
+        tick_rows = {
+            int(np.rint((y1 - tick) / max(y1 - y0, 1e-9) * (plot_height - 1))): label
+            for tick, label in zip(y_ticks, y_labels)
+        }
+        margin = " " * label_width
+        rows = [title, [Segment(f"{margin}┌{'─' * plot_width}┐")]]
+        for row, segments in enumerate(canvas.rows()):
+            axis = f"{tick_rows[row].rjust(label_width)}┤" if row in tick_rows else f"{margin}│"
+            rows.append([Segment(axis)] + segments + [Segment("│")])
+
+        tick_columns, _ = canvas.to_dots(np.arange(1, nr_laps + 1), np.zeros(nr_laps))
+        tick_columns = np.rint(tick_columns).astype(np.int64) // 2
+        bottom = np.full(plot_width, "─")
+        bottom[tick_columns] = "┬"
+        rows.append([Segment(f"{margin}└{''.join(bottom)}┘")])
+
+        # The labels are centered below their tick, a label that would overlap the previous one is left out
+        labels = ""
+        for column, label in zip(tick_columns + label_width + 1, self.x_labels):
+            start = min(max(column - len(label) // 2, len(labels) + 1 if labels else 0), width - len(label))
+            if start >= len(labels) + (1 if labels else 0):
+                labels = labels.ljust(start) + label
+        rows.append([Segment(labels)])
+        return rows
+
+
+class RaceChart:
+    """The charts of the total times and the lap times of a race, as a rich renderable. The charts are drawn every
+     time they are rendered, so they fill the space that the layout gives them.
+    """
+    def __init__(
+            self,
+            gender: str,
+            length: int,
+            names: List[str],
+            lap_times: np.array,
+            prediction: Optional[PredictionInterval] = None):
+        """Initialize
+
+        :param str gender: string indicating if the race is for Men or Women. Accepted values are ["M", "F"]
+        :param int length: integer indicating the length of the race. Accepted values are
+         [500, 1000, 1500, 3000, 5000, 10000]
+
+        :param List[str] names: List of strings with the names of the athletes.
+        :param np.array lap_times:  Numpy array with the lap times so far in centiseconds.
+        :param (PredictionInterval, None) prediction: prediction intervals that are drawn as a dotted band.
+        """
+        self.gender = gender
+        self.length = length
+        self.names = names
+        self.lap_times = lap_times
+        self.prediction = prediction
+
+    def charts(self) -> (LineChart, LineChart):
+        """Creates the chart of the total times and the chart of the lap times."""
+        styles = (Style(color="red"), Style(color="blue"))
+        gender_name = "Men" if self.gender == "M" else "Women"
+        nr_laps = self.lap_times.shape[1]
+        labels = passage_labels(self.length)
+        labels = labels if len(labels) == nr_laps else [str(lap) for lap in range(1, nr_laps + 1)]
+
+        # The charts are in seconds, laps that were not skated are left out
+        skated = self.lap_times != MISSING
+        lap_times = np.where(skated, self.lap_times / 100, 0)
+        total_times = np.cumsum(lap_times, axis=1)
+        laps = np.arange(1, nr_laps + 1)
+
+        names = []
+        for i, name in enumerate(self.names):
+            names += [Segment(" vs ")] if i > 0 else []
+            names.append(Segment(name, styles[i]))
+
+        totals, lap_lines = [], []
+        for i in range(len(self.names)):
+            totals.append((laps[skated[i]], total_times[i, skated[i]], styles[i], False))
+            lap_lines.append((laps[skated[i]], lap_times[i, skated[i]], styles[i], False))
+        prediction = self.prediction
+        if prediction is not None and prediction.laps_done < nr_laps:
+            band_laps = np.arange(prediction.laps_done, nr_laps + 1)
+            for i in range(len(self.names)):
+                for quantile in (0, 2):
+                    band = prediction.band[i, quantile, prediction.laps_done - 1:]
+                    totals.append((band_laps, band, styles[i], True))
+
+        total_chart = LineChart(
+            [Segment(f"{gender_name}'s {self.length}m race total times: ")] + names, labels, (0, nr_laps * 35), totals
+        )
+        lap_chart = LineChart(
+            [Segment(f"{gender_name}'s {self.length}m race lap times: ")] + names, labels, (5, 35), lap_lines
+        )
+        return total_chart, lap_chart
+
+    def __rich_console__(self, console: Console, options: ConsoleOptions) -> RenderResult:
+        width = options.max_width or console.width
+        height = options.height or console.height
+        new_line = Segment.line()
+        for chart, chart_height in zip(self.charts(), (height // 2, height - height // 2)):
+            for row in chart.render_lines(width, chart_height):
+                yield from row
+                yield new_line
+
+
+def create_chart_panel(
+        gender: str,
+        length: int,
+        names: List[str],
+        lap_times: np.array,
+        layout: Layout,
+        prediction: Optional[PredictionInterval] = None) -> Panel:
+    """Creates the panel with the native charts. The layout that is supplied will be used to put the panel into.
+
+    :param str gender: string indicating if the race is for Men or Women. Accepted values are ["M", "F"]
+    :param int length: integer indicating the length of the race. Accepted values are
+     [500, 1000, 1500, 3000, 5000, 10000]
+
+    :param List[str] names: List of strings with the names of the athletes.
+    :param np.array lap_times:  Numpy array with the times so far.
+    :param rich.Layout layout:  The layout in which the charts will be placed.
+    :param (PredictionInterval, None) prediction: prediction intervals that are drawn as a band.
+    :return rich.Panel:  The panel with the charts in it is returned
+    """
+    panel = Panel(RaceChart(gender, length, names, lap_times, prediction))
+    layout.update(panel)
+    return panel
@@ -0,0 +1,218 @@
+"""
+Columnar export and import of the results archive in long format, one row per lap. Uses Arrow IPC or Parquet when
+pyarrow is installed (pip install SkateTracker[arrow]), and a plain NumPy .npz file otherwise.
+"""
+import glob
+import os
+
+import numpy as np
+
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pa = None
+
+try:
+    from SkateTracker.splits import refresh_splits
+    from SkateTracker.utils import load_race_ids, load_results, missing_times, parse_results_fname, results_path, \
+        save_results
+except ModuleNotFoundError:
+    from splits import refresh_splits
+    from utils import load_race_ids, load_results, missing_times, parse_results_fname, results_path, save_results
+
+COLUMNS = ("tournament", "gender", "distance", "race", "athlete", "lap", "lap_time")
+STRING_COLUMNS = ("tournament", "gender", "athlete")
+ARROW_EXTENSIONS = (".arrow", ".feather", ".ipc")
+
+
+def _format(fname: str) -> str:
+    extension = os.path.splitext(fname)[1].lower()
+    if extension == ".npz":
+        return "npz"
+    if extension not in ARROW_EXTENSIONS + (".parquet",):
+        raise ValueError(f"ERROR: {fname} should end in .npz, .parquet or one of {', '.join(ARROW_EXTENSIONS)}")
+    if pa is None:
+        raise ImportError("ERROR: Arrow and Parquet files need pyarrow, install it with "
+                          "pip install SkateTracker[arrow] or use a .npz file instead")
+    return "parquet" if extension == ".parquet" else "arrow"
+
+
+def results_to_columns(fnames: Optional[List[str]] = None) -> Dict[str, np.array]:
+    """Converts results files to long format. The string columns are dictionary encoded, as a pair of an int32 code
+     array and the array of distinct values.
+
+    :param (List[str], None) fnames: paths of the results files. If None, all results files in skate_data are used.
+    :return dict: for every column in COLUMNS a Numpy array, or a (codes, values) pair for the string columns
+    """
+    if fnames is None:
+        fnames = sorted(glob.glob(os.path.join(os.getcwd(), 'skate_data', "*_data.csv")))
+
+    parts = {column: [] for column in COLUMNS}
+    values = {column: {} for column in STRING_COLUMNS}
+    for fname in fnames:
+        tournament, gender, length = parse_results_fname(fname)
+        names, results = load_results(tournament, fname=fname)
+        race_ids = load_race_ids(fname, len(names))
+        n_results, nr_laps = results.shape
+        n_rows = n_results * nr_laps
+
+        athlete_codes = np.array(
+            [values["athlete"].setdefault(name, len(values["athlete"])) for name in names], dtype=np.int32
+        )
+        for column, value in (("tournament", tournament), ("gender", gender)):
+            parts[column].append(np.full(n_rows, values[column].setdefault(value, len(values[column])), np.int32))
+        parts["distance"].append(np.full(n_rows, length, dtype=np.int32))
+        parts["race"].append(np.repeat(race_ids.astype(np.int32), nr_laps))
+        parts["athlete"].append(np.repeat(athlete_codes, nr_laps))
+        parts["lap"].append(np.tile(np.arange(1, nr_laps + 1, dtype=np.int16), n_results))
+        # The lap times are int32 centiseconds, with MISSING (-1) for laps that were not skated
+        parts["lap_time"].append(results.reshape(-1))
+
+    columns = {}
+    for column in COLUMNS:
+        data = np.concatenate(parts[column]) if parts[column] else np.zeros(0)
+        if column in STRING_COLUMNS:
+            columns[column] = (data.astype(np.int32), np.array(list(values[column]), dtype=str))
+        else:
+            columns[column] = data
+    return columns
+
+
+def export_columnar(output: str, fnames: Optional[List[str]] = None) -> int:
+    """Exports results files to a single columnar file in long format.
+
+    :param str output: path of the columnar file, the extension selects the format (.npz, .parquet, .arrow).
+    :param (List[str], None) fnames: paths of the results files. If None, all results files in skate_data are used.
+    :return int: the number of rows (laps) that were written
+    """
+    fmt = _format(output)
+    columns = results_to_columns(fnames)
+
+    if fmt == "npz":
+        arrays = {}
+        for column, data in columns.items():
+            if column in STRING_COLUMNS:
+                arrays[column], arrays[f"{column}_values"] = data
+            else:
+                arrays[column] = data
+        np.savez(output, **arrays)
+    else:
+        table = pa.table({
+            column: pa.DictionaryArray.from_arrays(*data) if column in STRING_COLUMNS else pa.array(data)
+            for column, data in columns.items()
+        })
+        if fmt == "parquet":
+            pa.parquet.write_table(table, output)
+        else:
+            with pa.ipc.new_file(output, table.schema) as writer:
+                writer.write_table(table)
+    return columns["lap_time"].shape[0]
+
+
+def read_columnar(fname: str) -> Dict[str, Tuple[np.array, np.array]]:
+    """Reads a columnar file in a single read. Arrow IPC files are memory mapped, so the numeric columns are not
+     copied.
+
+    :param str fname: path of the columnar file.
+    :return dict: for every column in COLUMNS a Numpy array, or a (codes, values) pair for the string columns
+    """
+    fmt = _format(fname)
+    if fmt == "npz":
+        try:
+            data = np.load(fname)
+        except ValueError:
+            raise ValueError(f"ERROR: {fname} is not a .npz file")
+        with data:
+            missing = [column for column in COLUMNS if column not in data.files]
+            if missing:
+                raise ValueError(f"ERROR: {fname} has no {', '.join(missing)} column")
+            return {
+                column: (data[column], data[f"{column}_values"]) if column in STRING_COLUMNS else data[column]
+                for column in COLUMNS
+            }
+
+    if fmt == "parquet":
+        table = pa.parquet.read_table(fname)
+    else:
+        table = pa.ipc.open_file(pa.memory_map(fname)).read_all()
+    missing = [column for column in COLUMNS if column not in table.column_names]
+    if missing:
+        raise ValueError(f"ERROR: {fname} has no {', '.join(missing)} column")
+
+    columns = {}
+    for column in COLUMNS:
+        data = table.column(column).combine_chunks()
+        if column in STRING_COLUMNS:
+            if not isinstance(data, pa.DictionaryArray):
+                data = data.dictionary_encode()
+            columns[column] = (data.indices.to_numpy(), np.array(data.dictionary.to_pylist(), dtype=str))
+        else:
+            columns[column] = data.to_numpy()
+    return columns
+
+
+def import_columnar(fname: str, replace: bool = False) -> Dict[Tuple[str, str, int], int]:
+    """Imports a columnar file in long format into the skate_data folder. Every tournament, gender and distance in
+     the file is written to its results file, with the race ids that were exported.
+
+    :param str fname: path of the columnar file.
+    :param bool replace: whether results files that already exist may be replaced. If False, nothing is written
+     when one of them exists.
+
+    :return dict: the number of results that were written per race file
+    """
+    columns = read_columnar(fname)
+    tournament_codes, tournaments = columns["tournament"]
+    gender_codes, genders = columns["gender"]
+    athlete_codes, athletes = columns["athlete"]
+    distances = columns["distance"].astype(np.int64)
+    if columns["lap_time"].dtype.kind not in "iu":
+        raise ValueError(f"ERROR: the lap times in {fname} should be integer centiseconds")
+
+    # Every row belongs to one result, identified by (tournament, gender, distance, race, athlete). The results are
+    # numbered in order of their first row, which keeps the order of the original results files.
+    keys = np.stack((tournament_codes, gender_codes, distances, columns["race"], athlete_codes), axis=1)
+    _, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+    order = np.argsort(np.argsort(first))
+    result = order[inverse.reshape(-1)]
+
+    n_results = first.shape[0]
+    result_rows = np.zeros(n_results, dtype=np.int64)
+    result_rows[result] = np.arange(result.shape[0])
+    written = {}
+    race_files = keys[result_rows]
+    file_keys = np.unique(race_files[:, :3], axis=0)
+    if not replace:
+        existing = [
+            results_path(str(tournaments[tournament_code]), str(genders[gender_code]), int(length))
+            for tournament_code, gender_code, length in file_keys
+        ]
+        existing = [path for path in existing if os.path.exists(path)]
+        if existing:
+            raise FileExistsError(
+                f"ERROR: skate_data already has {', '.join(os.path.basename(path) for path in existing)}, "
+                f"use --replace to overwrite"
+            )
+
+    for tournament_code, gender_code, length in file_keys:
+        in_file = np.all(race_files[:, :3] == (tournament_code, gender_code, length), axis=1)
+        file_results = np.flatnonzero(in_file)
+        rows = np.isin(result, file_results)
+
+        nr_laps = int(columns["lap"][rows].max())
+        times = missing_times((file_results.shape[0], nr_laps))
+        index = np.searchsorted(file_results, result[rows])
+        times[index, columns["lap"][rows].astype(np.int64) - 1] = columns["lap_time"][rows]
+
+        race_ids = race_files[file_results, 3]
+        names = [str(athletes[code]) for code in race_files[file_results, 4]]
+        race = (str(tournaments[tournament_code]), str(genders[gender_code]), int(length))
+        save_results(*race, names, times.T, race_ids)
+        # Splits of the results that were replaced would otherwise be matched to the imported results
+        refresh_splits(results_path(*race), names, times, race[2])
+        written[race] = file_results.shape[0]
+    return written
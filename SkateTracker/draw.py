@@ -0,0 +1,145 @@
+"""
+Tournament draws, and background prefetching of the previous results of the athletes in the upcoming pairs
+"""
+import re
+
+import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+try:
+    from SkateTracker.api import Archive, final_times, load_archive
+    from SkateTracker.utils import MISSING, format_clock, format_time, missing_times, number_of_laps, total_times
+except ModuleNotFoundError:
+    from api import Archive, final_times, load_archive
+    from utils import MISSING, format_clock, format_time, missing_times, number_of_laps, total_times
+
+SECTION = re.compile(r"^\[\s*([MF])\s+(\d+)m?\s*\]$")
+
+
+class DrawError(ValueError):
+    """Raised when a draw file can not be read."""
+
+
+def load_draw(fname: str, gender: str, length: int) -> List[List[str]]:
+    """Loads the pairs of a race from a draw file. Every line is a pair, with the names of the athletes separated by
+     a comma, in the order they skate. A draw of several races is split in sections, each starting with a line like
+     [F 1500]. Lines before the first section belong to every race, empty lines and lines starting with # are skipped.
+
+    :param str fname: path of the draw file.
+    :param str gender: string indicating if the race is for Men or Women. Accepted values are ["M", "F"]
+    :param int length: integer indicating the length of the race.
+    :return List[List[str]]: the names of the athletes of every pair
+    """
+    pairs = []
+    in_race = True
+    with open(fname) as f:
+        for line_nr, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            section = SECTION.match(line)
+            if section is not None:
+                in_race = section.group(1) == gender and int(section.group(2)) == length
+                continue
+            names = [name.strip() for name in line.split(",") if name.strip()]
+            if len(names) not in (1, 2):
+                raise DrawError(f"ERROR: {fname}:{line_nr}: a pair needs 1 or 2 athletes")
+            if in_race:
+                pairs.append(names)
+    return pairs
+
+
+class AthleteHistory:
+    """Previous results of an athlete at a distance.
+
+    :ivar str name: name of the athlete.
+    :ivar np.array times: Numpy array with the lap times of every previous result, shape=(n_results, nr_laps)
+    :ivar (np.array, None) personal_best: the lap times of the fastest complete result, None if there is none.
+    """
+    def __init__(self, name: str, times: np.array):
+        self.name = name
+        self.times = times
+        finals = final_times(times)
+        complete = np.flatnonzero(finals != MISSING)
+        self.personal_best = times[complete[np.argmin(finals[complete])]] if complete.shape[0] > 0 else None
+
+    def __len__(self) -> int:
+        return self.times.shape[0]
+
+    def compare(self, lap_times: np.array) -> str:
+        """Describes the personal best and how the lap times so far compare with it, for example
+         PB 01:54.21, +0.35 on PB pace.
+        """
+        if self.personal_best is None:
+            return f"no PB, {len(self)} previous race{'' if len(self) == 1 else 's'}"
+        description = f"PB {format_clock(total_times(self.personal_best))}"
+        laps_done = int(np.sum(lap_times != MISSING))
+        if laps_done > 0 and np.all(lap_times[:laps_done] != MISSING):
+            diff = total_times(lap_times[:laps_done]) - total_times(self.personal_best[:laps_done])
+            description += f", {format_time(diff, sign=True)} on PB pace"
+        return description
+
+
+class HistoryPrefetcher:
+    """Looks up the previous results of athletes in a background thread. The archive is loaded and indexed by athlete
+     once, after that the history of the next pair is prepared while the current race is tracked. All work runs in a
+     single worker thread, so the index is never used by two threads at once.
+    """
+    def __init__(self, gender: str, length: int, archive: Optional[Archive] = None):
+        """Initialize and start loading the archive
+
+        :param str gender: string indicating if the races are for Men or Women. Accepted values are ["M", "F"]
+        :param int length: integer indicating the length of the races.
+        :param (Archive, None) archive: the archive of the distance, if it was already loaded.
+        """
+        self.nr_laps = number_of_laps(length)
+        self.index = {}
+        self.pending = {}
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.executor.submit(self._load, gender, length, archive)
+
+    def _load(self, gender: str, length: int, archive: Optional[Archive] = None):
+        archive = archive if archive is not None else load_archive(gender, length)
+        if len(archive) == 0:
+            return
+        athletes, inverse = np.unique(archive.names, return_inverse=True)
+        order = np.argsort(inverse, kind="stable")
+        starts = np.searchsorted(inverse[order], np.arange(athletes.shape[0]))
+        for name, rows in zip(athletes, np.split(order, starts[1:])):
+            self.index[str(name)] = [archive.times[rows]]
+
+    def _history(self, name: str) -> AthleteHistory:
+        times = self.index.get(name, [missing_times((0, self.nr_laps))])
+        return AthleteHistory(name, np.vstack(times))
+
+    def _add(self, names: List[str], times: np.array):
+        for name, lap_times in zip(names, times):
+            self.index.setdefault(name, []).append(lap_times[None, :])
+
+    def prefetch(self, names: List[str]):
+        """Starts looking up the history of the athletes, without waiting for it."""
+        for name in names:
+            if name not in self.pending:
+                self.pending[name] = self.executor.submit(self._history, name)
+
+    def get(self, names: List[str]) -> List[AthleteHistory]:
+        """Gives the history of the athletes, which is immediate if they were prefetched in time."""
+        self.prefetch(names)
+        return [self.pending[name].result() for name in names]
+
+    def add(self, names: List[str], times: np.array):
+        """Adds the results of a race that was just tracked to the histories."""
+        for name in names:
+            self.pending.pop(name, None)
+        self.executor.submit(self._add, list(names), np.array(times))
+
+    def nbytes(self) -> int:
+        """Gives the memory used by the lap times in the index, in bytes. Waits until the archive is loaded."""
+        return self.executor.submit(
+            lambda: sum(times.nbytes for athlete_times in self.index.values() for times in athlete_times)
+        ).result()
+
+    def close(self):
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,152 @@
+"""
+Batch export of the final race screens of saved races to HTML, SVG and text reports
+"""
+import io
+import os
+
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+from rich.console import Console
+
+try:
+    from SkateTracker.layout import make_race_layout
+    from SkateTracker.main import create_race_view
+    from SkateTracker.utils import load_race_ids, load_results, missing_times, parse_results_fname, update_best_times
+except ModuleNotFoundError:
+    from layout import make_race_layout
+    from main import create_race_view
+    from utils import load_race_ids, load_results, missing_times, parse_results_fname, update_best_times
+
+EXPORT_FORMATS = ("html", "svg", "txt")
+
+
+def split_races(
+        names: List[str],
+        results: np.array,
+        race_ids: np.array) -> List[Tuple[int, List[str], np.array, List[str], np.array]]:
+    """Groups saved results per race and computes the best times as they were after every race.
+
+    :param List[str] names: List of strings with the names of the athletes.
+    :param np.array results: Numpy array with the lap times, shape=(n_athletes, nr_laps)
+    :param np.array race_ids: Numpy array with the race of every result.
+    :return list: for every race, in the order they were skated, the race id, the names and lap times of the race and
+     the names and times of the best 3 after the race
+    """
+    best_names = ["None", "None", "None"]
+    best_times = missing_times((3, results.shape[1]))
+
+    # A stable sort groups the results per race, while keeping the order of the athletes within a race
+    order = np.argsort(race_ids, kind="stable")
+    unique_ids, starts = np.unique(race_ids[order], return_index=True)
+    groups = np.split(order, starts[1:])
+
+    races = []
+    for race_id, index in sorted(zip(unique_ids, groups), key=lambda group: group[1][0]):
+        race_names = [names[i] for i in index]
+        best_names, best_times = update_best_times(race_names, results[index], best_names, best_times)
+        races.append((int(race_id), race_names, results[index], best_names, best_times))
+    return races
+
+
+def render_race(
+        gender: str,
+        length: int,
+        names: List[str],
+        times: np.array,
+        best_names: List[str],
+        best_times: np.array,
+        width: int = 200,
+        height: int = 50,
+        chart: str = "plotext") -> Console:
+    """Renders the final screen of a race into a recording console.
+
+    :param str gender: string indicating if the race is for Men or Women. Accepted values are ["M", "F"]
+    :param int length: integer indicating the length of the race. Accepted values are
+     [500, 1000, 1500, 3000, 5000, 10000]
+
+    :param List[str] names: List of strings with the names of the athletes.
+    :param np.array times: Numpy array with the lap times of the race in centiseconds.
+    :param List[str] best_names: List of strings with the names of the best athletes after this race.
+    :param np.array best_times: Numpy array with the best times after this race.
+    :param int width: width of the rendered screen in characters.
+    :param int height: height of the rendered screen in lines.
+    :param str chart: the backend that draws the charts, "plotext" or "native".
+    :return rich.Console: the console that recorded the screen
+    """
+    nr_laps = times.shape[1]
+    race_layout = make_race_layout()
+    create_race_view(gender, length, names, times, nr_laps, best_names, best_times, race_layout, first=True,
+                     chart=chart)
+
+    # The race is finished, so the progress bar is shown completed
+    race_progress = race_layout["progress"].renderable.renderable.renderable
+    race_progress.update(race_progress.task_ids[0], completed=nr_laps)
+
+    console = Console(record=True, width=width, height=height, file=io.StringIO(), force_terminal=True)
+    console.print(race_layout)
+    return console
+
+
+def export_race(args: tuple) -> List[str]:
+    """Renders a single race and writes the reports. Runs in a worker process of export_races.
+
+    :param tuple args: the arguments of render_race, followed by the path of the report without an extension and the
+     formats that are written.
+
+    :return List[str]: the paths of the written reports
+    """
+    *render_args, stem, formats = args
+    console = render_race(*render_args)
+
+    fnames = []
+    for fmt in formats:
+        fname = f"{stem}.{fmt}"
+        if fmt == "html":
+            console.save_html(fname, clear=False)
+        elif fmt == "svg":
+            console.save_svg(fname, title=os.path.basename(stem), clear=False)
+        else:
+            console.save_text(fname, clear=False)
+        fnames.append(fname)
+    return fnames
+
+
+def export_races(
+        fname: str,
+        output_dir: str,
+        formats: Tuple[str] = EXPORT_FORMATS,
+        width: int = 200,
+        height: int = 50,
+        workers: Optional[int] = None,
+        chart: str = "plotext") -> List[str]:
+    """Exports the final screen of every race in a results file. Rendering is CPU bound, so the races are divided
+     over a pool of processes.
+
+    :param str fname: path of the results file.
+    :param str output_dir: directory in which the reports are written.
+    :param Tuple[str] formats: the report formats, a subset of ("html", "svg", "txt").
+    :param int width: width of the rendered screens in characters.
+    :param int height: height of the rendered screens in lines.
+    :param (int, None) workers: number of processes. If None, the number of CPUs is used.
+    :param str chart: the backend that draws the charts, "plotext" or "native".
+    :return List[str]: the paths of all written reports
+    """
+    tournament, gender, length = parse_results_fname(fname)
+    names, results = load_results(tournament, fname=fname)
+    race_ids = load_race_ids(fname, len(names))
+
+    os.makedirs(output_dir, exist_ok=True)
+    gender_name = "Men" if gender == "M" else "Women"
+    jobs = [
+        (gender, length, race_names, times, best_names, best_times, width, height, chart,
+         os.path.join(output_dir, f"{tournament}_{gender_name}_{length}m_race_{race_id + 1}"), formats)
+        for race_id, race_names, times, best_names, best_times in split_races(names, results, race_ids)
+    ]
+
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        reports = executor.map(export_race, jobs, chunksize=max(1, len(jobs) // (4 * workers)))
+        return [report for race_reports in reports for report in race_reports]
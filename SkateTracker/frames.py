@@ -0,0 +1,233 @@
+"""
+Adaptive drawing of the race view. Frames are drawn in a background thread, so the next lap can be entered while the
+previous frame is still being drawn, and the detail of the view is lowered when drawing takes longer than a budget.
+"""
+import io
+import sys
+import threading
+import time
+
+import numpy as np
+
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import List, Optional
+
+from rich import get_console, print
+from rich.console import Console, ConsoleOptions, RenderResult
+from rich.layout import Layout
+from rich.segment import Segment
+
+try:
+    from SkateTracker.layout import make_race_layout
+    from SkateTracker.predict import PredictionInterval
+except ModuleNotFoundError:
+    from layout import make_race_layout
+    from predict import PredictionInterval
+
+try:
+    import readline
+except ImportError:
+    readline = None
+
+# Detail levels: the full view, a smaller plot, and a plot that is only drawn again after the last lap
+FULL, SMALL_PLOT, FINAL_PLOT = 0, 1, 2
+PLOT_RATIOS = {FULL: 7, SMALL_PLOT: 4, FINAL_PLOT: 4}
+CLEAR_SCREEN = "\x1b[H\x1b[2J"
+
+
+class CachedRenderable:
+    """Keeps the rendered lines of a renderable, so a panel that did not change is not rendered again in the next
+     frame, as long as it gets the same size.
+    """
+    def __init__(self, renderable):
+        self.renderable = renderable
+        self.size = None
+        self.lines = None
+
+    def __rich_console__(self, console: Console, options: ConsoleOptions) -> RenderResult:
+        size = (options.max_width, options.height)
+        if size != self.size:
+            self.lines = console.render_lines(self.renderable, options, pad=True)
+            self.size = size
+        new_line = Segment.line()
+        for line in self.lines:
+            yield from line
+            yield new_line
+
+
+class AdaptiveRenderer:
+    """Draws the frames of a race in a background thread. Every frame is timed, including writing it to the terminal.
+     When the frames take longer than the budget, the detail is lowered one level at a time: first the plot gets less
+     room, then the plot is only drawn again after the last lap. When there is headroom again, the detail is restored.
+     Panels that did not change since the previous frame are never rendered again, and a frame that is superseded by a
+     newer lap before it is drawn is skipped.
+
+    :ivar int level: the current detail level, FULL, SMALL_PLOT or FINAL_PLOT.
+    :ivar dict costs: the smoothed time it took to draw a frame at every level, in seconds.
+    """
+    def __init__(self, budget: float, chart: str = "plotext", console: Optional[Console] = None):
+        """Initialize
+
+        :param float budget: the time that drawing a frame may take, in seconds.
+        :param str chart: the backend that draws the charts, "plotext" or "native".
+        :param (rich.Console, None) console: the console of the terminal, the default console if None.
+        """
+        self.budget = budget
+        self.chart = chart
+        self.console = console or get_console()
+        self.level = FULL
+        self.costs = {}
+        self.layout = make_race_layout()
+        self.panels = {}
+        self.prompt = None
+        # Messages of the current lap, written again below every frame until the next lap is drawn
+        self.messages = []
+        self.generation = 0
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = None
+        # Errors of frames that were drawn in the background, reported at the next draw or flush
+        self.errors = []
+
+    def start_race(self) -> Layout:
+        """Starts a new race with an empty layout, after the frames of the previous race are drawn."""
+        self.flush()
+        self.layout = make_race_layout()
+        self.panels = {}
+        return self.layout
+
+    def draw(
+            self,
+            gender: str,
+            length: int,
+            names: List[str],
+            times: np.array,
+            nr_laps: int,
+            best_names: List[str],
+            best_times: np.array,
+            laps_done: int,
+            prediction: Optional[PredictionInterval] = None,
+            histories: Optional[list] = None,
+            schedules: Optional[np.array] = None):
+        """Draws the race view after laps_done laps in the background, this returns immediately. The arguments are the
+         same as those of create_race_view.
+        """
+        with self.lock:
+            self.generation += 1
+            generation = self.generation
+            self.messages = []
+        args = (gender, length, list(names), times.copy(), nr_laps, list(best_names), best_times.copy())
+        kwargs = dict(prediction=prediction, histories=histories, schedules=schedules)
+        self._report_errors()
+        self.pending = self.executor.submit(self._draw, generation, laps_done, args, kwargs)
+        self.pending.add_done_callback(self._collect_error)
+
+    def _collect_error(self, future: Future):
+        if future.exception() is not None:
+            with self.lock:
+                self.errors.append(future.exception())
+
+    def _report_errors(self):
+        """Prints the errors of the frames that failed since the previous report."""
+        with self.lock:
+            errors, self.errors = self.errors, []
+        for error in errors:
+            self.message(f"ERROR: drawing the race view failed: {type(error).__name__}: {error}")
+
+    def _draw(self, generation: int, laps_done: int, args: tuple, kwargs: dict):
+        # main imports this module, so the race view is imported when it is needed
+        try:
+            from SkateTracker.main import create_race_view
+        except ModuleNotFoundError:
+            from main import create_race_view
+
+        if generation != self.generation:
+            return
+        start = time.perf_counter()
+        names, times, nr_laps, best_names, best_times = args[2:]
+        # The last lap is always drawn in full detail, the next race is only asked for after it
+        level = FULL if laps_done == nr_laps else self.level
+        create_race_view(*args, self.layout, first=True, chart=self.chart, **kwargs)
+        race_progress = self.layout["progress"].renderable.renderable.renderable
+        race_progress.update(race_progress.task_ids[0], completed=laps_done)
+
+        prediction = kwargs["prediction"]
+        plot_key = (tuple(names), times.tobytes(), prediction.band.tobytes() if prediction is not None else None)
+        if level == FINAL_PLOT and "plotext" in self.panels:
+            # The plot of an earlier lap is kept until the last lap
+            plot_key = self.panels["plotext"][0]
+        keys = {
+            "plotext": plot_key,
+            "best_results": (tuple(best_names), best_times.tobytes()),
+            "progress": laps_done,
+        }
+        for name, key in keys.items():
+            region = self.layout[name]
+            if name in self.panels and self.panels[name][0] == key:
+                region.update(self.panels[name][1])
+            else:
+                self.panels[name] = (key, CachedRenderable(region.renderable))
+                region.update(self.panels[name][1])
+        self.layout["plotext"].ratio = PLOT_RATIOS[level]
+
+        width, height = self.console.size
+        console = Console(file=io.StringIO(), force_terminal=True, width=width, height=height,
+                          color_system=self.console.color_system)
+        console.print(self.layout)
+        with self.lock:
+            if generation != self.generation:
+                return
+            sys.stdout.write(CLEAR_SCREEN + console.file.getvalue())
+            sys.stdout.flush()
+            for message in self.messages:
+                print(message)
+            if self.prompt is not None:
+                # The prompt was cleared with the screen, so it is written again with what was typed so far
+                sys.stdout.write(self.prompt + (readline.get_line_buffer() if readline is not None else ""))
+            sys.stdout.flush()
+        self._adapt(level, time.perf_counter() - start)
+
+    def _adapt(self, level: int, cost: float):
+        """Updates the smoothed cost of the level and moves to a lower or higher level of detail."""
+        self.costs[level] = cost if level not in self.costs else 0.5 * self.costs[level] + 0.5 * cost
+        # The costs of the levels with more detail are lowered a bit every frame, so they are tried again at some point
+        for other in range(level):
+            if other in self.costs:
+                self.costs[other] *= 0.9
+        if level != self.level:
+            return
+        if self.costs[level] > self.budget and self.level < FINAL_PLOT:
+            self.level += 1
+        elif self.level > FULL and self.costs[level] < self.budget / 2 and \
+                self.costs.get(self.level - 1, 0) <= self.budget:
+            self.level -= 1
+
+    def message(self, message: str):
+        """Prints a message for the current lap, such as an error in the entered lap times. Unlike a plain print, the
+         message is not lost when a frame that is still being drawn clears the screen.
+        """
+        with self.lock:
+            self.messages.append(message)
+            print(message)
+
+    def input(self, prompt: str) -> str:
+        """Asks for input while frames may still be drawn. The prompt is written again below every frame."""
+        with self.lock:
+            self.prompt = prompt
+            sys.stdout.write(prompt)
+            sys.stdout.flush()
+        try:
+            return input()
+        finally:
+            with self.lock:
+                self.prompt = None
+
+    def flush(self):
+        """Waits until the last frame is drawn, and reports the errors of all frames that failed."""
+        if self.pending is not None:
+            wait([self.pending])
+        self._report_errors()
+
+    def close(self):
+        self.flush()
+        self.executor.shutdown()
@@ -0,0 +1,357 @@
+"""
+Streaming import of external result files (CSV or JSON lines) into the skate_data results store
+"""
+import csv
+import json
+import os
+import re
+import tempfile
+
+import numpy as np
+
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+try:
+    from SkateTracker.utils import MISSING, TIME_DTYPE, is_valid_race, number_of_laps, results_path, result_key, \
+        load_results, load_race_ids, race_ids_path, to_centiseconds
+    from SkateTracker.names import load_name_index, update_name_index
+    from SkateTracker.splits import SplitTimes, lap_distances, load_splits, save_splits
+except ModuleNotFoundError:
+    from names import load_name_index, update_name_index
+    from splits import SplitTimes, lap_distances, load_splits, save_splits
+    from utils import MISSING, TIME_DTYPE, is_valid_race, number_of_laps, results_path, result_key, load_results, \
+        load_race_ids, race_ids_path, to_centiseconds
+
+JSON_EXTENSIONS = (".json", ".jsonl", ".ndjson")
+FIELDS = ("tournament", "athlete", "gender", "distance", "splits")
+# Columns with the time of a single lap, like 1, lap2 or lap_3
+LAP_COLUMN = re.compile(r"^(lap[ _]?)?\d+$")
+# Number of results that are converted to text at once when a results file is written
+WRITE_BLOCK = 10000
+GENDERS = {"M": "M", "F": "F", "W": "F", "MEN": "M", "WOMEN": "F"}
+
+
+class RecordError(ValueError):
+    """Raised when a record of an external result file can not be converted to a valid result."""
+
+
+def iter_records(fname: str) -> Iterator[Tuple[int, dict]]:
+    """Reads an external result file line by line. Only the current line is kept in memory.
+
+    A CSV file needs a header with (at least) the columns athlete, gender and distance. The lap times are either given
+     in a column laps, separated by ";" or spaces, or in a column per lap, named like 1 or lap1. Any other column is an
+     error. A JSON lines file needs an object per line with the keys athlete, gender, distance and laps (a list of lap
+     times). Both can optionally give a tournament, which overrides the tournament given on the command line. Instead
+     of the lap times, the sectional splits can be given under splits, as "<passage>:<time>" separated by ";" in a CSV
+     file or as a list of [passage, time] pairs in a JSON lines file.
+
+    :param str fname: path of the file that will be imported.
+    :return Iterator[(int, (dict, RecordError))]: yields the line number and the raw record of each race, or the error
+     of a line that is not a valid JSON object
+    :raises RecordError: if the header of a CSV file has an unknown column
+    """
+    with open(fname, newline="") as f:
+        if os.path.splitext(fname)[1].lower() in JSON_EXTENSIONS:
+            for line_nr, line in enumerate(f, start=1):
+                if line.strip():
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError as e:
+                        record = RecordError(f"invalid JSON: {e.msg} at column {e.colno}")
+                    if not isinstance(record, (dict, RecordError)):
+                        record = RecordError("a line needs to be a JSON object")
+                    yield line_nr, record
+        else:
+            reader = csv.reader(f)
+            header = [column.strip().lower() for column in next(reader, [])]
+            lap_columns = [i for i, column in enumerate(header) if LAP_COLUMN.match(column)]
+            unknown = [column for i, column in enumerate(header)
+                       if column not in FIELDS and column != "laps" and i not in lap_columns]
+            if unknown:
+                raise RecordError(f"unknown columns {', '.join(map(repr, unknown))}, the file is skipped")
+            for line_nr, row in enumerate(reader, start=2):
+                if not row:
+                    continue
+                record = {column: value.strip() for column, value in zip(header, row)}
+                if "laps" not in record:
+                    record["laps"] = [row[i] for i in lap_columns if i < len(row) and row[i].strip()]
+                yield line_nr, record
+
+
+def parse_splits(splits, length: int) -> (np.array, np.array):
+    """Validates the sectional splits of a record.
+
+    :param (str, list) splits: the splits as "<passage>:<time>;..." or as a list of [passage, time] pairs.
+    :param int length: integer indicating the length of the race.
+    :return (np.array, np.array): the passage distances and split times in centiseconds
+    """
+    if isinstance(splits, str):
+        splits = [split.split(":") for split in splits.replace(" ", "").split(";") if split]
+    try:
+        distances, times = np.array(splits, dtype=np.float64).reshape(-1, 2).T
+    except (TypeError, ValueError):
+        raise RecordError("splits need to be pairs of a passage and a time")
+    if distances.shape[0] == 0 or np.any(np.diff(distances) <= 0) or distances[0] <= 0 or distances[-1] != length:
+        raise RecordError(f"the passages of the splits need to increase up to {length}m")
+    if not np.all(np.isfinite(times)) or np.any(times <= 0):
+        raise RecordError("split times need to be positive")
+    return distances.astype(np.int32), to_centiseconds(times)
+
+
+def check_tournament(tournament: str) -> str:
+    """Checks that a tournament can be used in the name of a results file, so it can not point outside skate_data.
+
+    :param str tournament: the name of the tournament.
+    :return str: the name of the tournament
+    :raises RecordError: if the name is empty, a relative path like .. or contains a path separator
+    """
+    separators = {"/", os.sep, os.altsep} - {None}
+    if tournament.strip() in ("", ".", "..") or any(sep in tournament for sep in separators) or "\0" in tournament:
+        raise RecordError(f"invalid tournament {tournament!r}")
+    return tournament
+
+
+def parse_record(record: dict, tournament: str) -> Tuple[str, str, int, str, np.array, np.array, np.array]:
+    """Validates a raw record and converts it into the values used by the results store.
+
+    :param dict record: raw record as produced by iter_records
+    :param str tournament: tournament that is used if the record does not give one.
+    :return (str, str, int, str, np.array, np.array, np.array): tournament, gender, length, name of the athlete, lap
+     times, and the passage distances and times of the splits. All times are in centiseconds
+    """
+    race_tournament = check_tournament(str(record.get("tournament") or tournament))
+    name = str(record.get("athlete", "")).strip()
+    if not name or "," in name or "\n" in name:
+        raise RecordError(f"invalid athlete name {name!r}")
+
+    gender = GENDERS.get(str(record.get("gender", "")).strip().upper())
+    try:
+        length = int(float(record.get("distance", "")))
+    except (TypeError, ValueError):
+        raise RecordError(f"invalid distance {record.get('distance')!r}")
+    if gender is None or not is_valid_race(gender, length):
+        raise RecordError(f"invalid race {record.get('gender')!r} {record.get('distance')!r}")
+
+    if record.get("splits"):
+        distances, split_times = parse_splits(record["splits"], length)
+        lap_times = SplitTimes([0, distances.shape[0]], distances, split_times).to_laps(length)[0]
+        if np.any(lap_times == MISSING):
+            raise RecordError("the splits need to include the passage at the end of every lap")
+        return race_tournament, gender, length, name, lap_times, distances, split_times
+
+    laps = record.get("laps", [])
+    if isinstance(laps, str):
+        laps = laps.replace(";", " ").split()
+    try:
+        lap_times = np.array(laps, dtype=np.float64)
+    except (TypeError, ValueError):
+        raise RecordError("lap times need to be numbers")
+    if lap_times.ndim != 1 or lap_times.shape[0] != number_of_laps(length):
+        raise RecordError(f"a {length}m race needs {number_of_laps(length)} lap times")
+    if not np.all(np.isfinite(lap_times)) or np.any(lap_times <= 0):
+        raise RecordError("lap times need to be positive")
+
+    lap_times = to_centiseconds(lap_times)
+    if np.any(lap_times == MISSING):
+        raise RecordError("lap times need to be at least 0.01 seconds")
+    return race_tournament, gender, length, name, lap_times, lap_distances(length), lap_times
+
+
+def chunks(iterable: Iterable, chunk_size: int) -> Iterator[list]:
+    """Splits an iterable in lists of at most chunk_size elements, without materializing the iterable."""
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, chunk_size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, chunk_size))
+
+
+class RaceGroup:
+    """Results of a single race file (tournament, gender and length) that are collected during an import. The lap times
+     and splits of every chunk are appended to scratch files, so only the names and keys of the results stay in memory.
+     The keys of the results that are already saved are loaded once, so that duplicates can be skipped in constant
+     time.
+    """
+    def __init__(self, tournament: str, gender: str, length: int, scratch_dir: str):
+        """Initialize and copy the results that are already saved to the scratch files
+
+        :param str tournament: string with the name of the tournament of the results.
+        :param str gender: string indicating if the race is for Men or Women. Accepted values are ["M", "F"]
+        :param int length: integer indicating the length of the race.
+        :param str scratch_dir: directory in which the scratch files are written.
+        """
+        self.tournament = tournament
+        self.gender = gender
+        self.length = length
+        self.nr_laps = number_of_laps(length)
+        self.fname = results_path(tournament, gender, length)
+        self.names = []
+        self.n_new = 0
+        self.race_ids = np.zeros(0, dtype=np.int64)
+        self.keys = set()
+
+        stem = os.path.join(scratch_dir, os.path.basename(self.fname)[:-len("_data.csv")])
+        self.scratch = {part: f"{stem}_{part}.bin" for part in ("times", "split_counts", "split_distances", "splits")}
+        for scratch in self.scratch.values():
+            open(scratch, "wb").close()
+
+        if os.path.isfile(self.fname):
+            names, results = load_results(tournament, gender=gender, length=length)
+            self.names = names
+            self.race_ids = load_race_ids(self.fname, len(names))
+            self.keys = {result_key(name, laps) for name, laps in zip(names, results)}
+            self._append(results, load_splits(self.fname, results, length, names))
+
+    @property
+    def new_names(self) -> List[str]:
+        """The names of the results that were added by the import."""
+        return self.names[len(self.names) - self.n_new:]
+
+    def _append(self, lap_times: np.array, splits: SplitTimes):
+        parts = {
+            "times": lap_times.astype(TIME_DTYPE), "split_counts": np.diff(splits.offsets),
+            "split_distances": splits.distances, "splits": splits.times
+        }
+        for part, values in parts.items():
+            with open(self.scratch[part], "ab") as f:
+                values.tofile(f)
+
+    def add(self, names: List[str], lap_times: np.array, splits: SplitTimes) -> int:
+        """Adds the results of a chunk, skipping all results that are already known.
+
+        :return int: the number of results that were added
+        """
+        keep = []
+        for i, (name, laps) in enumerate(zip(names, lap_times)):
+            key = result_key(name, laps)
+            if key not in self.keys:
+                self.keys.add(key)
+                keep.append(i)
+        self.names += [names[i] for i in keep]
+        self.n_new += len(keep)
+        self._append(lap_times[keep], splits.take(keep))
+        return len(keep)
+
+    def save(self):
+        """Writes the saved and the newly imported results to the results file. The results file has a column per
+         result, so it is written one lap at a time from the scratch file, a block of results at a time. The files are
+         written next to the results file and then moved over it.
+        """
+        if self.n_new == 0:
+            return
+        os.makedirs(os.path.dirname(self.fname), exist_ok=True)
+        n_results = len(self.names)
+        times = np.memmap(self.scratch["times"], dtype=TIME_DTYPE, mode="r", shape=(n_results, self.nr_laps))
+
+        with open(self.fname + ".tmp", "w") as f:
+            f.write(",".join(self.names) + "\n")
+            for lap in range(self.nr_laps):
+                for start in range(0, n_results, WRITE_BLOCK):
+                    block = times[start:start + WRITE_BLOCK, lap].tolist()
+                    f.write(("," if start > 0 else "") + ",".join(map(str, block)))
+                f.write("\n")
+
+        # Every imported result is a race of its own, the source files do not say who skated together
+        first_id = self.race_ids.max() + 1 if self.race_ids.shape[0] > 0 else 0
+        with open(race_ids_path(self.fname) + ".tmp", "w") as f:
+            f.write(",".join(map(str, self.race_ids.tolist())))
+            for start in range(0, self.n_new, WRITE_BLOCK):
+                new_ids = np.arange(first_id + start, first_id + min(start + WRITE_BLOCK, self.n_new))
+                f.write(("," if start > 0 or self.race_ids.shape[0] > 0 else "") + ",".join(map(str, new_ids.tolist())))
+            f.write("\n")
+
+        counts = np.fromfile(self.scratch["split_counts"], dtype=np.int64)
+        splits = SplitTimes(
+            np.concatenate(([0], np.cumsum(counts))),
+            np.memmap(self.scratch["split_distances"], dtype=np.int32, mode="r"),
+            np.memmap(self.scratch["splits"], dtype=TIME_DTYPE, mode="r")
+        ) if counts.sum() > 0 else SplitTimes(np.zeros(n_results + 1, dtype=np.int64))
+        os.replace(self.fname + ".tmp", self.fname)
+        os.replace(race_ids_path(self.fname) + ".tmp", race_ids_path(self.fname))
+        save_splits(self.fname, splits, self.names)
+
+
+def import_results(
+        fnames: List[str],
+        tournament: str,
+        chunk_size: int = 10000,
+        max_errors: int = 20) -> (Dict[Tuple[str, str, int], int], int, List[str]):
+    """Imports external result files into the results store. The files are streamed in chunks of chunk_size races,
+     so only one chunk of the source is in memory at any time. Every chunk is validated, converted to lap time arrays
+     and deduplicated against the saved results and the results imported before it. The lap times and splits of the
+     chunks are collected in scratch files, from which the results files are written at the end.
+
+    :param List[str] fnames: paths of the files that will be imported.
+    :param str tournament: tournament used for all records that do not give a tournament themselves.
+    :param int chunk_size: number of races that are read and converted at once.
+    :param int max_errors: maximum number of error messages that are kept.
+    :return (dict, int, List[str]): number of added results per race file, number of skipped duplicates and the
+     first max_errors error messages
+    """
+    groups = {}
+    errors = []
+    n_duplicates = 0
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        for fname in fnames:
+            try:
+                n_duplicates += import_file(fname, tournament, groups, errors, scratch_dir, chunk_size, max_errors)
+            except RecordError as e:
+                # The header of the file was not valid, none of its records were read
+                if len(errors) < max_errors:
+                    errors.append(f"{fname}:1: {e}")
+            except (OSError, UnicodeDecodeError) as e:
+                # The results of the chunks that were read before are kept
+                if len(errors) < max_errors:
+                    errors.append(f"{fname}: could not be read, {getattr(e, 'strerror', None) or e}")
+
+        name_index = load_name_index()
+        for group in groups.values():
+            group.save()
+            update_name_index(name_index, group.new_names)
+
+    added = {race: len(group.new_names) for race, group in groups.items()}
+    return added, n_duplicates, errors
+
+
+def import_file(
+        fname: str,
+        tournament: str,
+        groups: Dict[Tuple[str, str, int], RaceGroup],
+        errors: List[str],
+        scratch_dir: str,
+        chunk_size: int,
+        max_errors: int) -> int:
+    """Imports a single external result file, chunk by chunk, into the race groups.
+
+    :return int: the number of results that were skipped because they were already saved
+    """
+    n_duplicates = 0
+    for chunk in chunks(iter_records(fname), chunk_size):
+        parsed = {}
+        for line_nr, record in chunk:
+            try:
+                if isinstance(record, RecordError):
+                    raise record
+                race_tournament, gender, length, name, lap_times, distances, split_times = \
+                    parse_record(record, tournament)
+            except RecordError as e:
+                if len(errors) < max_errors:
+                    errors.append(f"{fname}:{line_nr}: {e}")
+                continue
+            names, laps, split_distances, splits = parsed.setdefault(
+                (race_tournament, gender, length), ([], [], [], [])
+            )
+            names.append(name)
+            laps.append(lap_times)
+            split_distances.append(distances)
+            splits.append(split_times)
+
+        for race, (names, laps, split_distances, splits) in parsed.items():
+            if race not in groups:
+                groups[race] = RaceGroup(*race, scratch_dir)
+            offsets = np.concatenate(([0], np.cumsum([len(distances) for distances in split_distances])))
+            chunk_splits = SplitTimes(offsets, np.concatenate(split_distances), np.concatenate(splits))
+            n_added = groups[race].add(names, np.vstack(laps), chunk_splits)
+            n_duplicates += len(names) - n_added
+    return n_duplicates
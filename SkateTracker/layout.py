@@ -1,6 +1,4 @@
-from datetime import timedelta
-
-from typing import List
+from typing import List, Optional
 
 import numpy as np
 
@@ -10,6 +8,11 @@ from rich.layout import Layout
 from rich.table import Table
 from rich.progress import Progress, SpinnerColumn, BarColumn, TextColumn
 
+try:
+    from SkateTracker.utils import MISSING, format_clock, format_time, total_times
+except ModuleNotFoundError:
+    from utils import MISSING, format_clock, format_time, total_times
+
 
 def make_start_layout() -> Layout:
     """Define the layout for the starting screen."""
@@ -44,22 +47,55 @@ def make_race_layout() -> Layout:
     return layout
 
 
-def create_lap_time_table(names: List[str], times: np.array, top_3_times: np.array) -> Panel:
+def create_lap_time_table(
+        names: List[str],
+        times: np.array,
+        top_3_times: np.array,
+        passages: Optional[List[str]] = None,
+        predictions: Optional[List[str]] = None,
+        personal_bests: Optional[List[str]] = None,
+        schedules: Optional[np.array] = None) -> Panel:
     """Creates a table which shows the progress of the current races. It has 4 columns. 2 groups of two, with the lap
     times of an athlete and the difference with the current best time.
 
     :param List[str] names: List of strings with the names of the athletes.
-    :param np.array times: Numpy array with the times so far.
-    :param np.array top_3_times: Numpy array with the best times so far
+    :param np.array times: Numpy array with the lap times so far in centiseconds.
+    :param np.array top_3_times: Numpy array with the best times so far in centiseconds.
+    :param (List[str], None) passages: labels of the passage at the end of every lap. If given, they are shown in an
+     extra first column, so the opener can be told apart from the full laps.
+
+    :param (List[str], None) predictions: formatted prediction interval of the final time of every athlete. If given,
+     they are shown below the table.
+
+    :param (List[str], None) personal_bests: description of the personal best of every athlete. If given, they are
+     shown below the table as well.
+
+    :param (np.array, None) schedules: Numpy array with the scheduled lap times of every athlete in centiseconds, MISSING
+     for an athlete without a schedule. If given, the difference with the scheduled passage times is shown next to the
+     best diff, with the target time in the footer.
+
     :return rich.Panel: Returns a rich.Panel with the table in it
     """
+    header_colors = ("red", "blue")
+    caption = None
+    if predictions is not None or personal_bests is not None:
+        captions = [
+            [caption for caption in athlete_captions if caption is not None]
+            for athlete_captions in zip(predictions or [None] * len(names), personal_bests or [None] * len(names))
+        ]
+        caption = "\n".join(
+            f"[{header_colors[i]}]{name}[/]: {' | '.join(captions[i])}" for i, name in enumerate(names)
+        )
     table_lap_times = Table(
         title="Lap time progression",
+        caption=caption,
+        caption_justify="left",
         show_footer=True,
     )
 
-    total_times = times.sum(axis=1)
-    header_colors = ("red", "blue")
+    if passages is not None:
+        table_lap_times.add_column("Passage", justify="right", no_wrap=True, min_width=6, style="bright_black")
+    totals = np.where(np.any(times != MISSING, axis=1), total_times(times), MISSING)
     for i, name in enumerate(names):
         table_lap_times.add_column(
             name,
@@ -68,9 +104,17 @@ def create_lap_time_table(names: List[str], times: np.array, top_3_times: np.arr
             min_width=10,
             header_style=header_colors[i],
             style=header_colors[i],
-            footer=f"{str(timedelta(seconds=total_times[i]))[2:10]}"
+            footer=format_clock(totals[i])
         )
         table_lap_times.add_column("Best diff", justify="center", no_wrap=True, min_width=10)
+        if schedules is not None:
+            table_lap_times.add_column(
+                "Sched diff",
+                justify="center",
+                no_wrap=True,
+                min_width=10,
+                footer=format_clock(total_times(schedules[i]) if np.all(schedules[i] != MISSING) else MISSING)
+            )
     # table_lap_times.add_column(
     #     names[1],
     #     justify="center",
@@ -83,32 +127,36 @@ def create_lap_time_table(names: List[str], times: np.array, top_3_times: np.arr
     # table_lap_times.add_column("Best diff", justify="center", no_wrap=True, min_width=10)
 
     best_lap_times = top_3_times[0, :]
-    diff = times - best_lap_times
-    times = np.vstack((times, diff))
+    skated = times != MISSING
+    # A difference is only shown when both the lap and the best lap were skated
+    has_diff = skated & (best_lap_times != MISSING)
+    diff = np.where(has_diff, times - best_lap_times, 0)
+    if schedules is not None:
+        # The schedule is compared at every passage, as long as all laps so far were skated
+        has_schedule = (np.cumsum(~skated, axis=1) == 0) & (schedules != MISSING)
+        schedule_diff = np.cumsum(np.where(has_schedule, times - schedules, 0), axis=1)
 
     colors = ("bright_red", "bright_cyan")
 
-    for col in times.T:
-        if len(names) == 2:
-            if col[0] == 0 and col[1] == 0:
-                table_lap_times.add_row("NA", "NA", "NA", "NA")
+    for j in range(times.shape[1]):
+        row = [passages[j]] if passages is not None else []
+        lap, lap_diff = times[:, j], diff[:, j]
+        if not skated[:, j].any():
+            table_lap_times.add_row(*row, *["NA"] * ((2 if schedules is None else 3) * len(names)))
+            continue
+        for i in range(len(names)):
+            color_diff = colors[1 - int(lap_diff[i] > 0)]
+            if len(names) == 2:
+                color = colors[1 - int(lap[0] > lap[1])] if i == 0 else colors[int(lap[0] > lap[1])]
             else:
-                colors_race = (colors[1 - int(col[0] > col[1])], colors[int(col[0] > col[1])])
-                color_diff_1 = colors[1 - int(col[2] > 0)]
-                color_diff_2 = colors[1 - int(col[3] > 0)]
-                item_1 = f"[{colors_race[0]}]{col[0]:.2f}"
-                item_2 = f"[{color_diff_1}]{col[2]:.2f}" if col[2] < 0 else f"[{color_diff_1}]+{col[2]:.2f}"
-                item_3 = f"[{colors_race[1]}]{col[1]:.2f}"
-                item_4 = f"[{color_diff_2}]{col[3]:.2f}" if col[3] < 0 else f"[{color_diff_2}]+{col[3]:.2f}"
-                table_lap_times.add_row(item_1, item_2, item_3, item_4)
-        else:
-            if col[0] == 0:
-                table_lap_times.add_row("NA", "NA")
-            else:
-                color_diff_1 = colors[1 - int(col[1] > 0)]
-                item_1 = f"[{color_diff_1}]{col[0]:.2f}"
-                item_2 = f"[{color_diff_1}]{col[1]:.2f}" if col[1] < 0 else f"[{color_diff_1}]+{col[1]:.2f}"
-                table_lap_times.add_row(item_1, item_2)
+                color = color_diff
+            row.append(f"[{color}]{format_time(lap[i])}")
+            row.append(f"[{color_diff}]{format_time(lap_diff[i], sign=True)}" if has_diff[i, j] else "NA")
+            if schedules is not None:
+                behind = schedule_diff[i, j]
+                row.append(f"[{colors[1 - int(behind > 0)]}]{format_time(behind, sign=True)}" if has_schedule[i, j]
+                           else "NA")
+        table_lap_times.add_row(*row)
     panel_lap_times = Panel(
         Align.center(table_lap_times, vertical="top"),
         border_style="bright_red"
@@ -117,18 +165,22 @@ def create_lap_time_table(names: List[str], times: np.array, top_3_times: np.arr
     return panel_lap_times
 
 
-def create_best_table(names: List[str], times: np.array) -> Panel:
+def create_best_table(names: List[str], times: np.array, passages: Optional[List[str]] = None) -> Panel:
     """Creates the table with the top 3 best times so far.
 
     :param List[str] names: List of strings with the names of the best athletes so far.
-    :param np.array times: Numpy array with the best times so far
+    :param np.array times: Numpy array with the best times so far in centiseconds.
+    :param (List[str], None) passages: labels of the passage at the end of every lap, shown in an extra first column.
     :return rich.Panel: Panel with the table showing the top 3 best results so far.
     """
     table_best = Table(
         title="Best times so far",
         show_footer=True)
 
-    total_times = times.sum(axis=1)
+    if passages is not None:
+        table_best.add_column("Passage", justify="right", no_wrap=True, min_width=6, style="bright_black")
+
+    totals = np.where(np.any(times != MISSING, axis=1), total_times(times), MISSING)
     table_best.add_column(
         names[0],
         justify="center",
@@ -136,7 +188,7 @@ def create_best_table(names: List[str], times: np.array) -> Panel:
         min_width=10,
         style="gold3",
         header_style="gold3",
-        footer=f"{str(timedelta(seconds=total_times[0]))[2:10]}"
+        footer=format_clock(totals[0])
     )
     table_best.add_column(
         names[1],
@@ -145,7 +197,7 @@ def create_best_table(names: List[str], times: np.array) -> Panel:
         min_width=10,
         style="grey74",
         header_style="grey74",
-        footer=f"{str(timedelta(seconds=total_times[1]))[2:10]}"
+        footer=format_clock(totals[1])
     )
     table_best.add_column(
         names[2],
@@ -154,10 +206,11 @@ def create_best_table(names: List[str], times: np.array) -> Panel:
         min_width=10,
         style="orange4",
         header_style="orange4",
-        footer=f"{str(timedelta(seconds=total_times[2]))[2:10]}"
+        footer=format_clock(totals[2])
     )
-    for col in times.T:
-        table_best.add_row(*col.astype(str))
+    for j, col in enumerate(times.T):
+        row = [passages[j]] if passages is not None else []
+        table_best.add_row(*row, *[format_time(time) for time in col])
 
     panel_best = Panel(
         Align.center(table_best, vertical="top"),
@@ -3,7 +3,8 @@ CLI tool (python module) that helps you track lap times during a speed skating r
 It will also predict the final time, as well as visualise some useful  statistics
 """
 import argparse
-from math import ceil
+
+from typing import Callable
 
 from rich import print
 
@@ -11,10 +12,32 @@ try:
     from SkateTracker.layout import *
     from SkateTracker.utils import *
     from SkateTracker.plot import create_plotext_panel
+    from SkateTracker.chart import CHART_BACKENDS, create_chart_panel
+    from SkateTracker.names import NameCompleter, correct_names, load_name_index, update_name_index
+    from SkateTracker.stats import LapStatistics
+    from SkateTracker.splits import passage_labels, refresh_splits
+    from SkateTracker.predict import LapRatioModel, PredictionInterval, format_interval
+    from SkateTracker.broadcast import RaceBroadcaster
+    from SkateTracker.draw import AthleteHistory
+    from SkateTracker.watch import ResultsWatcher
+    from SkateTracker.schedule import ScheduleError, parse_targets, race_schedules
+    from SkateTracker.session import Session, parse_race
+    from SkateTracker.frames import AdaptiveRenderer
 except ModuleNotFoundError:
     from layout import *
     from utils import *
     from plot import create_plotext_panel
+    from chart import CHART_BACKENDS, create_chart_panel
+    from names import NameCompleter, correct_names, load_name_index, update_name_index
+    from stats import LapStatistics
+    from splits import passage_labels, refresh_splits
+    from predict import LapRatioModel, PredictionInterval, format_interval
+    from broadcast import RaceBroadcaster
+    from draw import AthleteHistory
+    from watch import ResultsWatcher
+    from schedule import ScheduleError, parse_targets, race_schedules
+    from session import Session, parse_race
+    from frames import AdaptiveRenderer
 
 
 def welcome_print(tournament: str, gender: str, length: int, prediction_method: str, accumulate: str, save: str) -> Panel:
@@ -73,6 +96,7 @@ def make_instruction_panel() -> Panel:
 
 def create_race_view(
         gender: str,
+        length: int,
         names: List[str],
         times: np.array,
         nr_laps: int,
@@ -80,10 +104,17 @@ def create_race_view(
         best_times: np.array,
         race_layout: Layout,
         first: bool = False,
-        final: bool = False) -> None:
+        final: bool = False,
+        prediction: Optional[PredictionInterval] = None,
+        histories: Optional[List[AthleteHistory]] = None,
+        chart: str = "plotext",
+        schedules: Optional[np.array] = None) -> None:
     """Creates the main race view and layout.
 
     :param str gender: string indicating if the race is for Men or Women. Accepted values are ["M", "F"].
+    :param int length: integer indicating the length of the race. Accepted values are
+     [500, 1000, 1500, 3000, 5000, 10000]
+
     :param List[str] names: List of strings with the names of the athletes.
     :param np.array times: Numpy array with the times so far.
     :param int nr_laps: integer indicating how many laps this race is going to take.
@@ -96,6 +127,18 @@ def create_race_view(
     :param bool final: Boolean indicating if this is the final time the view will be shown. THe progress bar does not
      need to be progressed or initiated then.
 
+    :param (PredictionInterval, None) prediction: If given, the p10/p50/p90 of the final times are shown in the lap
+     time table and as a band in the plot.
+
+    :param (List[AthleteHistory], None) histories: If given, the personal best of every athlete and the difference
+     with its pace are shown in the lap time table.
+
+    :param str chart: the backend that draws the charts, "plotext" or "native". The native charts are drawn directly
+     into the layout, which is a lot faster.
+
+    :param (np.array, None) schedules: If given, the scheduled lap times of every athlete. The difference with the
+     schedule is shown in the lap time table.
+
     :return None: Nothing
     """
 
@@ -116,67 +159,186 @@ def create_race_view(
             progress_panel.renderable.renderable.advance(progress_panel.renderable.renderable.task_ids[0])
             progress_layout.update(progress_panel)
 
-    _ = create_plotext_panel(
+    create_panel = create_chart_panel if chart == "native" else create_plotext_panel
+    _ = create_panel(
         gender,
-        nr_laps,
+        length,
         names,
         times,
-        plotext_layout
+        plotext_layout,
+        prediction
     )
 
-    table_progression = create_lap_time_table(names, times, best_times)
-    table_best_results = create_best_table(best_names, best_times)
+    passages = passage_labels(length)
+    predictions = [format_interval(final) for final in prediction.final] if prediction is not None else None
+    personal_bests = [history.compare(lap_times) for history, lap_times in zip(histories, times)] \
+        if histories is not None else None
+    table_progression = create_lap_time_table(
+        names, times, best_times, passages, predictions, personal_bests, schedules
+    )
+    table_best_results = create_best_table(best_names, best_times, passages)
 
     current_race_layout.update(table_progression)
     best_results_layout.update(table_best_results)
 
 
+def confirm_lap_times(
+        names: List[str],
+        lap_time: np.array,
+        lap: int,
+        lap_stats: LapStatistics,
+        ask: Callable[[str], str] = input,
+        show: Callable[[str], None] = print) -> bool:
+    """Checks the entered lap times against the statistics of the lap. If a lap time looks wrong, for example 2.83
+     instead of 28.3, the user has to confirm it.
+
+    :param List[str] names: List of strings with the names of the athletes.
+    :param np.array lap_time: Numpy array with the entered lap times in centiseconds.
+    :param int lap: index of the lap.
+    :param LapStatistics lap_stats: statistics of all lap times so far.
+    :param Callable ask: asks the user for input, the input method of the renderer when the views are drawn in the
+     background.
+
+    :param Callable show: prints a message, the message method of the renderer when the views are drawn in the
+     background.
+
+    :return bool: True if the lap times can be used
+    """
+    anomalies = lap_stats.anomalies(lap, lap_time)
+    for name, time in zip(np.array(names)[anomalies], lap_time[anomalies]):
+        show(f"WARNING: {format_time(time)} for {name} is unusual for the {ordinal(lap + 1)} lap "
+              f"(usually {lap_stats.mean[lap]:.2f} \u00B1 {lap_stats.std(lap):.2f})")
+    if not anomalies.any():
+        return True
+
+    correct = False
+    while not correct:
+        keep = ask("Do you want to keep these lap times? [y/n]: ")
+        if not (keep == "y" or keep == "n"):
+            show("ERROR: please select a valid response!")
+        else:
+            correct = True
+    return keep == "y"
+
+
+def shown_best_times(
+        best_names: List[str],
+        best_times: np.array,
+        watcher: Optional[ResultsWatcher] = None) -> (List[str], np.array):
+    """Adds the best results that other trackers saved since the last check to the best results of this tracker.
+
+    :param List[str] best_names: List of strings with the names of the best athletes of this tracker.
+    :param np.array best_times: Numpy array with the best times of this tracker.
+    :param (ResultsWatcher, None) watcher: If given, the results files of the other trackers that it watches.
+    :return (List[str], np.array): the names and times of the best results to show
+    """
+    if watcher is None:
+        return best_names, best_times
+    watcher.poll()
+    if watcher.best_times is None:
+        return best_names, best_times
+    return update_best_times(watcher.best_names, watcher.best_times, best_names, best_times)
+
+
 def track_race(
         gender: str,
+        length: int,
         names: List[str],
         nr_laps: int,
         best_names: List[str],
-        best_times: np.array) -> (np.array, Layout):
+        best_times: np.array,
+        lap_stats: Optional[LapStatistics] = None,
+        model: Optional[LapRatioModel] = None,
+        broadcaster: Optional[RaceBroadcaster] = None,
+        histories: Optional[List[AthleteHistory]] = None,
+        watcher: Optional[ResultsWatcher] = None,
+        chart: str = "plotext",
+        schedules: Optional[np.array] = None,
+        renderer: Optional[AdaptiveRenderer] = None) -> (np.array, Layout):
     """For each race, this function does the tracking of the race. It will create the race layout and view. For each
      lap it will ask the user for the lap times and incorporate them into the views
 
     :param str gender: string indicating if the race is for Men or Women. Accepted values are ["M", "F"]
+    :param int length: integer indicating the length of the race. Accepted values are
+     [500, 1000, 1500, 3000, 5000, 10000]
+
     :param List[str] names: List of strings with the names of the athletes.
     :param int nr_laps: integer indicating how many laps this race is going to take.
     :param List[str] best_names: List of strings with the names of the best athletes so far.
     :param np.array best_times: Numpy array with the best times so far.
+    :param (LapStatistics, None) lap_stats: statistics of all lap times so far. If given, lap times that are
+     implausible for the lap have to be confirmed before they are used.
+
+    :param (LapRatioModel, None) model: If given, the prediction intervals of the final times are simulated after
+     every lap.
+
+    :param (RaceBroadcaster, None) broadcaster: If given, the race and every lap are sent to the connected viewers.
+    :param (List[AthleteHistory], None) histories: previous results of the athletes, used to compare with their
+     personal bests.
+
+    :param (ResultsWatcher, None) watcher: If given, the best results that other trackers save during the race are
+     added to the best times that are shown.
+
+    :param str chart: the backend that draws the charts, "plotext" or "native".
+    :param (np.array, None) schedules: If given, the scheduled lap times of every athlete, shape=(n_athletes, nr_laps)
+    :param (AdaptiveRenderer, None) renderer: If given, the views are drawn in the background by the renderer, so the
+     next lap times can be entered while a view is still being drawn.
+
     :return (np.array, rich.Layout): Returns the final lap times of the athletes.
      So that they may used to save the times and update the best times. Also returns the layout so that all the results
      can be shown one last time.
     """
     n_athletes = len(names)
-    times = np.zeros((len(names), nr_laps))
+    times = missing_times((len(names), nr_laps))
 
-    race_layout = make_race_layout()
-    create_race_view(
-        gender,
-        names,
-        times,
-        nr_laps,
-        best_names,
-        best_times,
-        race_layout,
-        first=True
-    )
-    print(race_layout)
+    shown_names, shown_times = shown_best_times(best_names, best_times, watcher)
+    if renderer is not None:
+        race_layout = renderer.start_race()
+        renderer.draw(gender, length, names, times, nr_laps, shown_names, shown_times, 0, histories=histories,
+                      schedules=schedules)
+    else:
+        race_layout = make_race_layout()
+        create_race_view(
+            gender,
+            length,
+            names,
+            times,
+            nr_laps,
+            shown_names,
+            shown_times,
+            race_layout,
+            first=True,
+            histories=histories,
+            chart=chart,
+            schedules=schedules
+        )
+        print(race_layout)
+    # With a renderer, a frame that is still being drawn would otherwise clear the prompts and errors
+    ask = renderer.input if renderer is not None else input
+    show = renderer.message if renderer is not None else print
+    if broadcaster is not None:
+        broadcaster.start_race(gender, length, names, nr_laps, shown_names, shown_times)
 
     for i in range(nr_laps):
         correct = False
         while not correct:
             try:
-                lap_time = np.array([
-                    float(t) for t in input(f"Lap times of {ordinal(i+1)} lap:").replace(" ", "").split(",")
+                entered = np.array([
+                    float(t) for t in ask(f"Lap times of {ordinal(i+1)} lap:").replace(" ", "").split(",")
                     ])
+                # Only 0 marks a lap that was not skated, a negative time is a typo
+                if not np.all(np.isfinite(entered) & (entered >= 0)):
+                    raise ValueError("lap times can not be negative")
+                # The lap times are converted to centiseconds once
+                lap_time = to_centiseconds(entered)
             except ValueError:
-                print("ERROR: You need to enter numbers!")
+                show("ERROR: You need to enter numbers!")
             else:
                 if lap_time.shape[0] != n_athletes:
-                    print("ERROR: you need to enter the correct amount of times!")
+                    show("ERROR: you need to enter the correct amount of times!")
+
+                elif lap_stats is not None and not confirm_lap_times(names, lap_time, i, lap_stats, ask, show):
+                    show("Please enter the lap times again.")
 
                 else:
                     correct = True
@@ -184,21 +346,53 @@ def track_race(
 
         # For now the view is erased and updated each time. The reason being that rich.Live does not work
         # nicely with input and a progress bar. (As far as I could figure out)
+        prediction = model.simulate(times, i + 1) if model is not None else None
+        if broadcaster is not None:
+            broadcaster.lap(i, times[:, i], prediction)
+
+        shown_names, shown_times = shown_best_times(best_names, best_times, watcher)
+        if renderer is not None:
+            # The view is drawn in the background, so the next lap times can be entered right away
+            renderer.draw(gender, length, names, times, nr_laps, shown_names, shown_times, i + 1,
+                          prediction=prediction, histories=histories, schedules=schedules)
+            continue
+
         os.system("clear")
         create_race_view(
             gender,
+            length,
             names,
             times,
             nr_laps,
-            best_names,
-            best_times,
-            race_layout
+            shown_names,
+            shown_times,
+            race_layout,
+            prediction=prediction,
+            histories=histories,
+            chart=chart,
+            schedules=schedules
         )
         print(race_layout)
+    if renderer is not None:
+        renderer.flush()
     return times, race_layout
 
 
-def main_tracking(tournament: str, gender: str, length: int, prediction_method: str, accumulate: str, save: str):
+def main_tracking(
+        tournament: str,
+        gender: str,
+        length: int,
+        prediction_method: str,
+        accumulate: str,
+        save: str,
+        broadcast: Optional[str] = None,
+        draw: Optional[str] = None,
+        watch: Optional[List[str]] = None,
+        chart: str = "plotext",
+        targets: Optional[List[str]] = None,
+        session: str = "n",
+        memory_budget: int = 512,
+        frame_budget: Optional[float] = None):
     """Main function that parses the initial arguments. Prompts the user for the names of the athletes and calls
      all the other functions that create the layouts, views, tracking etc.
 
@@ -215,16 +409,46 @@ def main_tracking(tournament: str, gender: str, length: int, prediction_method:
      If the user exits the tool and restarts it again with the same settings, it will use this file to load the previous
      results type
 
+    :param (str, None) broadcast: path of a Unix domain socket. If given, the races are broadcast to the viewers that
+     connect to it (SkateTrackerTools view).
+
+    :param (str, None) draw: path of a draw file. If given, the pairs of the draw are tracked one after the other,
+     instead of typing the names of every pair.
+
+    :param (List[str], None) watch: the tournament names of the other trackers that save their results in the same
+     skate_data folder. If given, their results are added to the best times as they are saved.
+
+    :param str chart: the backend that draws the charts. Accepted values ["plotext", "native"]
+
+    :param (List[str], None) targets: target final times of athletes, as NAME=TIME. If given, the lap time table shows
+     how far these athletes are ahead of or behind the schedule to reach their target.
+
+    :param str session: string which indicates if the distance can be switched between races. Accepted values
+     ["y", "n"]
+
+    :param int memory_budget: the memory in MB that the archive caches of the distances that are not tracked right
+     now may use in a session.
+
+    :param (float, None) frame_budget: the time in milliseconds that drawing the race view may take. If given, the views
+     are drawn in the background and the detail of the view is lowered when drawing takes longer.
+
     :return None:
     """
 
     # verify if all the arguments are correct (some combinations are not possible)
-    if gender == "M" and length == 3000:
-        raise ValueError("This combination is not a valid race!")
-    if gender == "F" and length == 10000:
+    if not is_valid_race(gender, length):
         raise ValueError("This combination is not a valid race!")
 
-    use = check_saved(tournament, gender, length)
+    # The results of every distance are kept for the session, the archive caches of recently used distances are kept
+    # within the memory budget
+    try:
+        target_times = parse_targets(targets or [])
+    except ScheduleError as error:
+        print(f"{error} Continuing without schedules.")
+        target_times = {}
+    distances = Session(tournament, draw, target_times, watch, memory_budget * 2 ** 20)
+    results, caches = distances.switch(gender, length)
+
     # Creates the main start layout
     layout_start = make_start_layout()
 
@@ -237,45 +461,64 @@ def main_tracking(tournament: str, gender: str, length: int, prediction_method:
     layout_start["main"]["body"].update(welcome_panel)
     print(layout_start)
 
-    nr_laps = ceil(length / 400)
-    best_names = ["None", "None", "None"]
-    best_times = np.zeros((3, nr_laps))
-
-    if use == "y":
-        all_names, all_results = load_results(tournament, gender=gender, length=length)
-        best_names, best_times = update_best_times(all_names, all_results, best_names, best_times)
-    else:
-        all_names = []
-        all_results = []
+    # Names can be tab-completed from all athletes in the archive
+    name_index = load_name_index()
+    name_completer = NameCompleter(name_index)
+    broadcaster = RaceBroadcaster(broadcast) if broadcast is not None else None
+    renderer = AdaptiveRenderer(frame_budget / 1000, chart) if frame_budget is not None else None
 
     tracking = True
     while tracking:
-        correct_names = False
-        while not correct_names:
-            names = [name.rstrip() for name in input("The names of the athletes are: ").split(",") if len(name) > 0]
-
-            if len(names) == 1 or len(names) == 2:
-                correct_names = True
-            else: 
-                print("ERROR: Please enter 1 or 2 athletes to track!")
+        gender, length, nr_laps, pairs = results.gender, results.length, results.nr_laps, results.pairs
+        if pairs:
+            # The next pair of the draw is tracked, when the draw is finished the names are asked again
+            names = pairs.pop(0)
+            print(f"Next pair: {' vs '.join(names)}")
+        else:
+            correct = False
+            while not correct:
+                with name_completer:
+                    typed = input("The names of the athletes are: ")
+                names = [name.strip() for name in typed.split(",") if name.strip()]
+
+                if len(names) == 1 or len(names) == 2:
+                    correct = True
+                else:
+                    print("ERROR: Please enter 1 or 2 athletes to track!")
+            names = correct_names(name_index, names)
+        # The previous results of the next pair are looked up in the background while a race is tracked
+        histories = caches.prefetcher.get(names)
+        if pairs:
+            caches.prefetcher.prefetch(pairs[0])
+
         # A full race is tracked, the lap times and final race view are returned
-        lap_times, race_layout = track_race(gender, names, nr_laps, best_names, best_times)
-        best_names, best_times = update_best_times(names, lap_times, best_names, best_times)
+        lap_times, race_layout = track_race(
+            gender, length, names, nr_laps, results.best_names, results.best_times, caches.lap_stats, caches.model,
+            broadcaster, histories, caches.watcher, chart, race_schedules(names, caches.schedules, nr_laps), renderer
+        )
+        results.add_race(names, lap_times, saved=save == "y")
+        caches.add_race(names, lap_times)
+        if broadcaster is not None:
+            broadcaster.best(*shown_best_times(results.best_names, results.best_times, caches.watcher))
 
+        records = results.records
         if save == "y":
-            if len(all_names) != 0:
-                all_results = np.vstack((all_results, lap_times))
-                all_names = all_names + names
-                save_results(tournament, gender, length, all_names, all_results.T)
-            else:
-                all_results = lap_times
-                all_names = names
-                save_results(tournament, gender, length, all_names, all_results.T)
+            save_results(tournament, gender, length, records.names, records.times.T, records.race_ids)
+            refresh_splits(results_path(tournament, gender, length), records.names, records.times, length)
+            update_name_index(name_index, names)
 
         correct = False
         while not correct:
-            next_race = input("Do you want to start tracking the next race? [y/n]: ")
-            if not (next_race == "y" or next_race == "n"):
+            next_pair = f" ({' vs '.join(pairs[0])})" if pairs else ""
+            options = "y/n, or a race like F 1000 to switch" if session == "y" else "y/n"
+            next_race = input(f"Do you want to start tracking the next race{next_pair}? [{options}]: ")
+            race = parse_race(next_race) if session == "y" else None
+            if race is not None:
+                # The next race is of another distance, which keeps the results of this one
+                results, caches = distances.switch(*race)
+                next_race = "y"
+                correct = True
+            elif not (next_race == "y" or next_race == "n"):
                 print("ERROR: please select a valid response!")
             else:
                 correct = True
@@ -283,18 +526,27 @@ def main_tracking(tournament: str, gender: str, length: int, prediction_method:
         if next_race == "n":
             create_race_view(
                 gender,
+                length,
                 names,
                 lap_times,
                 nr_laps,
-                best_names,
-                best_times,
+                *shown_best_times(results.best_names, results.best_times, caches.watcher),
                 race_layout,
-                final=True
+                final=True,
+                histories=histories,
+                chart=chart,
+                schedules=race_schedules(names, caches.schedules, nr_laps)
             )
             print(race_layout)
             input("Input anything to quit the Tracker!")
             tracking = False
 
+    if broadcaster is not None:
+        broadcaster.close()
+    distances.close()
+    if renderer is not None:
+        renderer.close()
+
     return 0
 
 
@@ -319,6 +571,30 @@ def main():
     parser.add_argument("--accumulate", "-a", choices=["y", "n"], type=str, default="y",
                         help="Indicate if previous results should be accumulated in the visualisations.")
     # For now this will be a simple csv, might change into something like an sqlite db
+    parser.add_argument("--draw", "-d", type=str, default=None, metavar="FILE",
+                        help="A file with the draw, one pair per line with the names separated by a comma. The pairs "
+                             "are tracked in this order.")
+    parser.add_argument("--broadcast", "-b", type=str, default=None, metavar="SOCKET",
+                        help="Path of a Unix domain socket to broadcast the races on. Spectators can follow the race "
+                             "with: SkateTrackerTools view SOCKET")
+    parser.add_argument("--watch", "-w", nargs="+", type=str, default=None, metavar="TOURNAMENT",
+                        help="The tournament names of the other trackers that save their results in the same "
+                             "skate_data folder. Their results are added to the best times as they are saved.")
+    parser.add_argument("--chart", "-c", choices=CHART_BACKENDS, type=str, default="plotext",
+                        help="The backend that draws the charts. The native charts are faster than plotext.")
+    parser.add_argument("--targets", "-ta", nargs="+", type=str, default=None, metavar="NAME=TIME",
+                        help="Target final times of athletes, for example Anna=1:56.40. The lap time table shows how "
+                             "far they are from the schedule to reach the target.")
+    parser.add_argument("--session", "-se", choices=["y", "n"], type=str, default="n",
+                        help="Indicate if the distance can be switched between races, for example by answering F 1000 "
+                             "when asked for the next race. Gender and length give the first distance.")
+    parser.add_argument("--memory_budget", "-m", type=int, default=512, metavar="MB",
+                        help="The memory in MB that is used to keep the saved results of the other distances of a "
+                             "session loaded.")
+    parser.add_argument("--frame_budget", "-fb", type=float, default=None, metavar="MS",
+                        help="The time in milliseconds that drawing the race view may take. If given, the view is "
+                             "drawn in the background and shows less detail when drawing takes longer, for slow "
+                             "terminals.")
 
     args = parser.parse_args()
     kwargs = vars(args)
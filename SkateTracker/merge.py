@@ -0,0 +1,127 @@
+"""
+Merging of the result files that are recorded by multiple operators of the same race
+"""
+import os
+import shutil
+
+import numpy as np
+
+from typing import List
+
+try:
+    from SkateTracker.names import load_name_index, update_name_index
+    from SkateTracker.utils import load_race_ids, load_results, parse_results_fname, race_ids_path, result_key, \
+        results_path, save_results, top_results
+    from SkateTracker.splits import SplitTimes, load_splits, save_splits, splits_path
+except ModuleNotFoundError:
+    from names import load_name_index, update_name_index
+    from utils import load_race_ids, load_results, parse_results_fname, race_ids_path, result_key, results_path, \
+        save_results, top_results
+    from splits import SplitTimes, load_splits, save_splits, splits_path
+
+# Folder inside skate_data to which the merged files are moved, so that their results are not counted twice
+MERGED_DIR = "merged"
+
+
+def merge_results(fnames: List[str]) -> (List[str], np.array, np.array, SplitTimes, int):
+    """Combines several result files of the same race into one set of results. Every result is identified by the
+     content hash of the name and the lap times, so duplicates are removed in a single pass over all results.
+
+    :param List[str] fnames: paths of the result files.
+    :return (List[str], np.array, np.array, SplitTimes, int): names, lap times, race ids and splits of all unique
+     results, in the order they were first seen, and the number of duplicates that were removed
+    """
+    seen = set()
+    names = []
+    results = []
+    race_ids = []
+    splits = []
+    n_races = 0
+    n_duplicates = 0
+    nr_laps = None
+
+    for fname in fnames:
+        file_names, file_results = load_results("", fname=fname)
+        # The race ids of every file are shifted, so that races of different files stay apart
+        file_race_ids = load_race_ids(fname, len(file_names)) + n_races
+        n_races = file_race_ids.max() + 1 if len(file_names) > 0 else n_races
+        if nr_laps is None:
+            nr_laps = file_results.shape[1]
+        elif file_results.shape[1] != nr_laps:
+            raise ValueError(f"ERROR: {fname} has a different number of laps than {fnames[0]}")
+
+        keep = []
+        for i, (name, laps) in enumerate(zip(file_names, file_results)):
+            key = result_key(name, laps)
+            if key in seen:
+                n_duplicates += 1
+            else:
+                seen.add(key)
+                keep.append(i)
+        names += [file_names[i] for i in keep]
+        results.append(file_results[keep])
+        race_ids.append(file_race_ids[keep])
+        splits.append(load_splits(fname, file_results, parse_results_fname(fname)[2], file_names).take(keep))
+
+    return names, np.vstack(results), np.concatenate(race_ids), SplitTimes.concatenate(splits), n_duplicates
+
+
+def move_merged(fname: str, copy: bool = False) -> str:
+    """Moves a results file that was merged, with its race ids and splits, to the merged folder next to it. A file of
+     an earlier merge with the same name is kept, the new file gets a number.
+
+    :param str fname: path of the results file.
+    :param bool copy: whether to copy the files instead, for a results file that is about to be overwritten.
+    :return str: the new path of the results file
+    """
+    move = shutil.copy2 if copy else os.replace
+    directory = os.path.join(os.path.dirname(fname), MERGED_DIR)
+    os.makedirs(directory, exist_ok=True)
+    target = os.path.join(directory, os.path.basename(fname))
+    n = 1
+    while os.path.exists(target):
+        target = os.path.join(directory, f"{n}_{os.path.basename(fname)}")
+        n += 1
+    for path in (race_ids_path, splits_path):
+        if os.path.isfile(path(fname)):
+            move(path(fname), path(target))
+    move(fname, target)
+    return target
+
+
+def merge_files(fnames: List[str], output: str = None, k: int = 3) -> (str, List[str], np.array, int, List[str]):
+    """Merges result files of the same race and saves the result. All files need to be of the same gender and length.
+     The names of the merged results are added to the name index. The merged files in the folder of the merged file
+     are moved to its merged folder, so that the archive does not count their results twice. A results file that is
+     overwritten by the merge is copied there first.
+
+    :param List[str] fnames: paths of the result files.
+    :param (str, None) output: tournament name of the merged file. If None, the tournament of the first file is used,
+     so the merged results replace the results of the first file.
+
+    :param int k: number of places of the leaderboard that is rebuilt from the merged results.
+    :return (str, List[str], np.array, int, List[str]): path of the merged file, the names and lap times of the top k,
+     the number of removed duplicates and the new paths of the files that were moved or copied
+    """
+    races = [parse_results_fname(fname) for fname in fnames]
+    _, gender, length = races[0]
+    if any(race[1:] != (gender, length) for race in races):
+        raise ValueError("ERROR: Only results of the same gender and length can be merged")
+    tournament = output if output is not None else races[0][0]
+
+    names, results, race_ids, splits, n_duplicates = merge_results(fnames)
+    merged = results_path(tournament, gender, length)
+    backup = move_merged(merged, copy=True) if os.path.isfile(merged) else None
+    save_results(tournament, gender, length, names, results.T, race_ids)
+    save_splits(merged, splits, names)
+    update_name_index(load_name_index(), names)
+
+    moved = [
+        move_merged(fname) for fname in dict.fromkeys(os.path.abspath(fname) for fname in fnames)
+        if fname != merged and os.path.dirname(fname) == os.path.dirname(merged)
+    ]
+    if backup is not None:
+        moved.insert(0, backup)
+
+    best_names, best_times = top_results(names, results, k)
+    return merged, best_names, best_times, n_duplicates, moved
@@ -0,0 +1,212 @@
+"""
+Prefix trie of all athlete names in the archive, used for tab-completion and correction of typed names
+"""
+import glob
+import json
+import os
+
+from typing import Iterable, List, Optional
+
+try:
+    import readline
+except ImportError:
+    # readline is not available on Windows, names can then still be corrected but not completed
+    readline = None
+
+END = "\x00"
+
+
+class NameTrie:
+    """Prefix trie of athlete names. Lookups are case-insensitive, a node stores the original spelling of the name that
+     ends in it under the END key. The trie consists of plain nested dictionaries, so it is saved to and loaded from
+     JSON without rebuilding it.
+    """
+    def __init__(self, root: Optional[dict] = None):
+        self.root = root if root is not None else {}
+
+    def insert(self, name: str) -> bool:
+        """Adds a name to the trie.
+
+        :param str name: name of the athlete.
+        :return bool: True if the name was not in the trie yet
+        """
+        node = self.root
+        for char in name.lower():
+            node = node.setdefault(char, {})
+        new = END not in node
+        node[END] = name
+        return new
+
+    def update(self, names: Iterable[str]) -> bool:
+        """Adds multiple names. Returns True if any of the names was new."""
+        return any([self.insert(name) for name in names])
+
+    def _node(self, prefix: str) -> Optional[dict]:
+        node = self.root
+        for char in prefix.lower():
+            node = node.get(char)
+            if node is None:
+                return None
+        return node
+
+    def get(self, name: str) -> Optional[str]:
+        """Gives the spelling of name as it is known in the trie, or None if the name is not known."""
+        node = self._node(name)
+        return node.get(END) if node is not None else None
+
+    def __contains__(self, name: str) -> bool:
+        return self.get(name) is not None
+
+    def __len__(self) -> int:
+        count = 0
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            count += END in node
+            stack.extend(child for char, child in node.items() if char != END)
+        return count
+
+    def complete(self, prefix: str, limit: int = 20) -> List[str]:
+        """Gives the names that start with prefix, in alphabetical order. Only the sub-trie of the prefix is visited.
+
+        :param str prefix: the start of a name.
+        :param int limit: the maximum number of names that are returned.
+        :return List[str]: the names starting with prefix
+        """
+        node = self._node(prefix)
+        names = []
+        stack = [node] if node is not None else []
+        while stack and len(names) < limit:
+            node = stack.pop()
+            if END in node:
+                names.append(node[END])
+            stack.extend(node[char] for char in sorted((char for char in node if char != END), reverse=True))
+        return names
+
+    def closest(self, name: str, max_distance: int = 2) -> Optional[str]:
+        """Finds the name in the trie with the smallest edit distance to name. Walks the trie while keeping a row of the
+         Levenshtein table per node, and prunes every branch whose row is already further away than max_distance.
+
+        :param str name: the typed name.
+        :param int max_distance: the maximum edit distance of a correction. Short names allow fewer edits, one per
+         four characters, so that a short name is not corrected to a different short name. Every name allows one edit.
+
+        :return (str, None): the closest name, or None if no name is within max_distance
+        """
+        word = name.lower()
+        best_name, best_distance = None, min(max_distance, max(1, len(word) // 4)) + 1
+        stack = [(self.root, list(range(len(word) + 1)))]
+        while stack:
+            node, row = stack.pop()
+            if END in node and row[-1] < best_distance:
+                best_name, best_distance = node[END], row[-1]
+            for char, child in node.items():
+                if char == END:
+                    continue
+                next_row = [row[0] + 1]
+                for i, word_char in enumerate(word, start=1):
+                    next_row.append(min(next_row[i - 1] + 1, row[i] + 1, row[i - 1] + (word_char != char)))
+                if min(next_row) < best_distance:
+                    stack.append((child, next_row))
+        return best_name
+
+
+def name_index_path() -> str:
+    """Gives the path of the saved name index."""
+    return os.path.join(os.getcwd(), 'skate_data', "athlete_names.json")
+
+
+def save_name_index(trie: NameTrie):
+    """Saves the name index in the skate_data folder."""
+    if not os.path.isdir(os.path.join(os.getcwd(), 'skate_data')):
+        os.mkdir(os.path.join(os.getcwd(), 'skate_data'))
+    with open(name_index_path(), "w") as f:
+        json.dump(trie.root, f, separators=(",", ":"))
+
+
+def load_name_index() -> NameTrie:
+    """Loads the name index. If there is no saved index yet, it is built once from the headers of all results files.
+
+    :return NameTrie: the trie with all names in the archive
+    """
+    if os.path.isfile(name_index_path()):
+        with open(name_index_path()) as f:
+            return NameTrie(json.load(f))
+
+    trie = NameTrie()
+    for fname in glob.glob(os.path.join(os.getcwd(), 'skate_data', "*_data.csv")):
+        with open(fname) as f:
+            trie.update(name for name in f.readline().rstrip().split(",") if name)
+    if len(trie.root) > 0:
+        save_name_index(trie)
+    return trie
+
+
+def update_name_index(trie: NameTrie, names: Iterable[str]):
+    """Adds names to the index and saves it if any of them was new."""
+    if trie.update(names):
+        save_name_index(trie)
+
+
+def correct_names(trie: NameTrie, names: List[str]) -> List[str]:
+    """Checks the typed names against the index. For every unknown name that is close to a known name, the user is
+     asked if the known name was meant, so that a typo does not create a new athlete.
+
+    :param NameTrie trie: the name index.
+    :param List[str] names: the typed names.
+    :return List[str]: the names after the corrections
+    """
+    corrected = []
+    for name in names:
+        known = trie.get(name)
+        if known is not None:
+            corrected.append(known)
+            continue
+
+        suggestion = trie.closest(name)
+        if suggestion is not None:
+            correct = False
+            while not correct:
+                use = input(f"{name} is not known, did you mean {suggestion}? [y/n]: ")
+                if not (use == "y" or use == "n"):
+                    print("ERROR: please select a valid response!")
+                else:
+                    correct = True
+            name = suggestion if use == "y" else name
+        corrected.append(name)
+    return corrected
+
+
+class NameCompleter:
+    """readline completer for comma separated athlete names."""
+    def __init__(self, trie: NameTrie):
+        self.trie = trie
+        self.matches = []
+
+    def __call__(self, text: str, state: int) -> Optional[str]:
+        if state == 0:
+            prefix = text.lstrip()
+            self.matches = [text[:len(text) - len(prefix)] + name for name in self.trie.complete(prefix)]
+        return self.matches[state] if state < len(self.matches) else None
+
+    def __enter__(self):
+        """Activates tab-completion of names for input() until the with block ends, the previous completer is restored
+         afterwards.
+        """
+        if readline is None:
+            return self
+        self.previous = readline.get_completer(), readline.get_completer_delims()
+        readline.set_completer(self)
+        readline.set_completer_delims(",")
+        if readline.__doc__ is not None and "libedit" in readline.__doc__:
+            readline.parse_and_bind("bind ^I rl_complete")
+        else:
+            readline.parse_and_bind("tab: complete")
+        return self
+
+    def __exit__(self, *exc_info):
+        if readline is None:
+            return
+        completer, delims = self.previous
+        readline.set_completer(completer)
+        readline.set_completer_delims(delims)
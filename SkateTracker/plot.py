@@ -1,7 +1,16 @@
 import numpy as np
 import plotext as plt
 
-from typing import List
+try:
+    from SkateTracker.predict import PredictionInterval
+    from SkateTracker.splits import passage_labels
+    from SkateTracker.utils import MISSING
+except ModuleNotFoundError:
+    from predict import PredictionInterval
+    from splits import passage_labels
+    from utils import MISSING
+
+from typing import List, Optional
 from rich.jupyter import JupyterMixin
 from rich.ansi import AnsiDecoder
 from rich.console import Group as RenderGroup
@@ -9,7 +18,13 @@ from rich.layout import Layout
 from rich.panel import Panel
 
 
-def plot_race(gender: str, length: int, names: List[str], lap_times: np.array, *size):
+def plot_race(
+        gender: str,
+        length: int,
+        names: List[str],
+        lap_times: np.array,
+        *size,
+        prediction: Optional[PredictionInterval] = None):
     """Function that takes all parameters and times and produces the two plots in the tracking view. Depends mainly on
      plotext
 
@@ -18,8 +33,11 @@ def plot_race(gender: str, length: int, names: List[str], lap_times: np.array, *
      [500, 1000, 1500, 3000, 5000, 10000]
 
     :param List[str] names: List of strings with the names of the athletes.
-    :param np.array lap_times:  Numpy array with the times so far.
+    :param np.array lap_times:  Numpy array with the lap times so far in centiseconds.
     :param size: Additional arguments for the width and the height of the plots
+    :param (PredictionInterval, None) prediction: If given, the p10 and p90 of the remaining total times are drawn as
+     a dotted band in the plot of the total times.
+
     :return:
     """
     colors = ("red", "blue")
@@ -28,8 +46,13 @@ def plot_race(gender: str, length: int, names: List[str], lap_times: np.array, *
     title_names = " vs ".join(names)
     nr_athletes = len(names)
     nr_laps = lap_times.shape[1]
+    # The x-axis is labelled with the passage of every lap, so the opener shows up as e.g. 100m or 300m
+    ticks = list(range(1, nr_laps + 1))
+    labels = passage_labels(length) if len(passage_labels(length)) == nr_laps else ticks
     plt.subplots(2,1)
 
+    # The plots are in seconds, laps that were not skated are left out below
+    lap_times = np.where(lap_times != MISSING, lap_times / 100, 0)
     total_times = np.cumsum(lap_times, axis=1)
     total_times[lap_times == 0] = 0
     # Plot of the total
@@ -40,10 +63,15 @@ def plot_race(gender: str, length: int, names: List[str], lap_times: np.array, *
         else:
             athlete_times = total_times[i, total_times[i, :] > 0]
         plt.plot(athlete_times, color=colors[i], label=names[i])
+    if prediction is not None and prediction.laps_done < nr_laps:
+        laps = list(range(prediction.laps_done, nr_laps + 1))
+        for i in range(nr_athletes):
+            for quantile in (0, 2):
+                plt.plot(laps, prediction.band[i, quantile, prediction.laps_done - 1:], color=colors[i], marker="dot")
     plt.plotsize(*size)
     plt.ylim(0, nr_laps * 35)
     plt.title(f"{gender_name}'s {length}m race total times: {title_names}")
-    plt.xticks(list(range(nr_laps)))
+    plt.xticks(ticks, labels)
     plt.xlim(1, nr_laps)
 
     # Plot of the lap times
@@ -57,7 +85,7 @@ def plot_race(gender: str, length: int, names: List[str], lap_times: np.array, *
     plt.plotsize(*size)
     plt.ylim(5, 35)
     plt.title(f"{gender_name}'s {length}m race lap times: {title_names}")
-    plt.xticks(list(range(nr_laps)))
+    plt.xticks(ticks, labels)
     plt.xlim(1, nr_laps)
     return plt.build()
 
@@ -66,7 +94,13 @@ class plotextMixin(JupyterMixin):
     """plotextMixin that allows plotext figures to be placed inside a rich.Layout. Got the code from
      https://github.com/piccolomo/plotext/issues/26
     """
-    def __init__(self, gender: str, length: int, names: List[str], lap_times: np.array):
+    def __init__(
+            self,
+            gender: str,
+            length: int,
+            names: List[str],
+            lap_times: np.array,
+            prediction: Optional[PredictionInterval] = None):
         """Initialize
 
         :param str gender: string indicating if the race is for Men or Women. Accepted values are ["M", "F"]
@@ -75,12 +109,14 @@ class plotextMixin(JupyterMixin):
 
         :param List[str] names: List of strings with the names of the athletes.
         :param np.array lap_times:  Numpy array with the times so far.
+        :param (PredictionInterval, None) prediction: prediction intervals that are drawn as a band.
         """
         self.decoder = AnsiDecoder()
         self.gender = gender
         self.length = length
         self.names = names
         self.lap_times = lap_times
+        self.prediction = prediction
 
     def __rich_console__(self, console, options):
         self.width = options.max_width or console.width
@@ -91,7 +127,8 @@ class plotextMixin(JupyterMixin):
             self.names,
             self.lap_times,
             self.width,
-            self.height / 2)
+            self.height / 2,
+            prediction=self.prediction)
         self.rich_canvas = RenderGroup(*self.decoder.decode(canvas))
         yield self.rich_canvas
 
@@ -101,7 +138,8 @@ def create_plotext_panel(
         length: int,
         names: List[str],
         lap_times: np.array,
-        layout: Layout) -> Panel:
+        layout: Layout,
+        prediction: Optional[PredictionInterval] = None) -> Panel:
     """Creates the actual ponel with the plotext in it. The layouy that is supplied will be used to put the panel into.
 
     :param str gender: string indicating if the race is for Men or Women. Accepted values are ["M", "F"]
@@ -111,13 +149,15 @@ def create_plotext_panel(
     :param List[str] names: List of strings with the names of the athletes.
     :param np.array lap_times:  Numpy array with the times so far.
     :param rich.Layout layout:  The layout in which the plotext figure will be placed.
+    :param (PredictionInterval, None) prediction: prediction intervals that are drawn as a band.
     :return rich.Panel:  The panel with the plotext in it is returned
     """
     mix = plotextMixin(
         gender,
         length,
         names,
-        lap_times
+        lap_times,
+        prediction
     )
     mix = Panel(mix)
     layout.update(mix)
@@ -0,0 +1,101 @@
+"""
+Prediction intervals of the final time, simulated from the lap-to-lap changes of historical races
+"""
+import numpy as np
+
+from typing import Optional, Tuple
+
+try:
+    from SkateTracker.utils import MISSING, to_seconds
+except ModuleNotFoundError:
+    from utils import MISSING, to_seconds
+
+QUANTILES = (10, 50, 90)
+
+
+class PredictionInterval:
+    """Result of a simulation for every athlete in a race. The simulated times are in seconds.
+
+    :ivar np.array final: Numpy array with the p10, p50 and p90 of the final time, shape=(n_athletes, 3)
+    :ivar np.array band: Numpy array with the p10, p50 and p90 of the total time after every lap,
+     shape=(n_athletes, 3, nr_laps). The laps that have been skated are equal to the actual total times.
+
+    :ivar int laps_done: number of laps that had been skated when the prediction was made.
+    """
+    def __init__(self, final: np.array, band: np.array, laps_done: int):
+        self.final = final
+        self.band = band
+        self.laps_done = laps_done
+
+
+class LapRatioModel:
+    """Monte Carlo model of the remaining laps. Every historical race gives the ratios between consecutive lap times.
+     A remaining trajectory is simulated by continuing from the last lap with the ratios of a randomly drawn
+     historical race, which keeps the correlation between the laps of a race.
+    """
+    def __init__(self, nr_laps: int, min_races: int = 10, seed: Optional[int] = None):
+        """Initialize without any historical races
+
+        :param int nr_laps: integer indicating how many laps the races take.
+        :param int min_races: the minimum number of historical races before predictions are made.
+        :param (int, None) seed: seed of the random generator, for reproducible simulations.
+        """
+        self.nr_laps = nr_laps
+        self.min_races = min_races
+        self.ratios = np.zeros((0, nr_laps - 1))
+        self.totals = np.zeros(0)
+        self.rng = np.random.default_rng(seed)
+
+    def add(self, times: np.array):
+        """Adds historical races. Only races of which all laps were skated are used.
+
+        :param np.array times: Numpy array with the lap times in centiseconds, shape=(n_athletes, nr_laps)
+        """
+        times = np.atleast_2d(times)
+        times = to_seconds(times[np.all(times != MISSING, axis=1)])
+        self.ratios = np.vstack((self.ratios, times[:, 1:] / times[:, :-1]))
+        self.totals = np.concatenate((self.totals, times.sum(axis=1)))
+
+    def simulate(self, times: np.array, laps_done: int, n_samples: int = 2000) -> Optional[PredictionInterval]:
+        """Simulates the remaining laps of all athletes of a race at once.
+
+        :param np.array times: Numpy array with the lap times so far in centiseconds, shape=(n_athletes, nr_laps)
+        :param int laps_done: number of laps that have been skated.
+        :param int n_samples: number of simulated trajectories per athlete.
+        :return (PredictionInterval, None): the prediction intervals, or None if there are not enough historical
+         races or no laps have been skated yet
+        """
+        if self.totals.shape[0] < self.min_races or laps_done < 1:
+            return None
+
+        n_athletes = times.shape[0]
+        times = np.where(times != MISSING, times / 100, 0)
+        totals = np.cumsum(times[:, :laps_done], axis=1)
+        # The skated laps are known, so every quantile equals the actual total time
+        band = np.repeat(totals[:, None, :], len(QUANTILES), axis=1)
+
+        if laps_done < self.nr_laps:
+            # (n_athletes, n_samples, remaining laps) ratios, all drawn in a single fancy-indexing operation
+            races = self.rng.integers(self.ratios.shape[0], size=(n_athletes, n_samples))
+            ratios = self.ratios[races, laps_done - 1:]
+            remaining = times[:, laps_done - 1, None, None] * np.cumprod(ratios, axis=2)
+            remaining = totals[:, -1, None, None] + np.cumsum(remaining, axis=2)
+
+            # A single partial sort gives all quantiles, which is much cheaper than a full sort per quantile
+            kth = [round((n_samples - 1) * q / 100) for q in QUANTILES]
+            quantiles = np.partition(remaining, kth, axis=1)[:, kth, :]
+            band = np.concatenate((band, quantiles), axis=2)
+
+        return PredictionInterval(band[:, :, -1], band, laps_done)
+
+
+def format_interval(final: Tuple[float, float, float]) -> str:
+    """Formats the p10, p50 and p90 of a final time as 1:54.21 (1:53.80 - 1:54.90)."""
+    def fmt(seconds):
+        # Rounded to centiseconds first, so that 119.999 becomes 2:00.00 and not 1:60.00
+        minutes, centiseconds = divmod(int(round(seconds * 100)), 6000)
+        return f"{minutes}:{centiseconds // 100:02d}.{centiseconds % 100:02d}" if minutes else \
+            f"{centiseconds // 100}.{centiseconds % 100:02d}"
+
+    p10, p50, p90 = final
+    return f"{fmt(p50)} ({fmt(p10)} - {fmt(p90)})"
@@ -0,0 +1,120 @@
+"""
+Compact columnar storage of all the results that are tracked during a session
+"""
+import numpy as np
+
+from typing import List, Optional
+
+try:
+    from SkateTracker.utils import TIME_DTYPE
+except ModuleNotFoundError:
+    from utils import TIME_DTYPE
+
+
+class ResultRecords:
+    """Columnar store of results. Every row is the result of one athlete in one race and consists of an interned
+     athlete id, a race id and the lap times in centiseconds as int32. The arrays grow geometrically, so appending a
+     race is amortized constant time instead of copying all previous results.
+    """
+    __slots__ = ("nr_laps", "_athletes", "_athlete_index", "_athlete_ids", "_race_ids", "_times", "_size", "_n_races")
+
+    def __init__(self, nr_laps: int, capacity: int = 16):
+        """Initialize an empty store
+
+        :param int nr_laps: integer indicating how many laps the races take.
+        :param int capacity: the number of results for which memory is reserved up front.
+        """
+        self.nr_laps = nr_laps
+        self._athletes = []
+        self._athlete_index = {}
+        self._athlete_ids = np.empty(capacity, dtype=np.int32)
+        self._race_ids = np.empty(capacity, dtype=np.int32)
+        self._times = np.empty((capacity, nr_laps), dtype=TIME_DTYPE)
+        self._size = 0
+        self._n_races = 0
+
+    @classmethod
+    def from_results(
+            cls,
+            names: List[str],
+            times: np.array,
+            race_ids: Optional[np.array] = None) -> "ResultRecords":
+        """Creates a store from results as returned by load_results.
+
+        :param List[str] names: List of strings with the names of the athletes.
+        :param np.array times: Numpy array with the lap times, shape=(n_athletes, nr_laps)
+        :param (np.array, None) race_ids: race of every result. If None, every result is its own race.
+        :return ResultRecords: the store with all the results
+        """
+        records = cls(times.shape[1], capacity=max(16, 2 * len(names)))
+        n = len(names)
+        records._athlete_ids[:n] = [records.intern(name) for name in names]
+        records._race_ids[:n] = np.arange(n) if race_ids is None else race_ids
+        records._times[:n] = times
+        records._size = n
+        records._n_races = int(records._race_ids[:n].max()) + 1 if n > 0 else 0
+        return records
+
+    def __len__(self) -> int:
+        return self._size
+
+    def intern(self, name: str) -> int:
+        """Gives the id of an athlete, registering the athlete if it is not known yet."""
+        athlete_id = self._athlete_index.get(name)
+        if athlete_id is None:
+            athlete_id = len(self._athletes)
+            self._athlete_index[name] = athlete_id
+            self._athletes.append(name)
+        return athlete_id
+
+    def _reserve(self, n: int):
+        """Makes sure there is room for n more results, doubling the capacity when needed."""
+        capacity = self._athlete_ids.shape[0]
+        if self._size + n <= capacity:
+            return
+        capacity = max(2 * capacity, self._size + n)
+        self._athlete_ids = np.resize(self._athlete_ids, capacity)
+        self._race_ids = np.resize(self._race_ids, capacity)
+        times = np.empty((capacity, self.nr_laps), dtype=TIME_DTYPE)
+        times[:self._size] = self._times[:self._size]
+        self._times = times
+
+    def append(self, names: List[str], times: np.array) -> int:
+        """Adds the results of a single race.
+
+        :param List[str] names: List of strings with the names of the athletes.
+        :param np.array times: Numpy array with the lap times of the race, shape=(len(names), nr_laps)
+        :return int: the id of the race
+        """
+        n = len(names)
+        self._reserve(n)
+        race_id = self._n_races
+        self._athlete_ids[self._size:self._size + n] = [self.intern(name) for name in names]
+        self._race_ids[self._size:self._size + n] = race_id
+        self._times[self._size:self._size + n] = times
+        self._size += n
+        self._n_races += 1
+        return race_id
+
+    @property
+    def athletes(self) -> List[str]:
+        """All distinct athletes, indexed by their id."""
+        return self._athletes
+
+    @property
+    def athlete_ids(self) -> np.array:
+        return self._athlete_ids[:self._size]
+
+    @property
+    def race_ids(self) -> np.array:
+        return self._race_ids[:self._size]
+
+    @property
+    def times(self) -> np.array:
+        """View on the lap times of all results, shape=(len(self), nr_laps)"""
+        return self._times[:self._size]
+
+    @property
+    def names(self) -> List[str]:
+        """The name of the athlete of every result, in the format used by save_results."""
+        return [self._athletes[i] for i in self.athlete_ids]
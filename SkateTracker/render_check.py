@@ -0,0 +1,197 @@
+"""
+Render-latency regression harness. Renders the race screen of a fixed set of recorded races and terminal sizes, compares
+the frames with stored golden frames and checks the time it takes to render every frame.
+"""
+import gzip
+import io
+import json
+import os
+import time
+
+import numpy as np
+
+from importlib.metadata import PackageNotFoundError, version
+from typing import Dict, List, Optional, Tuple
+
+from rich.console import Console
+
+try:
+    from SkateTracker.layout import make_race_layout
+    from SkateTracker.main import create_race_view
+    from SkateTracker.utils import missing_times, to_centiseconds
+except ModuleNotFoundError:
+    from layout import make_race_layout
+    from main import create_race_view
+    from utils import missing_times, to_centiseconds
+
+# Fixed recorded races: (key, gender, length, names, lap times, best names, best times), times in centiseconds
+GOLDEN_RACES = (
+    ("women_500m", "F", 500, ["Anna", "Bea"],
+     to_centiseconds([[10.52, 26.81], [10.61, 27.12]]),
+     ["Anna", "Bea", "Cor"], to_centiseconds([[10.52, 26.81], [10.61, 27.12], [10.70, 27.40]])),
+    ("men_1500m", "M", 1500, ["Dirk"],
+     to_centiseconds([[23.61, 25.12, 26.01, 27.33]]),
+     ["Evert", "Dirk", "Frits"], to_centiseconds([[23.40, 24.98, 25.87, 27.02], [23.61, 25.12, 26.01, 27.33],
+                                                  [23.75, 25.30, 26.20, 27.51]])),
+    ("women_5000m", "F", 5000, ["Gerda", "Hanna"],
+     to_centiseconds([[19.81, 31.20, 31.45, 31.62, 31.80, 31.85, 31.92, 32.04, 32.10, 32.25, 32.31, 32.40, 32.05],
+                      [19.95, 31.32, 31.50, 31.70, 31.74, 31.98, 32.10, 32.21, 32.30, 32.35, 32.60, 32.71, 32.52]]),
+     ["None", "None", "None"], missing_times((3, 13))),
+)
+TERMINAL_SIZES = ((120, 40), (200, 50))
+SPINNER_BLANKS = str.maketrans({chr(c): " " for c in range(0x2800, 0x2900)})
+# The golden frames are shipped with the package, a file per chart backend
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden_frames")
+
+
+def render_frame(
+        gender: str,
+        length: int,
+        names: List[str],
+        times: np.array,
+        best_names: List[str],
+        best_times: np.array,
+        laps_done: int,
+        width: int,
+        height: int,
+        chart: str = "plotext") -> (str, float):
+    """Renders the race screen as it is shown after laps_done laps into a recording console.
+
+    :param str gender: string indicating if the race is for Men or Women. Accepted values are ["M", "F"]
+    :param int length: integer indicating the length of the race.
+    :param List[str] names: List of strings with the names of the athletes.
+    :param np.array times: Numpy array with the lap times of the full race.
+    :param List[str] best_names: List of strings with the names of the best athletes so far.
+    :param np.array best_times: Numpy array with the best times so far.
+    :param int laps_done: number of laps that have been skated.
+    :param int width: width of the terminal in characters.
+    :param int height: height of the terminal in lines.
+    :param str chart: the backend that draws the charts, "plotext" or "native".
+    :return (str, float): the rendered frame with ANSI styles and the time it took to render it in seconds
+    """
+    nr_laps = times.shape[1]
+    lap_times = missing_times(times.shape)
+    lap_times[:, :laps_done] = times[:, :laps_done]
+
+    start = time.perf_counter()
+    race_layout = make_race_layout()
+    create_race_view(gender, length, names, lap_times, nr_laps, best_names, best_times, race_layout, first=True,
+                     chart=chart)
+    race_progress = race_layout["progress"].renderable.renderable.renderable
+    race_progress.update(race_progress.task_ids[0], completed=laps_done)
+
+    console = Console(record=True, width=width, height=height, file=io.StringIO(), force_terminal=True,
+                      color_system="truecolor")
+    console.print(race_layout)
+    elapsed = time.perf_counter() - start
+
+    # The spinner of the progress bar depends on the wall clock, so it is blanked in the progress panel (the last 3
+    # lines of the screen) to make the frames reproducible
+    lines = console.export_text(styles=True).split("\n")
+    lines[-4:] = [line.translate(SPINNER_BLANKS) for line in lines[-4:]]
+    return "\n".join(lines), elapsed
+
+
+def golden_frames(repeat: int = 5, chart: str = "plotext") -> Dict[str, Tuple[str, float]]:
+    """Renders every golden race after every lap in every terminal size.
+
+    :param int repeat: how often every frame is rendered, the fastest render time is reported.
+    :param str chart: the backend that draws the charts, "plotext" or "native".
+    :return dict: the frame and the render time in seconds, by the name of the frame
+    """
+    frames = {}
+    for key, gender, length, names, times, best_names, best_times in GOLDEN_RACES:
+        for width, height in TERMINAL_SIZES:
+            for laps_done in range(times.shape[1] + 1):
+                renders = [
+                    render_frame(gender, length, names, times, best_names, best_times, laps_done, width, height,
+                                 chart)
+                    for _ in range(repeat)
+                ]
+                elapsed = min(elapsed for _, elapsed in renders)
+                frames[f"{key}_lap{laps_done}_{width}x{height}"] = (renders[0][0], elapsed)
+    return frames
+
+
+def render_versions() -> Dict[str, str]:
+    """Gives the installed versions of the packages that the frames depend on."""
+    versions = {}
+    for package in ("rich", "plotext"):
+        try:
+            versions[package] = version(package)
+        except PackageNotFoundError:
+            versions[package] = "unknown"
+    return versions
+
+
+def golden_path(golden_dir: str, chart: str) -> str:
+    """Gives the path of the file with the golden frames of a chart backend."""
+    return os.path.join(golden_dir, f"{chart}.json.gz")
+
+
+def first_difference(frame: str, golden: str) -> int:
+    """Gives the number of the first line (starting at 1) in which two frames differ."""
+    lines, golden_lines = frame.split("\n"), golden.split("\n")
+    for line_nr, (line, golden_line) in enumerate(zip(lines, golden_lines), start=1):
+        if line != golden_line:
+            return line_nr
+    return min(len(lines), len(golden_lines)) + 1
+
+
+def check_frames(
+        golden_dir: Optional[str] = None,
+        budget: float = 0.1,
+        update: bool = False,
+        repeat: int = 5,
+        chart: str = "plotext") -> (List[Tuple[str, float, bool, bool]], List[str]):
+    """Compares the rendered frames with the golden frames in golden_dir and checks the render time of every frame.
+
+    :param (str, None) golden_dir: directory with a file of golden frames per chart backend. If None, the golden
+     frames that are shipped with the package are used.
+
+    :param float budget: the maximum render time of a single frame in seconds.
+    :param bool update: if True, the golden frames are (re)written instead of compared.
+    :param int repeat: how often every frame is rendered, the fastest render time is checked.
+    :param str chart: the backend that draws the charts, "plotext" or "native".
+    :return (list, List[str]): for every frame, the name, the render time and if the frame matched and was within
+     budget, and a list of all failures
+    """
+    fname = golden_path(golden_dir or GOLDEN_DIR, chart)
+    frames = golden_frames(repeat, chart)
+    versions = render_versions()
+    golden = {"versions": versions, "frames": {}}
+    if update:
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        data = json.dumps({"versions": versions, "frames": {name: frame for name, (frame, _) in frames.items()}},
+                          indent=0, sort_keys=True)
+        # Without a timestamp the file only changes when a frame changes
+        with open(fname, "wb") as f:
+            f.write(gzip.compress(data.encode(), mtime=0))
+    elif os.path.isfile(fname):
+        with gzip.open(fname, "rt") as f:
+            golden = json.load(f)
+
+    report = []
+    failures = []
+    for name, (frame, elapsed) in frames.items():
+        if update:
+            matches = True
+        elif name not in golden["frames"]:
+            matches = False
+            failures.append(f"{name}: there is no golden frame in {fname}")
+        else:
+            matches = golden["frames"][name] == frame
+            if not matches:
+                line_nr = first_difference(frame, golden["frames"][name])
+                failures.append(f"{name}: frame differs from the golden frame from line {line_nr}")
+
+        in_budget = elapsed <= budget
+        if not in_budget:
+            failures.append(f"{name}: rendering took {1000 * elapsed:.1f}ms, the budget is {1000 * budget:.1f}ms")
+        report.append((name, elapsed, matches, in_budget))
+
+    if golden["versions"] != versions and not all(matches for _, _, matches, _ in report):
+        recorded = ", ".join(f"{package} {v}" for package, v in sorted(golden["versions"].items()))
+        installed = ", ".join(f"{package} {v}" for package, v in sorted(versions.items()))
+        failures.append(f"the golden frames were recorded with {recorded}, but {installed} are installed")
+    return report, failures
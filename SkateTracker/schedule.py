@@ -0,0 +1,146 @@
+"""
+Target-pace schedules: the lap times that reach a target final time, paced like the archived races that finished
+close to that time.
+"""
+import os
+
+import numpy as np
+
+from typing import Dict, List, Optional, Sequence
+
+try:
+    from SkateTracker.api import final_times, load_archive
+    from SkateTracker.utils import MISSING, TIME_DTYPE, archive_paths, missing_times, parse_clock
+except ModuleNotFoundError:
+    from api import final_times, load_archive
+    from utils import MISSING, TIME_DTYPE, archive_paths, missing_times, parse_clock
+
+# Pace profiles per (gender, length), with the modification times of the results files they were computed from
+PROFILES_CACHE = {}
+
+
+class ScheduleError(ValueError):
+    """Raised when a schedule can not be made."""
+
+
+class PaceProfiles:
+    """The lap fractions (lap time divided by the final time) of all complete archived races of a distance, sorted by
+     final time. Scaling the fractions of a race to a target time gives a schedule with the same pacing.
+
+    :ivar np.array finals: Numpy array with the final times in centiseconds, sorted, shape=(n_races,)
+    :ivar np.array fractions: Numpy array with the lap fractions of every race, shape=(n_races, nr_laps)
+    """
+    def __init__(self, times: np.array):
+        """Initialize
+
+        :param np.array times: Numpy array with archived lap times in centiseconds, shape=(n_results, nr_laps). Results
+         in which not all laps were skated are left out.
+        """
+        times = np.atleast_2d(times)
+        finals = final_times(times)
+        complete = np.flatnonzero(finals != MISSING)
+        complete = complete[np.argsort(finals[complete], kind="stable")]
+        self.finals = finals[complete]
+        self.fractions = times[complete] / self.finals[:, None]
+
+    def __len__(self) -> int:
+        return self.finals.shape[0]
+
+    def schedules(self, targets: Sequence[int], k: int = 10) -> np.array:
+        """Makes the schedules of many target times at once. The schedule of a target follows the mean lap fractions
+         of the k archived races with the closest final times. The laps are rounded so that they add up to exactly the
+         target time.
+
+        :param Sequence[int] targets: the target final times in centiseconds.
+        :param int k: the number of archived races that every schedule is based on.
+        :return np.array: Numpy array with the scheduled lap times in centiseconds, shape=(n_targets, nr_laps)
+        """
+        targets = np.atleast_1d(np.asarray(targets, dtype=np.int64))
+        n_races = len(self)
+        if n_races == 0:
+            raise ScheduleError("ERROR: there are no complete saved races of this distance to base a schedule on!")
+        k = min(k, n_races)
+
+        # The k closest final times are among the k races on either side of where the target would be in the sorted
+        # final times, so only that window of 2k races is compared with every target
+        width = min(2 * k, n_races)
+        start = np.clip(np.searchsorted(self.finals, targets) - k, 0, n_races - width)
+        window = start[:, None] + np.arange(width)
+        distance = np.abs(self.finals[window] - targets[:, None])
+        nearest = np.take_along_axis(window, np.argpartition(distance, k - 1, axis=1)[:, :k], axis=1)
+        fractions = self.fractions[nearest].mean(axis=1)
+
+        passages = np.rint(np.cumsum(fractions, axis=1) * targets[:, None]).astype(np.int64)
+        passages[:, -1] = targets
+        return np.diff(passages, axis=1, prepend=0).astype(TIME_DTYPE)
+
+
+def load_profiles(gender: str, length: int) -> PaceProfiles:
+    """Gives the pace profiles of a gender and length. They are computed once and computed again only when one of the
+     results files of the distance changed.
+
+    :param str gender: string indicating if the races are for Men or Women. Accepted values are ["M", "F"]
+    :param int length: integer indicating the length of the races.
+    :return PaceProfiles: the pace profiles of all complete saved races
+    """
+    signature = tuple((fname, os.stat(fname).st_mtime_ns) for fname in archive_paths(gender, length))
+    cached = PROFILES_CACHE.get((gender, length))
+    if cached is None or cached[0] != signature:
+        cached = (signature, PaceProfiles(load_archive(gender, length).times))
+        PROFILES_CACHE[(gender, length)] = cached
+    return cached[1]
+
+
+def parse_targets(entries: List[str]) -> Dict[str, int]:
+    """Parses target times given as NAME=TIME, for example Anna=1:56.40. A target without a name is named after the
+     time itself.
+
+    :param List[str] entries: the targets.
+    :return Dict[str, int]: the target final time in centiseconds by name
+    """
+    targets = {}
+    for entry in entries:
+        name, _, time = entry.rpartition("=")
+        try:
+            targets[name.strip() or time.strip()] = parse_clock(time)
+        except ValueError:
+            raise ScheduleError(f"ERROR: {entry} is not a target like NAME=1:56.40!")
+    return targets
+
+
+def team_schedules(
+        gender: str,
+        length: int,
+        targets: Dict[str, int],
+        k: int = 10,
+        profiles: Optional[PaceProfiles] = None) -> Dict[str, np.array]:
+    """Makes the schedule of every athlete of a team.
+
+    :param str gender: string indicating if the races are for Men or Women. Accepted values are ["M", "F"]
+    :param int length: integer indicating the length of the races.
+    :param Dict[str, int] targets: the target final time in centiseconds by name.
+    :param int k: the number of archived races that every schedule is based on.
+    :param (PaceProfiles, None) profiles: the pace profiles of the distance. If None, they are loaded with
+     load_profiles.
+
+    :return Dict[str, np.array]: the scheduled lap times in centiseconds by name
+    """
+    if not targets:
+        return {}
+    profiles = profiles if profiles is not None else load_profiles(gender, length)
+    schedules = profiles.schedules(list(targets.values()), k)
+    return dict(zip(targets, schedules))
+
+
+def race_schedules(names: List[str], schedules: Dict[str, np.array], nr_laps: int) -> Optional[np.array]:
+    """Gives the schedules of the athletes of a race, MISSING for athletes without a schedule.
+
+    :param List[str] names: List of strings with the names of the athletes.
+    :param Dict[str, np.array] schedules: the scheduled lap times by name.
+    :param int nr_laps: integer indicating how many laps the race takes.
+    :return (np.array, None): Numpy array with the scheduled lap times, shape=(n_athletes, nr_laps), or None if none
+     of the athletes has a schedule
+    """
+    if not any(name in schedules for name in names):
+        return None
+    return np.array([schedules.get(name, missing_times(nr_laps)) for name in names], dtype=TIME_DTYPE)
@@ -0,0 +1,206 @@
+"""
+Tracking several distances in one session. The results and best times of every distance that was tracked are kept,
+the caches that are derived from the archive are kept for the recently used distances within a memory budget.
+"""
+import re
+
+import numpy as np
+
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from rich import print
+
+try:
+    from SkateTracker.api import load_archive
+    from SkateTracker.draw import HistoryPrefetcher, load_draw
+    from SkateTracker.predict import LapRatioModel
+    from SkateTracker.records import ResultRecords
+    from SkateTracker.schedule import PaceProfiles, ScheduleError, team_schedules
+    from SkateTracker.stats import LapStatistics
+    from SkateTracker.utils import (check_saved, is_valid_race, load_race_ids, load_results, missing_times,
+                                    number_of_laps, results_path, update_best_times)
+    from SkateTracker.watch import ResultsWatcher
+except ModuleNotFoundError:
+    from api import load_archive
+    from draw import HistoryPrefetcher, load_draw
+    from predict import LapRatioModel
+    from records import ResultRecords
+    from schedule import PaceProfiles, ScheduleError, team_schedules
+    from stats import LapStatistics
+    from utils import (check_saved, is_valid_race, load_race_ids, load_results, missing_times, number_of_laps,
+                       results_path, update_best_times)
+    from watch import ResultsWatcher
+
+RACE = re.compile(r"^([MF])\s*(\d+)m?$")
+
+
+def parse_race(text: str) -> Optional[Tuple[str, int]]:
+    """Parses a race like F 1000 or M500m into the gender and length, None if it is not a valid race."""
+    race = RACE.match(text.strip())
+    if race is None or not is_valid_race(race.group(1), int(race.group(2))):
+        return None
+    return race.group(1), int(race.group(2))
+
+
+class DistanceResults:
+    """The results of a distance in this tournament, which are kept for the whole session.
+
+    :ivar ResultRecords records: all results of the tournament, including the ones loaded from the results file.
+    :ivar List[str] best_names: List of strings with the names of the best athletes so far.
+    :ivar np.array best_times: Numpy array with the best times so far.
+    :ivar List[List[str]] pairs: the pairs of the draw that still have to skate.
+    :ivar list unsaved: the names and lap times of the races that were tracked but not saved, which are not in the
+     archive.
+    """
+    def __init__(self, tournament: str, gender: str, length: int, draw: Optional[str] = None):
+        self.gender = gender
+        self.length = length
+        self.nr_laps = number_of_laps(length)
+        self.best_names = ["None", "None", "None"]
+        self.best_times = missing_times((3, self.nr_laps))
+        self.unsaved = []
+
+        if check_saved(tournament, gender, length) == "y":
+            all_names, all_results = load_results(tournament, gender=gender, length=length)
+            self.best_names, self.best_times = update_best_times(all_names, all_results, self.best_names,
+                                                                 self.best_times)
+            race_ids = load_race_ids(results_path(tournament, gender, length), len(all_names))
+            self.records = ResultRecords.from_results(all_names, all_results, race_ids)
+        else:
+            self.records = ResultRecords(self.nr_laps)
+        self.pairs = load_draw(draw, gender, length) if draw is not None else []
+
+    def add_race(self, names: List[str], lap_times: np.array, saved: bool):
+        """Adds the results of a race that was just tracked."""
+        self.best_names, self.best_times = update_best_times(names, lap_times, self.best_names, self.best_times)
+        self.records.append(names, lap_times)
+        if not saved:
+            self.unsaved.append((list(names), np.array(lap_times)))
+
+
+class ArchiveCaches:
+    """Everything that is derived from the archive of a distance. It can be dropped at any time and made again, from
+     the archive and the races of the session that were not saved.
+    """
+    def __init__(
+            self,
+            tournament: str,
+            results: DistanceResults,
+            targets: Optional[Dict[str, int]] = None,
+            watch: Optional[List[str]] = None):
+        """Initialize, the archive is read once and shared by all caches
+
+        :param str tournament: string with the name of the tournament where the race is being held.
+        :param DistanceResults results: the results of the distance.
+        :param (Dict[str, int], None) targets: the target final times in centiseconds by name.
+        :param (List[str], None) watch: the tournament names of the other trackers of which the results are watched.
+        """
+        gender, length, nr_laps = results.gender, results.length, results.nr_laps
+        archive = load_archive(gender, length)
+        self.lap_stats = LapStatistics.from_results(archive.times) if len(archive) > 0 else LapStatistics(nr_laps)
+        self.model = LapRatioModel(nr_laps)
+        self.model.add(archive.times)
+        self.prefetcher = HistoryPrefetcher(gender, length, archive)
+        for names, lap_times in results.unsaved:
+            self.add_race(names, lap_times)
+        if results.pairs:
+            self.prefetcher.prefetch(results.pairs[0])
+
+        # The pace profiles are only needed for the schedules of the targets
+        self.profiles = PaceProfiles(archive.times) if targets else None
+        try:
+            self.schedules = team_schedules(gender, length, targets or {}, profiles=self.profiles)
+        except ScheduleError as error:
+            print(f"{error} Continuing without schedules.")
+            self.schedules = {}
+        # Results of other trackers of the same race are read as they are saved, this tracker's own file is skipped
+        self.watcher = ResultsWatcher(tournament, watch, gender, length) if watch else None
+
+    def add_race(self, names: List[str], lap_times: np.array):
+        """Adds the results of a race that was just tracked."""
+        self.lap_stats.update(lap_times)
+        self.model.add(lap_times)
+        self.prefetcher.add(names, lap_times)
+
+    def nbytes(self) -> int:
+        """Estimates the memory that is used by the caches, in bytes."""
+        nbytes = self.model.ratios.nbytes + self.model.totals.nbytes + self.prefetcher.nbytes()
+        if self.profiles is not None:
+            nbytes += self.profiles.finals.nbytes + self.profiles.fractions.nbytes
+        return nbytes
+
+    def close(self):
+        self.prefetcher.close()
+        if self.watcher is not None:
+            self.watcher.close()
+
+
+class Session:
+    """The distances of a tournament that are tracked in one session. The results of every distance are kept, the
+     archive caches of the distances that are not tracked right now are kept in least recently used order, as long as
+     they fit in the memory budget. A distance of which the caches were dropped loads them again when it is tracked.
+    """
+    def __init__(
+            self,
+            tournament: str,
+            draw: Optional[str] = None,
+            targets: Optional[Dict[str, int]] = None,
+            watch: Optional[List[str]] = None,
+            memory_budget: int = 512 * 2 ** 20):
+        """Initialize without any distances
+
+        :param str tournament: string with the name of the tournament where the races are being held.
+        :param (str, None) draw: path of a draw file with a section per race.
+        :param (Dict[str, int], None) targets: the target final times in centiseconds by name. They are used for the
+         first distance of the session.
+
+        :param (List[str], None) watch: the tournament names of the other trackers of which the results are watched.
+        :param int memory_budget: the memory in bytes that the caches of the distances that are not tracked right now
+         may use.
+        """
+        self.tournament = tournament
+        self.draw = draw
+        self.targets = targets
+        self.watch = watch
+        self.memory_budget = memory_budget
+        self.results: Dict[Tuple[str, int], DistanceResults] = {}
+        self.caches: "OrderedDict[Tuple[str, int], ArchiveCaches]" = OrderedDict()
+        self.sizes: Dict[Tuple[str, int], int] = {}
+        self.current = None
+        self.first = None
+
+    def switch(self, gender: str, length: int) -> (DistanceResults, ArchiveCaches):
+        """Makes a distance the current distance. Its results and caches are loaded if they are not in memory, and the
+         caches of the least recently used distances are dropped until the others fit in the memory budget.
+
+        :param str gender: string indicating if the race is for Men or Women. Accepted values are ["M", "F"]
+        :param int length: integer indicating the length of the race.
+        :return (DistanceResults, ArchiveCaches): the results and caches of the distance
+        """
+        key = (gender, length)
+        if self.current is not None and self.current != key and self.current in self.caches:
+            # The size of a distance is measured when it is left, by then its history has been loaded
+            self.sizes[self.current] = self.caches[self.current].nbytes()
+
+        if key not in self.results:
+            self.results[key] = DistanceResults(self.tournament, gender, length, self.draw)
+        if key in self.caches:
+            self.caches.move_to_end(key)
+        else:
+            self.first = self.first or key
+            targets = self.targets if key == self.first else None
+            self.caches[key] = ArchiveCaches(self.tournament, self.results[key], targets, self.watch)
+        self.current = key
+
+        inactive = [other for other in self.caches if other != key]
+        while inactive and sum(self.sizes.get(other, 0) for other in inactive) > self.memory_budget:
+            evicted = inactive.pop(0)
+            self.caches.pop(evicted).close()
+            self.sizes.pop(evicted, None)
+        return self.results[key], self.caches[key]
+
+    def close(self):
+        for caches in self.caches.values():
+            caches.close()
+        self.caches.clear()
@@ -0,0 +1,201 @@
+"""
+Sectional split times. Timing systems give passages at 100m, 200m, 300m or every lap, so the number of splits differs
+per race. The splits of all races are kept in flat arrays with offsets instead of a padded matrix.
+"""
+import os
+
+import numpy as np
+
+from typing import List, Optional, Tuple
+
+try:
+    from SkateTracker.utils import MISSING, TIME_DTYPE, number_of_laps
+except ModuleNotFoundError:
+    from utils import MISSING, TIME_DTYPE, number_of_laps
+
+
+def lap_distances(length: int) -> np.array:
+    """Gives the distance of the passage at the end of every timed lap. The first passage is the opener, the part of a
+     lap that is skated before the first full lap, for example 100m for the 500m and 300m for the 1500m.
+
+    :param int length: integer indicating the length of the race. Accepted values are
+     [500, 1000, 1500, 3000, 5000, 10000]
+
+    :return np.array: Numpy array with the passage distances in metres, shape=(nr_laps,)
+    """
+    nr_laps = number_of_laps(length)
+    return length - 400 * np.arange(nr_laps - 1, -1, -1)
+
+
+def passage_labels(length: int) -> List[str]:
+    """Labels of the passages of the timed laps, for example ["100m", "500m"] for the 500m."""
+    return [f"{distance}m" for distance in lap_distances(length)]
+
+
+class SplitTimes:
+    """Ragged store of the split times of many races. The splits of race i are distances[offsets[i]:offsets[i + 1]]
+     (the passage distance in metres) and times[offsets[i]:offsets[i + 1]] (the time since the previous passage in
+     centiseconds).
+    """
+    def __init__(self, offsets: np.array = None, distances: np.array = None, times: np.array = None):
+        self.offsets = np.zeros(1, dtype=np.int64) if offsets is None else np.asarray(offsets, dtype=np.int64)
+        self.distances = np.zeros(0, dtype=np.int32) if distances is None else np.asarray(distances, dtype=np.int32)
+        self.times = np.zeros(0, dtype=TIME_DTYPE) if times is None else np.asarray(times, dtype=TIME_DTYPE)
+
+    @classmethod
+    def from_laps(cls, lap_times: np.array, length: int) -> "SplitTimes":
+        """Creates the splits of races that were timed per lap. Laps that were not skated (MISSING) are left out.
+
+        :param np.array lap_times: Numpy array with the lap times in centiseconds, shape=(n_races, nr_laps)
+        :param int length: integer indicating the length of the race.
+        :return SplitTimes: the splits of all races
+        """
+        lap_times = np.atleast_2d(lap_times)
+        skated = lap_times != MISSING
+        distances = np.broadcast_to(lap_distances(length), lap_times.shape)
+        offsets = np.concatenate(([0], np.cumsum(skated.sum(axis=1))))
+        return cls(offsets, distances[skated], lap_times[skated])
+
+    @classmethod
+    def concatenate(cls, splits: List["SplitTimes"]) -> "SplitTimes":
+        """Combines the splits of several stores into one store."""
+        starts = np.cumsum([0] + [s.offsets[-1] for s in splits[:-1]])
+        offsets = np.concatenate([[0]] + [s.offsets[1:] + start for s, start in zip(splits, starts)])
+        return cls(offsets, np.concatenate([s.distances for s in splits]), np.concatenate([s.times for s in splits]))
+
+    def __len__(self) -> int:
+        return self.offsets.shape[0] - 1
+
+    def __getitem__(self, i: int) -> Tuple[np.array, np.array]:
+        return self.distances[self.offsets[i]:self.offsets[i + 1]], self.times[self.offsets[i]:self.offsets[i + 1]]
+
+    def append(self, distances: np.array, times: np.array):
+        """Adds the splits of a single race."""
+        self.offsets = np.append(self.offsets, self.offsets[-1] + len(distances))
+        self.distances = np.concatenate((self.distances, np.asarray(distances, dtype=np.int32)))
+        self.times = np.concatenate((self.times, np.asarray(times, dtype=TIME_DTYPE)))
+
+    def take(self, index: np.array) -> "SplitTimes":
+        """Selects a subset of the races, in the given order."""
+        index = np.asarray(index, dtype=np.int64)
+        counts = np.diff(self.offsets)[index]
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        # Position of every selected split in the flat arrays
+        flat = np.repeat(self.offsets[index] - offsets[:-1], counts) + np.arange(offsets[-1])
+        return SplitTimes(offsets, self.distances[flat], self.times[flat])
+
+    def race_index(self) -> np.array:
+        """Gives the race of every split in the flat arrays."""
+        return np.repeat(np.arange(len(self)), np.diff(self.offsets))
+
+    def to_laps(self, length: int) -> np.array:
+        """Adds up the splits within every timed lap. A lap is only filled in when the passage at its end was timed,
+         otherwise it is MISSING (not skated).
+
+        :param int length: integer indicating the length of the race.
+        :return np.array: Numpy array with the lap times in centiseconds, shape=(n_races, nr_laps)
+        """
+        passages = lap_distances(length)
+        nr_laps = passages.shape[0]
+        races = self.race_index()
+        laps = np.minimum(np.searchsorted(passages, self.distances, side="left"), nr_laps - 1)
+
+        lap_times = np.bincount(races * nr_laps + laps, weights=self.times, minlength=len(self) * nr_laps)
+        lap_times = lap_times.reshape(len(self), nr_laps)
+
+        complete = np.zeros((len(self), nr_laps), dtype=bool)
+        ends = passages[laps] == self.distances
+        complete[races[ends], laps[ends]] = True
+        return np.where(complete, np.rint(lap_times), MISSING).astype(TIME_DTYPE)
+
+    def passage_times(self, distances: List[int], length: int) -> np.array:
+        """Gives the time since the start at the given passages of every race, for example the 100m passage of the
+         1000m, which falls within the opener. A passage is MISSING when it was not timed or when a lap before it was
+         not skated, so that the splits before it do not add up to the time since the start.
+
+        :param List[int] distances: the passage distances in metres.
+        :param int length: integer indicating the length of the race.
+        :return np.array: Numpy array with the passage times in centiseconds, shape=(n_races, len(distances))
+        """
+        distances = np.asarray(distances, dtype=np.int32)
+        passages = lap_distances(length)
+        races = self.race_index()
+        counts = np.diff(self.offsets)
+        elapsed = np.cumsum(self.times, dtype=np.int64)
+        elapsed -= np.repeat(np.concatenate(([0], elapsed))[self.offsets[:-1]], counts)
+
+        # The number of laps from the start that were skated without a gap
+        skated = np.cumprod(self.to_laps(length) != MISSING, axis=1).sum(axis=1)
+        laps = np.searchsorted(passages, self.distances, side="left")
+        continuous = laps <= skated[races]
+
+        times = np.full((len(self), distances.shape[0]), MISSING, dtype=TIME_DTYPE)
+        for j, distance in enumerate(distances):
+            at = (self.distances == distance) & continuous
+            times[races[at], j] = elapsed[at]
+        return times
+
+
+def splits_path(fname: str) -> str:
+    """Gives the path of the file with the splits that belongs to a results file."""
+    return fname[:-len("_data.csv")] + "_splits.npz" if fname.endswith("_data.csv") else fname + ".splits.npz"
+
+
+def save_splits(fname: str, splits: SplitTimes, names: List[str]):
+    """Saves the splits of all results in a results file, in the same order as the results. The names are saved with
+     them, so that splits that do not belong to the results any more can be recognised.
+
+    :param str fname: path of the results file.
+    :param SplitTimes splits: the splits of every result.
+    :param List[str] names: List of strings with the names of the athletes of every result.
+    """
+    np.savez(splits_path(fname), offsets=splits.offsets, distances=splits.distances, times=splits.times,
+             names=np.array(names, dtype=str))
+
+
+def load_splits(fname: str, results: np.array, length: int, names: Optional[List[str]] = None) -> SplitTimes:
+    """Loads the splits of the results in a results file. The saved splits of a result are only used when they add up
+     to its lap times and were saved for the same athlete, so the splits of a results file that was written again
+     are never matched to other results. All other results get the splits of their lap times.
+
+    :param str fname: path of the results file.
+    :param np.array results: Numpy array with the lap times in the results file in centiseconds,
+     shape=(n_athletes, nr_laps)
+
+    :param int length: integer indicating the length of the race.
+    :param (List[str], None) names: List of strings with the names of the athletes of every result. If None, the names
+     are not checked.
+
+    :return SplitTimes: the splits of every result
+    """
+    n_results = results.shape[0]
+    from_laps = SplitTimes.from_laps(results, length)
+    if not os.path.isfile(splits_path(fname)):
+        return from_laps
+
+    with np.load(splits_path(fname)) as data:
+        saved = SplitTimes(data["offsets"], data["distances"], data["times"])
+        saved_names = list(data["names"]) if "names" in data else None
+    n_saved = min(len(saved), n_results)
+    saved = saved.take(np.arange(n_saved))
+
+    valid = np.zeros(n_results, dtype=bool)
+    valid[:n_saved] = np.all(saved.to_laps(length) == results[:n_saved], axis=1)
+    if names is not None and saved_names is not None:
+        valid[:n_saved] &= np.array(saved_names[:n_saved]) == np.array(names[:n_saved], dtype=str)
+    # The saved splits come first in the combined store, the splits of the lap times after them
+    index = np.where(valid, np.arange(n_results), n_saved + np.arange(n_results))
+    return SplitTimes.concatenate([saved, from_laps]).take(index)
+
+
+def refresh_splits(fname: str, names: List[str], results: np.array, length: int):
+    """Writes the splits file of a results file again after the results file was written, keeping only the splits that
+     still belong to the results. Nothing is written if the results file never had splits.
+
+    :param str fname: path of the results file.
+    :param List[str] names: List of strings with the names of the athletes of every result.
+    :param np.array results: Numpy array with the lap times in centiseconds, shape=(n_athletes, nr_laps)
+    :param int length: integer indicating the length of the race.
+    """
+    if os.path.isfile(splits_path(fname)):
+        save_splits(fname, load_splits(fname, results, length, names), names)
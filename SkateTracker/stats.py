@@ -0,0 +1,78 @@
+"""
+Incremental per-lap statistics, used to catch lap times that were entered wrong before they end up in the results
+"""
+import numpy as np
+
+try:
+    from SkateTracker.utils import MISSING, to_seconds
+except ModuleNotFoundError:
+    from utils import MISSING, to_seconds
+
+
+class LapStatistics:
+    """Running mean and variance of every lap of a race, kept with Welford's algorithm. Adding a race and checking a lap
+     time both take constant time, no matter how many races have been seen. The statistics are in seconds.
+    """
+    def __init__(self, nr_laps: int):
+        self.count = np.zeros(nr_laps)
+        self.mean = np.zeros(nr_laps)
+        self.m2 = np.zeros(nr_laps)
+
+    @classmethod
+    def from_results(cls, times: np.array) -> "LapStatistics":
+        """Computes the statistics of a set of results at once. Laps that were not skated (MISSING) are left out.
+
+        :param np.array times: Numpy array with the lap times in centiseconds, shape=(n_athletes, nr_laps)
+        :return LapStatistics: the statistics of the results
+        """
+        stats = cls(times.shape[1])
+        skated = times != MISSING
+        times = to_seconds(times)
+        stats.count = skated.sum(axis=0).astype(np.float64)
+        n = np.maximum(stats.count, 1)
+        stats.mean = np.where(skated, times, 0).sum(axis=0) / n
+        stats.m2 = np.where(skated, (times - stats.mean) ** 2, 0).sum(axis=0)
+        return stats
+
+    def merge(self, other: "LapStatistics"):
+        """Combines the statistics of two sets of results (the parallel version of Welford's algorithm)."""
+        count = self.count + other.count
+        n = np.maximum(count, 1)
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * other.count / n
+        self.m2 = self.m2 + other.m2 + delta ** 2 * self.count * other.count / n
+        self.count = count
+
+    def update(self, times: np.array):
+        """Adds the lap times of a race, one athlete at a time.
+
+        :param np.array times: Numpy array with the lap times of the race in centiseconds, shape=(n_athletes, nr_laps)
+        """
+        for lap_times in np.atleast_2d(times):
+            skated = lap_times != MISSING
+            lap_times = to_seconds(lap_times)
+            self.count = self.count + skated
+            delta = np.where(skated, lap_times - self.mean, 0)
+            self.mean = self.mean + delta / np.maximum(self.count, 1)
+            self.m2 = self.m2 + delta * np.where(skated, lap_times - self.mean, 0)
+
+    def std(self, lap: int) -> float:
+        return np.sqrt(self.m2[lap] / (self.count[lap] - 1)) if self.count[lap] > 1 else np.nan
+
+    def anomalies(self, lap: int, lap_times: np.array, threshold: float = 4.0, min_count: int = 5) -> np.array:
+        """Flags the lap times that are implausible for this lap, compared to all lap times seen so far.
+
+        :param int lap: index of the lap.
+        :param np.array lap_times: Numpy array with the entered lap time of every athlete in centiseconds. Laps that
+         were not skated (MISSING) are never flagged.
+
+        :param float threshold: number of standard deviations a lap time may differ from the mean.
+        :param int min_count: minimum number of seen lap times before anything is flagged.
+        :return np.array: boolean Numpy array, True for every lap time that looks wrong
+        """
+        if self.count[lap] < min_count:
+            return np.zeros(len(lap_times), dtype=bool)
+        # A minimal spread prevents flagging everything when all previous lap times were (almost) the same
+        std = max(self.std(lap), 0.02 * self.mean[lap])
+        lap_times = np.asarray(lap_times)
+        return (lap_times != MISSING) & (np.abs(to_seconds(lap_times) - self.mean[lap]) > threshold * std)
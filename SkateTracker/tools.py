@@ -0,0 +1,265 @@
+"""
+Command line tools to manage the results that are saved by the tracker in the skate_data folder
+"""
+import argparse
+import os
+import sys
+
+from rich import print
+from rich.table import Table
+
+try:
+    from SkateTracker.broadcast import view
+    from SkateTracker.chart import CHART_BACKENDS
+    from SkateTracker.columnar import export_columnar, import_columnar
+    from SkateTracker.export import EXPORT_FORMATS, export_races
+    from SkateTracker.importer import import_results
+    from SkateTracker.merge import merge_files
+    from SkateTracker.render_check import GOLDEN_DIR, check_frames, golden_path
+    from SkateTracker.layout import create_best_table
+    from SkateTracker.schedule import ScheduleError, parse_targets, team_schedules
+    from SkateTracker.splits import passage_labels
+    from SkateTracker.utils import format_clock, format_time, is_valid_race
+except ModuleNotFoundError:
+    from broadcast import view
+    from chart import CHART_BACKENDS
+    from columnar import export_columnar, import_columnar
+    from export import EXPORT_FORMATS, export_races
+    from importer import import_results
+    from merge import merge_files
+    from render_check import GOLDEN_DIR, check_frames, golden_path
+    from layout import create_best_table
+    from schedule import ScheduleError, parse_targets, team_schedules
+    from splits import passage_labels
+    from utils import format_clock, format_time, is_valid_race
+
+
+def import_command(args: argparse.Namespace) -> int:
+    """Imports external result files and prints a summary of what was added."""
+    added, n_duplicates, errors = import_results(args.files, args.tournament, chunk_size=args.chunk_size)
+
+    for (tournament, gender, length), n_added in sorted(added.items()):
+        gender_name = "Men" if gender == "M" else "Women"
+        print(f"{tournament}: {gender_name}'s {length}m, added [green]{n_added}[/green] results")
+    print(f"Skipped [yellow]{n_duplicates}[/yellow] results that were already saved.")
+    for error in errors:
+        print(f"[red]ERROR[/red]: {error}")
+    return 0
+
+
+def merge_command(args: argparse.Namespace) -> int:
+    """Merges result files of the same race and prints the rebuilt leaderboard."""
+    try:
+        fname, best_names, best_times, n_duplicates, moved = merge_files(args.files, output=args.output)
+    except ValueError as error:
+        print(f"[red]{error}[/red]")
+        return 1
+    except OSError as error:
+        print(f"[red]ERROR[/red]: could not read {error.filename}, {error.strerror or error}")
+        return 1
+
+    print(f"Merged {len(args.files)} files into {fname}, removed [yellow]{n_duplicates}[/yellow] duplicates.")
+    if moved:
+        print(f"Moved or copied the merged files to {os.path.dirname(moved[0])}.")
+    if len(best_names) == 3:
+        print(create_best_table(best_names, best_times))
+    return 0
+
+
+def export_command(args: argparse.Namespace) -> int:
+    """Exports the final screens of all races in a results file."""
+    fnames = export_races(args.file, args.output_dir, formats=args.formats, width=args.width, height=args.height,
+                          workers=args.workers, chart=args.chart)
+    print(f"Wrote [green]{len(fnames)}[/green] reports to {args.output_dir}.")
+    return 0
+
+
+def render_check_command(args: argparse.Namespace) -> int:
+    """Renders the golden races, compares them with the golden frames and checks the render time budget."""
+    report, failures = check_frames(args.golden_dir, budget=args.budget / 1000, update=args.update,
+                                    repeat=args.repeat, chart=args.chart)
+
+    slowest = max(elapsed for _, elapsed, _, _ in report)
+    mean = sum(elapsed for _, elapsed, _, _ in report) / len(report)
+    print(f"Rendered {len(report)} frames, mean {1000 * mean:.1f}ms, slowest {1000 * slowest:.1f}ms.")
+    if args.update:
+        print(f"Wrote the golden frames to {golden_path(args.golden_dir or GOLDEN_DIR, args.chart)}.")
+    for failure in failures:
+        print(f"[red]FAILED[/red]: {failure}")
+    return 1 if failures else 0
+
+
+def archive_export_command(args: argparse.Namespace) -> int:
+    """Exports the results files to a single columnar file."""
+    n_rows = export_columnar(args.output, args.files or None)
+    print(f"Wrote [green]{n_rows}[/green] laps to {args.output}.")
+    return 0
+
+
+def archive_import_command(args: argparse.Namespace) -> int:
+    """Imports a columnar file into the skate_data folder."""
+    try:
+        written = import_columnar(args.file, replace=args.replace)
+    except (FileExistsError, ImportError, ValueError) as error:
+        print(f"[red]{error}[/red]")
+        return 1
+    except OSError as error:
+        print(f"[red]ERROR[/red]: could not read {args.file}, {error.strerror or error}")
+        return 1
+
+    for (tournament, gender, length), n_results in sorted(written.items()):
+        gender_name = "Men" if gender == "M" else "Women"
+        print(f"{tournament}: {gender_name}'s {length}m, wrote [green]{n_results}[/green] results")
+    return 0
+
+
+def schedule_command(args: argparse.Namespace) -> int:
+    """Prints the lap schedules that reach the target times, with the passage time after every lap."""
+    if not is_valid_race(args.gender, args.length):
+        print("[red]ERROR[/red]: this combination is not a valid race!")
+        return 1
+    try:
+        schedules = team_schedules(args.gender, args.length, parse_targets(args.targets), k=args.neighbours)
+    except ScheduleError as error:
+        print(f"[red]{error}[/red]")
+        return 1
+
+    gender_name = "Men" if args.gender == "M" else "Women"
+    table = Table(title=f"{gender_name}'s {args.length}m schedules", show_footer=True)
+    table.add_column("Passage", justify="right", no_wrap=True, style="bright_black")
+    for name, schedule in schedules.items():
+        table.add_column(name, justify="center", no_wrap=True, footer=format_clock(schedule.sum()))
+    passages = {name: schedule.cumsum() for name, schedule in schedules.items()}
+    for j, passage in enumerate(passage_labels(args.length)):
+        table.add_row(passage, *[
+            f"{format_time(schedule[j])} ({format_clock(passages[name][j])})" for name, schedule in schedules.items()
+        ])
+    print(table)
+    return 0
+
+
+def view_command(args: argparse.Namespace) -> int:
+    """Follows the races of a broadcasting tracker until it stops."""
+    try:
+        view(args.socket, args.chart)
+    except (ConnectionRefusedError, FileNotFoundError):
+        print(f"[red]ERROR[/red]: no tracker is broadcasting on {args.socket}")
+        return 1
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Tools to manage the results saved by the speed skating race tracker"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = subparsers.add_parser(
+        "import",
+        help="Import external result files (CSV or JSON lines) into the skate_data folder."
+    )
+    import_parser.add_argument("files", nargs="+",
+                               help="The CSV or JSON lines files with the columns athlete, gender, distance and laps.")
+    import_parser.add_argument('--tournament', '-t', type=str, required=True,
+                               help="The tournament used for every record that does not name its own tournament.")
+    import_parser.add_argument('--chunk_size', '-c', type=int, default=10000,
+                               help="The number of races that are read and converted at once.")
+    import_parser.set_defaults(func=import_command)
+
+    merge_parser = subparsers.add_parser(
+        "merge",
+        help="Merge result files of the same race that were recorded on different machines."
+    )
+    merge_parser.add_argument("files", nargs="+",
+                              help="The <tournament>_race_<gender>_<length>m_data.csv files that will be merged.")
+    merge_parser.add_argument('--output', '-o', type=str, default=None,
+                              help="The tournament name of the merged file. By default the first file is replaced.")
+    merge_parser.set_defaults(func=merge_command)
+
+    export_parser = subparsers.add_parser(
+        "export",
+        help="Export the final screen of every race in a results file to HTML, SVG or text reports."
+    )
+    export_parser.add_argument("file", help="The <tournament>_race_<gender>_<length>m_data.csv file to export.")
+    export_parser.add_argument('--output_dir', '-o', type=str, default="skate_reports",
+                               help="The directory in which the reports are written.")
+    export_parser.add_argument('--formats', '-f', nargs="+", choices=EXPORT_FORMATS, default=list(EXPORT_FORMATS),
+                               help="The formats of the reports.")
+    export_parser.add_argument('--width', type=int, default=200, help="The width of the screens in characters.")
+    export_parser.add_argument('--height', type=int, default=50, help="The height of the screens in lines.")
+    export_parser.add_argument('--workers', '-w', type=int, default=None,
+                               help="The number of processes used to render. Defaults to the number of CPUs.")
+    export_parser.add_argument('--chart', '-c', choices=CHART_BACKENDS, default="plotext",
+                               help="The backend that draws the charts.")
+    export_parser.set_defaults(func=export_command)
+
+    archive_export_parser = subparsers.add_parser(
+        "archive-export",
+        help="Export results files to a single columnar file (Arrow, Parquet or npz) with one row per lap."
+    )
+    archive_export_parser.add_argument("output",
+                                       help="The columnar file, ending in .arrow, .feather, .parquet or .npz. "
+                                            "Arrow and Parquet need pyarrow.")
+    archive_export_parser.add_argument("--files", "-f", nargs="+", default=None,
+                                       help="The results files to export. By default all files in skate_data.")
+    archive_export_parser.set_defaults(func=archive_export_command)
+
+    archive_import_parser = subparsers.add_parser(
+        "archive-import",
+        help="Import a columnar file with one row per lap into the skate_data folder."
+    )
+    archive_import_parser.add_argument("file", help="The columnar file, ending in .arrow, .feather, .parquet or .npz.")
+    archive_import_parser.add_argument('--replace', action="store_true",
+                                       help="Overwrite results files that already exist in skate_data.")
+    archive_import_parser.set_defaults(func=archive_import_command)
+
+    render_check_parser = subparsers.add_parser(
+        "render-check",
+        help="Check the race screen against golden frames and a render time budget."
+    )
+    render_check_parser.add_argument('--golden_dir', '-d', type=str, default=None,
+                                     help="The directory with the golden frames. By default the golden frames that "
+                                          "come with the package.")
+    render_check_parser.add_argument('--budget', '-b', type=float, default=100,
+                                     help="The maximum render time of a single frame in milliseconds.")
+    render_check_parser.add_argument('--repeat', '-r', type=int, default=5,
+                                     help="How often every frame is rendered, the fastest render time is checked.")
+    render_check_parser.add_argument('--update', '-u', action="store_true",
+                                     help="Write the current frames as the new golden frames.")
+    render_check_parser.add_argument('--chart', '-c', choices=CHART_BACKENDS, default="plotext",
+                                     help="The backend that draws the charts. Every backend has its own golden "
+                                          "frames.")
+    render_check_parser.set_defaults(func=render_check_command)
+
+    schedule_parser = subparsers.add_parser(
+        "schedule",
+        help="Make the lap schedules that reach target final times, paced like the saved races close to the targets."
+    )
+    schedule_parser.add_argument("targets", nargs="+", metavar="[NAME=]TIME",
+                                 help="The target final times, for example Anna=1:56.40 or 1:58.00.")
+    schedule_parser.add_argument('--gender', '-g', type=str, choices=["M", "F"], required=True,
+                                 help="Indicate if the race is for the Men (M) or the Women (W).")
+    schedule_parser.add_argument('--length', '-l', type=int, choices=[500, 1000, 1500, 3000, 5000, 10000],
+                                 required=True, help="Indicate the length of the race.")
+    schedule_parser.add_argument('--neighbours', '-k', type=int, default=10,
+                                 help="The number of saved races with the closest final times that a schedule is "
+                                      "based on.")
+    schedule_parser.set_defaults(func=schedule_command)
+
+    view_parser = subparsers.add_parser(
+        "view",
+        help="Follow the races of a tracker that was started with --broadcast, read-only."
+    )
+    view_parser.add_argument("socket", help="The Unix domain socket that was given to --broadcast.")
+    view_parser.add_argument('--chart', '-c', choices=CHART_BACKENDS, default="plotext",
+                             help="The backend that draws the charts.")
+    view_parser.set_defaults(func=view_command)
+
+    args = parser.parse_args()
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,6 +1,11 @@
 import os
+import re
+import glob
+import hashlib
 import numpy as np
 
+from math import ceil
+
 from typing import List, Optional
 
 try:
@@ -24,6 +29,163 @@ def ordinal(n: int):
     return "%d%s" % (n, "tsnrhtdd"[(n // 10 % 10 != 1) * (n % 10 < 4) * n % 10::4])
 
 
+VALID_LENGTHS = (500, 1000, 1500, 3000, 5000, 10000)
+
+
+def is_valid_race(gender: str, length: int) -> bool:
+    """Checks if the combination of gender and length is a race that is actually skated.
+
+    :param str gender: string indicating if the race is for Men or Women. Accepted values are ["M", "F"]
+    :param int length: integer indicating the length of the race.
+    :return bool: True if the race exists, False otherwise
+    """
+    if gender not in ("M", "F") or length not in VALID_LENGTHS:
+        return False
+    if gender == "M" and length == 3000:
+        return False
+    if gender == "F" and length == 10000:
+        return False
+    return True
+
+
+def number_of_laps(length: int) -> int:
+    """Gives the number of laps (including the opening part of a lap) that are timed during a race.
+
+    :param int length: integer indicating the length of the race. Accepted values are
+     [500, 1000, 1500, 3000, 5000, 10000]
+
+    :return int: the number of timed laps
+    """
+    return ceil(length / 400)
+
+
+# Lap times are kept as whole centiseconds in int32, in memory and on disk. A lap that is not skated (yet) is MISSING,
+# so a time of zero is never used to mean "not skated".
+TIME_DTYPE = np.int32
+MISSING = -1
+
+
+def to_centiseconds(seconds) -> np.array:
+    """Converts times in seconds to centiseconds. Times that are not positive, like the zeros that older versions
+     used for laps that were not skated, become MISSING.
+
+    :param seconds: float or Numpy array with times in seconds.
+    :return np.array: Numpy array with the times in centiseconds, dtype=TIME_DTYPE
+    """
+    seconds = np.asarray(seconds, dtype=np.float64)
+    valid = np.isfinite(seconds) & (seconds > 0)
+    return np.where(valid, np.rint(np.where(valid, seconds, 0) * 100), MISSING).astype(TIME_DTYPE)
+
+
+def to_seconds(times: np.array) -> np.array:
+    """Converts times in centiseconds to seconds, for computations that need floats. MISSING becomes NaN."""
+    times = np.asarray(times)
+    return np.where(times != MISSING, times / 100, np.nan)
+
+
+def missing_times(shape) -> np.array:
+    """Gives an array of lap times of which no lap is skated yet."""
+    return np.full(shape, MISSING, dtype=TIME_DTYPE)
+
+
+def total_times(times: np.array) -> np.array:
+    """Adds up the skated laps of every result, exactly. Laps that are not skated count as zero.
+
+    :param np.array times: Numpy array with the lap times in centiseconds, shape=(..., nr_laps)
+    :return np.array: Numpy array with the total times in centiseconds, shape=(...)
+    """
+    times = np.asarray(times)
+    return np.where(times != MISSING, times, 0).sum(axis=-1, dtype=np.int64)
+
+
+def format_time(centiseconds: int, sign: bool = False) -> str:
+    """Formats a lap time in centiseconds as seconds, for example 2831 as 28.31, and MISSING as NA.
+
+    :param int centiseconds: the time in centiseconds.
+    :param bool sign: if True, the time is a difference and always gets a sign, for example +0.31.
+    :return str: the formatted time
+    """
+    if centiseconds == MISSING and not sign:
+        return "NA"
+    prefix = ("-" if centiseconds < 0 else "+") if sign else ""
+    seconds, hundredths = divmod(abs(int(centiseconds)), 100)
+    return f"{prefix}{seconds}.{hundredths:02d}"
+
+
+def format_clock(centiseconds: int) -> str:
+    """Formats a total time in centiseconds as minutes and seconds, for example 11421 as 01:54.21, and MISSING as NA."""
+    if centiseconds == MISSING:
+        return "NA"
+    minutes, centiseconds = divmod(int(centiseconds), 6000)
+    return f"{minutes:02d}:{centiseconds // 100:02d}.{centiseconds % 100:02d}"
+
+
+def parse_clock(text: str) -> int:
+    """Parses a total time as minutes and seconds or as seconds, for example 1:54.21 or 114.21, into centiseconds.
+
+    :param str text: the time.
+    :return int: the time in centiseconds
+    """
+    minutes, _, seconds = text.strip().rpartition(":")
+    centiseconds = int(round((int(minutes) * 60 if minutes else 0) * 100 + float(seconds) * 100))
+    if centiseconds <= 0:
+        raise ValueError(f"{text} is not a positive time")
+    return centiseconds
+
+
+def results_path(tournament: str, gender: str, length: int) -> str:
+    """Gives the path of the file in which the results of a race are saved.
+
+    :param str tournament: string with the name of the tournament where the race is being held.
+    :param str gender: string indicating if the race is for Men or Women. Accepted values are ["M", "F"]
+    :param int length: integer indicating the length of the race. Accepted values are
+     [500, 1000, 1500, 3000, 5000, 10000]
+
+    :return str: path of the results file inside the skate_data folder
+    """
+    gender_name = "Men" if gender == "M" else "Women"
+    return os.path.join(os.getcwd(), 'skate_data', f"{tournament}_race_{gender_name}_{length}m_data.csv")
+
+
+def archive_paths(gender: str, length: int) -> List[str]:
+    """Gives the paths of all results files of a gender and length, over all tournaments.
+
+    :param str gender: string indicating if the race is for Men or Women. Accepted values are ["M", "F"]
+    :param int length: integer indicating the length of the race. Accepted values are
+     [500, 1000, 1500, 3000, 5000, 10000]
+
+    :return List[str]: the paths of the results files
+    """
+    gender_name = "Men" if gender == "M" else "Women"
+    return sorted(glob.glob(os.path.join(os.getcwd(), 'skate_data', f"*_race_{gender_name}_{length}m_data.csv")))
+
+
+def parse_results_fname(fname: str) -> (str, str, int):
+    """Inverse of results_path, extracts the race from the name of a results file.
+
+    :param str fname: path of a results file.
+    :return (str, str, int): the tournament, gender and length of the race
+    """
+    match = re.fullmatch(r"(.+)_race_(Men|Women)_(\d+)m_data\.csv", os.path.basename(fname))
+    if match is None:
+        raise ValueError(f"ERROR: {fname} is not a results file of the tracker")
+    tournament, gender_name, length = match.groups()
+    return tournament, "M" if gender_name == "Men" else "F", int(length)
+
+
+def result_key(name: str, lap_times: np.array) -> bytes:
+    """Content hash of a single result. The lap times are whole centiseconds, so a result gives the same key before
+     and after it has been written to a file.
+
+    :param str name: name of the athlete.
+    :param np.array lap_times: Numpy array with the lap times of the athlete in centiseconds.
+    :return bytes: 16 byte digest identifying the result
+    """
+    digest = hashlib.blake2b(name.encode(), digest_size=16)
+    digest.update(np.asarray(lap_times, dtype=np.int64).tobytes())
+    return digest.digest()
+
+
 def update_best_times(names: List[str], times: np.array, best_names: List[str], best_times: np.array) -> np.array:
     """Utility function that takes the new times and best times as input and updates the top 3 best times according
      to the new times.
@@ -34,13 +196,23 @@ def update_best_times(names: List[str], times: np.array, best_names: List[str],
     :param np.array best_times: Numpy array with the best times so far.
     :return np.array: Returns a Numpy array with the new top 3 times, shape=(3, nr_laps)
     """
-    all_names = np.array(names + best_names, dtype=object)
-    all_times = np.vstack((times, best_times))
+    return top_results(list(names) + list(best_names), np.vstack((times, best_times)), k=3)
+
+
+def top_results(names: List[str], times: np.array, k: int = 3) -> (List[str], np.array):
+    """Selects the k fastest results, without sorting all the results. Results that are not skated (all MISSING) are
+     placed last.
 
-    total_times = all_times.sum(axis=1)
-    total_times[total_times == 0] = np.infty
-    total_times_sorted = total_times.argsort()
-    return list(all_names[total_times_sorted[:3]]), all_times[total_times_sorted[:3]]
+    :param List[str] names: List of strings with the names of the athletes.
+    :param np.array times: Numpy array with the lap times, shape=(n_athletes, nr_laps)
+    :param int k: the number of results to select
+    :return (List[str], np.array): the names and lap times of the k best results, fastest first
+    """
+    totals = np.where(np.any(times != MISSING, axis=1), total_times(times), np.iinfo(np.int64).max)
+    k = min(k, len(names))
+    best = np.argpartition(totals, k - 1)[:k] if k < len(names) else np.arange(len(names))
+    best = best[totals[best].argsort(kind="stable")]
+    return [names[i] for i in best], times[best]
 
 
 def check_saved(tournament: str, gender: str, length: int) -> str:
@@ -53,9 +225,7 @@ def check_saved(tournament: str, gender: str, length: int) -> str:
 
     :return str: Return a string ("y", "n", "no file") Indicating if a file was found if it is going to be used
     """
-    gender_name = "Men" if gender == "M" else "Women"
-
-    if os.path.isfile(os.path.join(os.getcwd(), 'skate_data', f"{tournament}_race_{gender_name}_{length}m_data.csv")):
+    if os.path.isfile(results_path(tournament, gender, length)):
         correct = False
         while not correct:
             use = input("Data for this race was already found. Do you want to use it? [y/n]")
@@ -68,7 +238,13 @@ def check_saved(tournament: str, gender: str, length: int) -> str:
     return use
 
 
-def save_results(tournament: str, gender: str, length: int, names: List[str], times: np.array):
+def save_results(
+        tournament: str,
+        gender: str,
+        length: int,
+        names: List[str],
+        times: np.array,
+        race_ids: Optional[np.array] = None):
     """Saves the current names and times.
 
     :param str tournament: string with the name of the tournament where the race is being held.
@@ -77,22 +253,46 @@ def save_results(tournament: str, gender: str, length: int, names: List[str], ti
      [500, 1000, 1500, 3000, 5000, 10000]
 
     :param List[str] names: List of strings with the names of the athletes.
-    :param np.array times: Numpy array with the times so far.
+    :param np.array times: Numpy array with the lap times so far in centiseconds, shape=(nr_laps, n_athletes)
+    :param (np.array, None) race_ids: the race of every athlete. If given, it is saved next to the results, so that
+     the results can be grouped per race again.
+
     :return None:
     """
     if not os.path.isdir(os.path.join(os.getcwd(), 'skate_data')):
         os.mkdir(os.path.join(os.getcwd(), 'skate_data'))
 
-    gender_name = "Men" if gender == "M" else "Women"
-
     np.savetxt(
-        os.path.join(os.getcwd(), 'skate_data', f"{tournament}_race_{gender_name}_{length}m_data.csv"),
+        results_path(tournament, gender, length),
         times,
         header=",".join(names),
         delimiter=",",
         comments="",
-        fmt="%1.2f"
+        fmt="%d"
     )
+    if race_ids is not None:
+        np.savetxt(race_ids_path(results_path(tournament, gender, length)), np.asarray(race_ids)[None, :],
+                   delimiter=",", fmt="%d")
+
+
+def race_ids_path(fname: str) -> str:
+    """Gives the path of the file with the race ids that belongs to a results file."""
+    return fname[:-len("_data.csv")] + "_races.csv" if fname.endswith("_data.csv") else fname + ".races"
+
+
+def load_race_ids(fname: str, n_results: int) -> np.array:
+    """Loads which results belong to the same race. Results that were saved without a race id (for example by an
+     older version of the tracker) are each treated as a race of their own.
+
+    :param str fname: path of the results file.
+    :param int n_results: the number of results in the results file.
+    :return np.array: Numpy array with the race id of every result, shape=(n_results,)
+    """
+    race_ids = np.zeros(0, dtype=np.int64)
+    if os.path.isfile(race_ids_path(fname)):
+        race_ids = np.loadtxt(race_ids_path(fname), delimiter=",", dtype=np.int64, ndmin=1)[:n_results]
+    start = race_ids.max() + 1 if race_ids.shape[0] > 0 else 0
+    return np.concatenate((race_ids, np.arange(start, start + n_results - race_ids.shape[0])))
 
 
 def load_results(
@@ -109,20 +309,22 @@ def load_results(
      [500, 1000, 1500, 3000, 5000, 10000]
 
     :return (List[str], np.array): Returns the names of all the athletes aas a list and all the results as a Numpy array
+     of lap times in centiseconds, shape=(n_athletes, nr_laps)
     """
-    if fname is not None:
-        with open(fname) as f:
-            names = f.readline().rstrip().split(",")
-        results = np.loadtxt(fname, delimiter=",", skiprows=1)
-    else:
+    if fname is None:
         if gender is not None and length is not None:
-            gender_name = "Men" if gender == "M" else "Women"
-            fname = os.path.join(os.getcwd(), 'skate_data', f"{tournament}_race_{gender_name}_{length}m_data.csv")
-            with open(fname) as f:
-                names = f.readline().rstrip().split(",")
-            results = np.loadtxt(fname, delimiter=",", skiprows=1)
+            fname = results_path(tournament, gender, length)
         else:
             raise ValueError("ERROR: Please insert a valid gender or length")
+
+    with open(fname) as f:
+        names = f.readline().rstrip().split(",")
+        first_row = f.readline()
+    if "." in first_row:
+        # Older versions saved the lap times in seconds, with zeros for the laps that were not skated
+        results = to_centiseconds(np.loadtxt(fname, delimiter=",", skiprows=1, ndmin=2))
+    else:
+        results = np.loadtxt(fname, delimiter=",", skiprows=1, ndmin=2, dtype=TIME_DTYPE)
     return names, results.T
 
 
@@ -0,0 +1,211 @@
+"""
+Watching the results files that other trackers save in the same skate_data folder, to keep a combined leaderboard.
+Changes are noticed with inotify on Linux and by polling the modification times elsewhere.
+"""
+import ctypes
+import ctypes.util
+import os
+import struct
+
+import numpy as np
+
+from typing import Collection, Dict, List, Optional, Set, Tuple
+
+try:
+    from SkateTracker.utils import missing_times, number_of_laps, results_path, to_centiseconds, top_results, TIME_DTYPE
+except ModuleNotFoundError:
+    from utils import missing_times, number_of_laps, results_path, to_centiseconds, top_results, TIME_DTYPE
+
+# inotify(7) event masks
+IN_CLOSE_WRITE = 0x08
+IN_MOVED_TO = 0x80
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class PollingWatcher:
+    """Notices changed files by comparing their modification time and size with the previous check."""
+    def __init__(self, directory: str, names: Collection[str]):
+        self.directory = directory
+        self.names = set(names)
+        self.stats = {}
+
+    def changes(self) -> Set[str]:
+        """Gives the names of the files that changed since the previous call, without waiting."""
+        changed = set()
+        for name in self.names:
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            if self.stats.get(name) != (stat.st_mtime_ns, stat.st_size):
+                self.stats[name] = (stat.st_mtime_ns, stat.st_size)
+                changed.add(name)
+        return changed
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """Notices changed files with inotify, through ctypes. Files are reported once they are closed after writing, so
+     a file is never read while another tracker is still writing it.
+    """
+    def __init__(self, directory: str, names: Collection[str]):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.names = set(names)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"inotify_add_watch failed for {directory}")
+
+    def changes(self) -> Set[str]:
+        """Gives the names of the files that changed since the previous call, without waiting."""
+        changed = set()
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset < len(data):
+                _, _, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+                offset += length
+                if name in self.names:
+                    changed.add(name)
+
+    def close(self):
+        os.close(self.fd)
+
+
+def directory_watcher(directory: str, names: Collection[str]):
+    """Gives an inotify watcher of the files with the given names in a directory where inotify is available, and a
+     polling watcher otherwise.
+    """
+    try:
+        return InotifyWatcher(directory, names)
+    except (AttributeError, OSError, TypeError):
+        return PollingWatcher(directory, names)
+
+
+def read_new_results(fname: str, n_known: int, nr_laps: int) -> Optional[Tuple[List[str], np.array]]:
+    """Reads the results that were added to a results file after the first n_known results. A results file has a
+     column per result, so new results are appended to the end of every line. Only those last columns are split off
+     and converted, the results that were already known are never parsed again.
+
+    :param str fname: path of the results file.
+    :param int n_known: the number of results that were read before.
+    :param int nr_laps: the number of laps of the race, which is the number of rows of a complete file.
+    :return (List[str], np.array), None: the names and lap times of the new results, shape=(n_new, nr_laps), or None
+     if the file is incomplete, for example because it is being written, or has fewer than n_known results
+    """
+    with open(fname) as f:
+        header = f.readline().rstrip("\n").split(",")
+        n_new = len(header) - n_known
+        if n_new < 0:
+            return None
+        rows = []
+        for line in f:
+            line = line.rstrip("\n")
+            if not line:
+                continue
+            if line.count(",") != len(header) - 1:
+                return None
+            rows.append(line.rsplit(",", n_new)[1:] if n_new < len(header) else line.split(","))
+    if len(rows) != nr_laps:
+        # Not all lap rows were written yet
+        return None
+    if n_new == 0:
+        return [], missing_times((0, len(rows)))
+
+    values = np.array(rows)
+    if any("." in value for value in values[0]):
+        # Older versions saved the lap times in seconds
+        times = to_centiseconds(values.astype(np.float64))
+    else:
+        times = values.astype(TIME_DTYPE)
+    return header[n_known:], times.T
+
+
+class ResultsWatcher:
+    """Combined leaderboard of the results files of a race that are saved by other trackers. Every results file is
+     read in full once, after that only the results that are added to it are read.
+    """
+    def __init__(self, tournament: str, others: List[str], gender: str, length: int, k: int = 3):
+        """Initialize and read the results files of the other trackers that exist
+
+        :param str tournament: the tournament of this tracker, its own results file is not watched.
+        :param List[str] others: the tournament names of the other trackers. Only their results files are watched,
+         so the results of earlier tournaments in the skate_data folder are not added to the leaderboard.
+
+        :param str gender: string indicating if the race is for Men or Women. Accepted values are ["M", "F"]
+        :param int length: integer indicating the length of the race.
+        :param int k: the number of results on the leaderboard.
+        """
+        self.directory = os.path.join(os.getcwd(), "skate_data")
+        os.makedirs(self.directory, exist_ok=True)
+        own_file = os.path.basename(results_path(tournament, gender, length))
+        names = {os.path.basename(results_path(other, gender, length)) for other in others} - {own_file}
+        self.nr_laps = number_of_laps(length)
+        self.k = k
+        # Per file the number of results that were read and the top k of the file
+        self.files: Dict[str, Tuple[int, List[str], np.array]] = {}
+        self.best_names = []
+        self.best_times = None
+
+        self.watcher = directory_watcher(self.directory, names)
+        self.dirty = {name for name in names if os.path.isfile(os.path.join(self.directory, name))}
+        self.watcher.changes()
+        self.poll()
+
+    def _read(self, name: str) -> bool:
+        n_known, best_names, best_times = self.files.get(name, (0, [], None))
+        fname = os.path.join(self.directory, name)
+        try:
+            new = read_new_results(fname, n_known, self.nr_laps)
+            if new is None and n_known > 0:
+                # The file may have been replaced by fewer results, for example by a merge, so it is read in full
+                new = read_new_results(fname, 0, self.nr_laps)
+                if new is not None:
+                    n_known, best_names, best_times = 0, [], None
+            if new is None:
+                return False
+            names, times = new
+            if names:
+                if best_times is not None:
+                    names, times = names + best_names, np.vstack((times, best_times))
+                best_names, best_times = top_results(names, times, self.k)
+        except FileNotFoundError:
+            self.files.pop(name, None)
+            return True
+        except ValueError:
+            return False
+
+        # The file only counts as read once all of it was converted
+        self.files[name] = (n_known + len(new[0]), best_names, best_times)
+        return True
+
+    def poll(self) -> bool:
+        """Reads the results that were added since the previous call, without waiting.
+
+        :return bool: True if the leaderboard changed
+        """
+        self.dirty |= self.watcher.changes()
+        if not self.dirty:
+            return False
+
+        # Files that can not be read yet stay dirty and are tried again at the next poll
+        self.dirty = {name for name in self.dirty if not self._read(name)}
+        files = [(names, times) for _, names, times in self.files.values() if times is not None]
+        if files:
+            self.best_names, self.best_times = top_results(
+                [name for names, _ in files for name in names], np.vstack([times for _, times in files]), self.k
+            )
+        return True
+
+    def close(self):
+        self.watcher.close()
@@ -18,15 +18,22 @@ setup(
     packages=[
         "SkateTracker"
     ],
+    package_data={
+        "SkateTracker": ["golden_frames/*.json.gz"]
+    },
     python_requires=">=3.5",
     install_requires=[
         "numpy>=1.18.4",
         "plotext>=4.0.0",
         "rich>=11.0.0"
     ],
+    extras_require={
+        "arrow": ["pyarrow>=7.0.0"]
+    },
     entry_points={
         "console_scripts": [
-            "SkateTracker = SkateTracker.main:main"
+            "SkateTracker = SkateTracker.main:main",
+            "SkateTrackerTools = SkateTracker.tools:main"
         ]
     }
 )